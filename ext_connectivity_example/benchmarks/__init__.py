@@ -0,0 +1,5 @@
+"""
+Benchmarks for the example application. Run them from the ext_connectivity_example directory, e.g.:
+
+    python -m benchmarks.bench_http_pool
+"""
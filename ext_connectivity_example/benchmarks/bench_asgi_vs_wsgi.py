@@ -0,0 +1,140 @@
+"""
+Load test comparing chat start throughput of the app served with a threaded WSGI server
+and with uvicorn (ASGI, async views) while fake Giosg service responds slowly. Chats are started
+for an existing visitor. Message sends are not used as they only store the message to the outbox.
+
+    python -m benchmarks.bench_asgi_vs_wsgi --requests 2000 --concurrency 200 --latency 0.25
+
+With WSGI every in-flight Giosg call holds one of the worker threads, so throughput is capped at
+roughly threads / latency. The ASGI app waits for Giosg on the event loop instead.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.utils import summarize
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def run_server(command, port, env=None):
+    """
+    Runs server in a separate process, so that it does not compete with the load generator for the GIL
+    """
+    process = subprocess.Popen(command + ["--port", str(port)], stdout=subprocess.DEVNULL, env=env)
+    try:
+        wait_for_port(port)
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with contextlib.suppress(OSError), socket.create_connection(("127.0.0.1", port), timeout=1):
+            return
+        time.sleep(0.1)
+    raise RuntimeError(f"Server did not start listening on port {port}")
+
+
+def prepare_database():
+    """
+    Creates benchmark database with one visitor for whom chats are started
+    """
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("migrate", verbosity=0)
+
+    from chat_app.models import Visitor
+    from giosg_api import api
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        giosg_visitor = api.create_giosg_visitor(settings.GIOSG_ORGANIZATION_ID, settings.GIOSG_ROOM_ID)
+    return Visitor.objects.create(
+        giosg_visitor_id=giosg_visitor["visitor_id"],
+        giosg_visitor_secret_id=giosg_visitor["visitor_secret_id"],
+        visitor_name="Benchmark visitor",
+    )
+
+
+async def generate_load(url, payload, total_requests, concurrency):
+    latencies = []
+    errors = 0
+    remaining = iter(range(total_requests))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    transport = httpx.AsyncHTTPTransport(limits=limits, socket_options=[(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)])
+    async with httpx.AsyncClient(transport=transport, timeout=60) as client:
+        async def worker():
+            nonlocal errors
+            for _ in remaining:
+                started = time.perf_counter()
+                try:
+                    response = await client.post(url, json=payload)
+                    if response.status_code != 201:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return dict(summarize(latencies), errors=errors, requests_per_second=round(total_requests / elapsed, 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.25, help="Latency added by fake Giosg in seconds")
+    parser.add_argument("--wsgi-threads", type=int, default=8)
+    args = parser.parse_args()
+
+    results = {}
+    giosg_command = [sys.executable, "-m", "benchmarks.fake_giosg", "--latency", str(args.latency)]
+    with tempfile.TemporaryDirectory() as tmp_dir, run_server(giosg_command, free_port()) as giosg_url:
+        os.environ.update(
+            DJANGO_SETTINGS_MODULE="benchmarks.settings",
+            BENCHMARK_DB_NAME=os.path.join(tmp_dir, "db.sqlite3"),
+            BENCHMARK_GIOSG_URL=giosg_url,
+        )
+        visitor = prepare_database()
+
+        servers = {
+            "wsgi": [sys.executable, "-m", "benchmarks.wsgi_server", "--threads", str(args.wsgi_threads)],
+            "asgi": [sys.executable, "-m", "uvicorn", "ext_connectivity_example.asgi:application",
+                     "--log-level", "warning", "--no-access-log"],
+        }
+        for name, command in servers.items():
+            with run_server(command, free_port()) as app_url:
+                payload = {"visitor_name": visitor.visitor_name}
+                results[name] = asyncio.run(generate_load(f"{app_url}/api/chats/", payload, args.requests,
+                                                          args.concurrency))
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Measures loading chat history from a fake Giosg service and exporting it as newline-delimited JSON.
+
+    python -m benchmarks.bench_backfill --chats 1000 --messages-per-chat 100 --latency 0.01
+
+Backfill is run with messages of one chat fetched at a time and with "--concurrency" chats at a time.
+Export writes everything to /dev/null. Peak memory allocated while it runs should stay the same
+when the amount of history grows.
+"""
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+from benchmarks.fake_giosg import FakeGiosgServer
+from benchmarks.utils import setup_test_database
+
+
+def run_backfill(concurrency, page_size):
+    from django.core.cache import cache
+
+    from chat_app import caching, history
+    from chat_app.models import ChatConversation
+
+    ChatConversation.objects.all().delete()
+    # Visitors of chats would otherwise be known from the previous run
+    cache.clear()
+    caching.chat_ids.reset()
+    started = time.perf_counter()
+    counts = history.backfill("benchmark-org", page_size=page_size, concurrency=concurrency)
+    duration = time.perf_counter() - started
+    return dict(counts, duration_s=round(duration, 3), messages_per_second=round(counts["messages"] / duration, 1))
+
+
+def run_export():
+    from chat_app import history
+
+    started = time.perf_counter()
+    with open(os.devnull, "w") as stream:
+        counts = history.export(stream)
+    duration = time.perf_counter() - started
+    # Tracing slows the export down, so memory is measured on a separate run
+    tracemalloc.start()
+    with open(os.devnull, "w") as stream:
+        history.export(stream)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rows = sum(counts.values())
+    return dict(counts, duration_s=round(duration, 3), rows_per_second=round(rows / duration, 1),
+                peak_memory_kb=round(peak / 1024, 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=1000)
+    parser.add_argument("--messages-per-chat", type=int, default=100)
+    parser.add_argument("--visitors", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.01, help="Latency added by fake Giosg in seconds")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--page-size", type=int, default=100)
+    args = parser.parse_args()
+
+    setup_test_database()
+    from django.test import override_settings
+
+    from chat_app.models import Visitor
+
+    visitor_ids = [f"benchmark-visitor-{i}" for i in range(args.visitors)]
+    Visitor.objects.bulk_create([
+        Visitor(giosg_visitor_id=visitor_id, giosg_visitor_secret_id="secret", visitor_name=visitor_id)
+        for visitor_id in visitor_ids
+    ])
+
+    results = {}
+    with FakeGiosgServer(latency=args.latency) as server:
+        server.state.add_history("benchmark-org", visitor_ids, args.chats, args.messages_per_chat)
+        with override_settings(GIOSG_API_BASE_URL=server.url):
+            for concurrency in (1, args.concurrency):
+                results[f"backfill_concurrency_{concurrency}"] = run_backfill(concurrency, args.page_size)
+    results["export"] = run_export()
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
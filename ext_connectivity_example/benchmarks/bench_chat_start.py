@@ -0,0 +1,72 @@
+"""
+Measures chat start latency (POST /api/chats/) for new and existing visitors with independent
+Giosg calls run concurrently and one after another. "pooled_visitor" is a new visitor who gets
+a visitor created ahead of time from the visitor pool (see chat_app/visitor_pool.py).
+
+    python -m benchmarks.bench_chat_start --iterations 50 --latency 0.05
+"""
+import argparse
+import contextlib
+import io
+import json
+import time
+
+from benchmarks.fake_giosg import FakeGiosgServer
+from benchmarks.utils import setup_test_database, summarize
+
+
+def run(iterations):
+    from django.conf import settings
+    from django.core.cache import cache
+    from django.test import Client
+
+    from chat_app import visitor_pool
+    from giosg_api import token_cache
+
+    client = Client()
+    timings = {"new_visitor": [], "pooled_visitor": [], "existing_visitor": [], "existing_visitor_token_expired": []}
+
+    def start_chat(scenario, visitor_name):
+        started = time.perf_counter()
+        response = client.post("/api/chats/", {"visitor_name": visitor_name}, content_type="application/json")
+        timings[scenario].append(time.perf_counter() - started)
+        assert response.status_code == 201, response.content
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(iterations):
+            visitor_name = f"visitor {time.time()} {i}"
+            start_chat("new_visitor", visitor_name)
+            visitor_pool.refill(settings.GIOSG_ORGANIZATION_ID, settings.GIOSG_ROOM_ID)
+            start_chat("pooled_visitor", f"pooled {visitor_name}")
+            start_chat("existing_visitor", visitor_name)
+            cache.clear()
+            token_cache.reset()
+            start_chat("existing_visitor_token_expired", visitor_name)
+    return {scenario: summarize(samples) for scenario, samples in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05, help="Latency added by fake Giosg in seconds")
+    args = parser.parse_args()
+
+    setup_test_database()
+    from django.test import override_settings
+
+    results = {}
+    with FakeGiosgServer(latency=args.latency) as server:
+        for mode, max_workers in (("concurrent", 32), ("sequential", 1)):
+            # Pool has one visitor at a time, so that new visitors do not get visitors pooled for others
+            with override_settings(
+                GIOSG_API_BASE_URL=server.url,
+                GIOSG_TASK_GRAPH_MAX_WORKERS=max_workers,
+                GIOSG_VISITOR_POOL={"low_watermark": 1, "high_watermark": 1},
+            ):
+                results[mode] = run(args.iterations)
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Measures message webhook throughput when many webhooks are written to the database at the same time.
+
+    python -m benchmarks.bench_db_writers --threads 16 --webhooks 4000
+    DJANGO_DB_PROFILE=postgres POSTGRES_DB=benchmark python -m benchmarks.bench_db_writers --backends postgres
+
+The app is served by benchmarks.wsgi_server with as many threads as there are writer threads, and each
+writer thread POSTs webhooks of distinct messages. Every webhook inserts its deduplication key and the
+queued event. Backends:
+
+    sqlite-default  SQLite without the pragmas of settings.SQLITE_PRAGMAS (rollback journal)
+    sqlite-wal      SQLite with settings.SQLITE_PRAGMAS (WAL mode)
+    postgres        PostgreSQL with the pooled backend, configured with the POSTGRES_* environment variables.
+                    The database must exist, it is migrated before the run.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import httpx
+
+from benchmarks.bench_asgi_vs_wsgi import free_port, run_server
+from benchmarks.utils import summarize
+
+BACKENDS = {
+    "sqlite-default": {"DJANGO_DB_PROFILE": "sqlite", "BENCHMARK_SQLITE_PRAGMAS": "off"},
+    "sqlite-wal": {"DJANGO_DB_PROFILE": "sqlite", "BENCHMARK_SQLITE_PRAGMAS": "on"},
+    "postgres": {"DJANGO_DB_PROFILE": "postgres"},
+}
+
+
+def webhook(run_id, number):
+    return {
+        "action": "added",
+        "resource_id": f"{run_id}-{number}",
+        "channel": f"/api/v5/orgs/benchmark-org/owned_chats/chat-{number % 50}/messages",
+        "resource": {
+            "type": "msg",
+            "chat_id": f"chat-{number % 50}",
+            "sender_type": "visitor",
+            "sender_id": "benchmark-visitor",
+            "sender_name": None,
+            "message": f"Message {number}",
+        },
+    }
+
+
+def generate_load(url, webhook_count, thread_count):
+    run_id = uuid.uuid4().hex
+    numbers = iter(range(webhook_count))
+    numbers_lock = threading.Lock()
+    latencies = []
+    errors = []
+
+    def writer():
+        with httpx.Client(timeout=60) as client:
+            while True:
+                with numbers_lock:
+                    number = next(numbers, None)
+                if number is None:
+                    return
+                started = time.perf_counter()
+                try:
+                    response = client.post(url, json=webhook(run_id, number))
+                    if response.status_code != 204:
+                        errors.append(response.status_code)
+                except httpx.HTTPError as ex:
+                    errors.append(repr(ex))
+                latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=writer) for _ in range(thread_count)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return dict(
+        summarize(latencies),
+        errors=len(errors),
+        webhooks_per_second=round(webhook_count / elapsed, 1),
+    )
+
+
+def run_backend(name, webhook_count, thread_count, tmp_dir):
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE="benchmarks.settings", **BACKENDS[name])
+    env["BENCHMARK_DB_NAME"] = os.path.join(tmp_dir, f"{name}.sqlite3")
+    subprocess.run([sys.executable, "manage.py", "migrate", "--verbosity", "0"], env=env, check=True)
+
+    command = [sys.executable, "-m", "benchmarks.wsgi_server", "--threads", str(thread_count)]
+    with run_server(command, free_port(), env) as app_url:
+        return generate_load(f"{app_url}/giosg_webhooks/messages", webhook_count, thread_count)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16, help="Number of concurrent writers")
+    parser.add_argument("--webhooks", type=int, default=4000)
+    parser.add_argument("--backends", default="sqlite-default,sqlite-wal",
+                        help=f"Comma separated list of: {', '.join(BACKENDS)}")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in args.backends.split(","):
+            results[name] = run_backend(name, args.webhooks, args.threads, tmp_dir)
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
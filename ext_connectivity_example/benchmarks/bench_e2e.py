@@ -0,0 +1,229 @@
+"""
+End-to-end benchmark of the main flows of the app against the fake Giosg service.
+
+    python -m benchmarks.bench_e2e --latency 0.02 --output results.json
+    python -m benchmarks.bench_e2e --latency 0.02 --compare results.json
+
+Requests go through the whole Django stack (middleware, URL routing, views, database) with the test client.
+Scenarios run one after another:
+
+    chat_start_new_visitor       POST /api/chats/ with a new visitor name
+    chat_start_existing_visitor  POST /api/chats/ with a known visitor name
+    message_send                 POST /api/chats/<id>/messages/, which only stores the message to the outbox
+    outbox_delivery              deliver_batch() of 100 messages until the outbox is empty
+    message_poll                 GET /api/chats/<id>/messages/ with the ETag of the previous poll as If-None-Match
+    webhook_burst                POST /giosg_webhooks/messages/batch with "--burst-size" webhooks per request
+    webhook_processing           process_batch() of 100 webhooks until the queue of the burst is empty
+
+For every scenario the latency percentiles, operations per second and the number of database queries per
+operation are reported. With --compare the relative change of each of them from an earlier --output file
+is reported as well, so that regressions can be spotted between commits.
+"""
+import argparse
+import contextlib
+import json
+import subprocess
+import time
+import uuid
+
+from benchmarks.fake_giosg import FakeGiosgServer
+from benchmarks.utils import setup_test_database, summarize
+
+# Metrics compared with --compare and whether a bigger value is better
+COMPARED_METRICS = {
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+    "operations_per_second": True,
+    "queries_mean": False,
+}
+
+
+class Scenario:
+    """
+    Collects latency and query count of each operation of one scenario
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.query_counts = []
+        self.operations = 0
+        self.duration = 0.0
+
+    @contextlib.contextmanager
+    def measure(self, operations=1):
+        """
+        Measures one sample. The number of operations done can be changed by setting "operations"
+        of the yielded dict, samples with no operations are discarded.
+        """
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        sample = {"operations": operations}
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            yield sample
+            duration = time.perf_counter() - started
+        if not sample["operations"]:
+            return
+        self.latencies.append(duration)
+        self.query_counts.append(len(queries))
+        self.operations += sample["operations"]
+        self.duration += duration
+
+    def result(self):
+        return dict(
+            summarize(self.latencies),
+            operations=self.operations,
+            operations_per_second=round(self.operations / self.duration, 1) if self.duration else None,
+            queries_mean=round(sum(self.query_counts) / len(self.query_counts), 2) if self.query_counts else None,
+            queries_max=max(self.query_counts, default=None),
+        )
+
+
+def message_webhook(chat_id, message_id):
+    return {
+        "action": "added",
+        "resource_id": message_id,
+        "channel": f"/api/v5/orgs/benchmark-org/owned_chats/{chat_id}/messages",
+        "resource": {
+            "id": message_id,
+            "type": "msg",
+            "chat_id": chat_id,
+            "sender_type": "user",
+            "sender_id": "benchmark-user",
+            "sender_name": "Operator",
+            "message": "Hello from the operator",
+        },
+    }
+
+
+def run(args):
+    from django.test import Client
+
+    from chat_app.models import ChatConversation
+    from chat_app.outbox import deliver_batch
+    from giosg_webhooks.queue import process_batch
+
+    client = Client()
+    scenarios = {name: Scenario(name) for name in (
+        "chat_start_new_visitor", "chat_start_existing_visitor", "message_send", "outbox_delivery", "message_poll",
+        "webhook_burst", "webhook_processing",
+    )}
+
+    def start_chat(scenario, visitor_name):
+        with scenarios[scenario].measure():
+            response = client.post("/api/chats/", {"visitor_name": visitor_name}, content_type="application/json")
+        assert response.status_code == 201, response.content
+
+    run_id = uuid.uuid4().hex[:8]
+    for i in range(args.chats):
+        start_chat("chat_start_new_visitor", f"visitor {run_id} {i}")
+        start_chat("chat_start_existing_visitor", f"visitor {run_id} {i}")
+    chats = list(ChatConversation.objects.values_list("id", "giosg_chat_id"))
+
+    for i in range(args.messages):
+        chat_pk, _ = chats[i % len(chats)]
+        with scenarios["message_send"].measure():
+            response = client.post(
+                f"/api/chats/{chat_pk}/messages/", {"message": f"Message {i}"}, content_type="application/json",
+            )
+        assert response.status_code == 202, response.content
+    delivered = True
+    while delivered:
+        with scenarios["outbox_delivery"].measure() as sample:
+            delivered = sample["operations"] = deliver_batch(100)
+
+    webhooks = [
+        message_webhook(chats[i % len(chats)][1], f"{run_id}-message-{i}") for i in range(args.webhooks)
+    ]
+    for start in range(0, len(webhooks), args.burst_size):
+        burst = webhooks[start:start + args.burst_size]
+        with scenarios["webhook_burst"].measure(len(burst)):
+            response = client.post("/giosg_webhooks/messages/batch", burst, content_type="application/json")
+        assert response.status_code in (202, 204), response.content
+    processed = True
+    while processed:
+        with scenarios["webhook_processing"].measure() as sample:
+            processed = sample["operations"] = process_batch(100)
+
+    etags = {}
+    for i in range(args.polls):
+        chat_pk, _ = chats[i % len(chats)]
+        url = f"/api/chats/{chat_pk}/messages/"
+        with scenarios["message_poll"].measure():
+            response = client.get(url, HTTP_IF_NONE_MATCH=etags.get(url, ""))
+        assert response.status_code in (200, 304), response.content
+        etags[url] = response["ETag"]
+
+    return {name: scenario.result() for name, scenario in scenarios.items()}
+
+
+def compare(results, baseline):
+    """
+    Returns relative change of the compared metrics from "baseline", positive numbers are improvements
+    """
+    changes = {}
+    for name, result in results.items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        changes[name] = {}
+        for metric, bigger_is_better in COMPARED_METRICS.items():
+            old, new = previous.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            improvement = change if bigger_is_better else -change
+            # Adding zero turns -0.0 to 0.0
+            changes[name][metric] = f"{improvement + 0.0:+.1%}"
+    return changes
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.02, help="Latency added by fake Giosg in seconds")
+    parser.add_argument("--chats", type=int, default=50, help="Number of chats started for each chat start scenario")
+    parser.add_argument("--messages", type=int, default=200, help="Number of messages sent")
+    parser.add_argument("--polls", type=int, default=500, help="Number of message list polls")
+    parser.add_argument("--webhooks", type=int, default=5000, help="Number of message webhooks received")
+    parser.add_argument("--burst-size", type=int, default=100, help="Number of webhooks in one batch request")
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Compare results with an earlier --output file")
+    args = parser.parse_args()
+
+    setup_test_database()
+    from django.test import override_settings
+
+    with FakeGiosgServer(latency=args.latency) as server:
+        with override_settings(GIOSG_API_BASE_URL=server.url, DEBUG=False):
+            scenarios = run(args)
+        giosg_requests = dict(server.state.request_counts)
+
+    results = {
+        "revision": git_revision(),
+        "options": {name: value for name, value in vars(args).items() if name not in ("output", "compare")},
+        "scenarios": scenarios,
+        "giosg_requests": giosg_requests,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+    if args.compare:
+        with open(args.compare) as f:
+            results["changes"] = compare(scenarios, json.load(f))
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Measures per call latency of giosg_api.api functions against local fake Giosg server
+with connection pooling enabled and disabled.
+
+    python -m benchmarks.bench_http_pool --iterations 200 --latency 0.002 --connect-latency 0.03
+
+The fake server speaks plain HTTP over loopback where opening a connection is almost free.
+Use --connect-latency to simulate the TCP and TLS handshake round trips paid for every new
+connection to service.giosg.com.
+"""
+import argparse
+import contextlib
+import io
+import json
+import time
+from collections import defaultdict
+
+from benchmarks.utils import setup_django, summarize
+
+
+def run(iterations, keep_alive):
+    from django.conf import settings
+    from giosg_api import api
+    from giosg_api.client import reset_client
+
+    settings.GIOSG_HTTP_CLIENT = dict(settings.GIOSG_HTTP_CLIENT, keep_alive=keep_alive)
+    reset_client()
+
+    org_id, room_id = settings.GIOSG_ORGANIZATION_ID, settings.GIOSG_ROOM_ID
+    timings = defaultdict(list)
+
+    def timed(name, func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        timings[name].append(time.perf_counter() - started)
+        return result
+
+    # API functions print every response, keep that out of the benchmark output
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(iterations):
+            visitor = timed("create_giosg_visitor", api.create_giosg_visitor, org_id, room_id)
+            visitor_id = visitor["visitor_id"]
+            timed("authenticate_giosg_visitor", api.authenticate_giosg_visitor, org_id, visitor["visitor_secret_id"])
+            timed("set_visitor_name", api.set_visitor_name, org_id, room_id, visitor_id, f"visitor {i}")
+            chat = timed("create_new_chat_as_visitor", api.create_new_chat_as_visitor, org_id, room_id, visitor_id,
+                         visitor["access_token"])
+            timed("send_message_as_visitor", api.send_message_as_visitor, visitor_id, chat["id"],
+                  visitor["access_token"], "Hello")
+            timed("get_visitor_id", api.get_visitor_id, org_id, chat["id"])
+    return {name: summarize(samples) for name, samples in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0, help="Latency added by fake server in seconds")
+    parser.add_argument("--connect-latency", type=float, default=0.03,
+                        help="Latency added by fake server for each new connection in seconds")
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from benchmarks.fake_giosg import FakeGiosgServer
+
+    results = {}
+    for mode, keep_alive in (("pooled", True), ("unpooled", False)):
+        with FakeGiosgServer(latency=args.latency, connect_latency=args.connect_latency) as server:
+            settings.GIOSG_API_BASE_URL = server.url
+            results[mode] = run(args.iterations, keep_alive)
+            results[mode]["connections_opened"] = server.state.connection_count
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Measures latency of the hot chat_app queries on a large database before and after the indexes
+of migration chat_app 0003_indexes are created.
+
+    python -m benchmarks.bench_indexes --messages 1000000 --chats 10000
+
+Rows are inserted while the database is migrated to chat_app 0002, after which the queries are
+measured, the rest of the migrations are applied and the queries are measured again.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import uuid
+
+from benchmarks.utils import summarize
+
+# Queries select only columns which exist at chat_app 0002, later migrations add more of them
+MESSAGE_FIELDS = ("id", "chat_id", "giosg_message_id", "created_at", "sender_id", "sender_name", "message")
+VISITOR_FIELDS = ("id", "giosg_visitor_id", "giosg_visitor_secret_id", "created_at", "visitor_name")
+
+
+def insert_rows(message_count, chat_count):
+    from django.db import connection, transaction
+    from django.utils import timezone
+
+    now = timezone.now()
+    visitors = [(uuid.uuid4().hex, f"visitor-{i}", f"secret-{i}", now, f"Visitor {i}") for i in range(chat_count)]
+    chats = [(uuid.uuid4().hex, f"chat-{i}", visitors[i][0], now) for i in range(chat_count)]
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO chat_app_visitor (id, giosg_visitor_id, giosg_visitor_secret_id, created_at, visitor_name) "
+            "VALUES (%s, %s, %s, %s, %s)", visitors,
+        )
+        cursor.executemany(
+            "INSERT INTO chat_app_chatconversation (id, giosg_chat_id, visitor_id, created_at) VALUES (%s, %s, %s, %s)",
+            chats,
+        )
+        batch = []
+        for i in range(message_count):
+            chat = chats[random.randrange(chat_count)]
+            created_at = now + timezone.timedelta(microseconds=i)
+            batch.append((uuid.uuid4().hex, chat[0], f"message-{i}", created_at, "sender", "Sender", f"Message {i}"))
+            if len(batch) == 10000 or i == message_count - 1:
+                cursor.executemany(
+                    "INSERT INTO chat_app_chatmessage "
+                    "(id, chat_id, giosg_message_id, created_at, sender_id, sender_name, message) "
+                    "VALUES (%s, %s, %s, %s, %s, %s, %s)", batch,
+                )
+                batch = []
+    return [chat[0] for chat in chats]
+
+
+def measure_queries(chat_pks, message_count, chat_count, iterations):
+    from chat_app.models import ChatMessage, Visitor
+
+    queries = {
+        "messages of chat ordered by created_at": lambda: list(
+            ChatMessage.objects.filter(chat_id=random.choice(chat_pks)).order_by("created_at")
+            .values_list(*MESSAGE_FIELDS)[:50]
+        ),
+        "message by giosg_message_id": lambda: list(
+            ChatMessage.objects.filter(giosg_message_id=f"message-{random.randrange(message_count)}")
+            .values_list(*MESSAGE_FIELDS)
+        ),
+        "100 messages by giosg_message_id": lambda: list(
+            ChatMessage.objects.filter(
+                giosg_message_id__in=[f"message-{random.randrange(message_count)}" for _ in range(100)]
+            ).values_list("giosg_message_id", flat=True)
+        ),
+        "visitor by giosg_visitor_id": lambda: list(
+            Visitor.objects.filter(giosg_visitor_id=f"visitor-{random.randrange(chat_count)}")
+            .values_list(*VISITOR_FIELDS)
+        ),
+    }
+    results = {}
+    for name, query in queries.items():
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            query()
+            samples.append(time.perf_counter() - started)
+        results[name] = summarize(samples)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--chats", type=int, default=10000)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DJANGO_SETTINGS_MODULE"] = "benchmarks.settings"
+        os.environ["BENCHMARK_DB_NAME"] = os.path.join(tmp, "benchmark.sqlite3")
+
+        import django
+        from django.core.management import call_command
+
+        django.setup()
+        call_command("migrate", verbosity=0)
+        call_command("migrate", "chat_app", "0002", verbosity=0)
+
+        started = time.perf_counter()
+        chat_pks = insert_rows(args.messages, args.chats)
+        insert_duration = time.perf_counter() - started
+
+        results = {"without_indexes": measure_queries(chat_pks, args.messages, args.chats, args.iterations)}
+        started = time.perf_counter()
+        call_command("migrate", verbosity=0)
+        migrate_duration = time.perf_counter() - started
+        results["with_indexes"] = measure_queries(chat_pks, args.messages, args.chats, args.iterations)
+        results["insert_duration_s"] = round(insert_duration, 1)
+        results["migrate_duration_s"] = round(migrate_duration, 1)
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
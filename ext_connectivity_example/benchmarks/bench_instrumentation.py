@@ -0,0 +1,79 @@
+"""
+Measures the overhead of the request instrumentation of ext_connectivity_example/instrumentation.py.
+
+    python -m benchmarks.bench_instrumentation --requests 2000
+
+"span" is the cost of one span in code which runs outside of instrumented requests. "message_list" scenarios
+fetch a page of 100 messages through the whole Django stack with instrumentation disabled and enabled.
+"""
+import argparse
+import json
+import time
+
+from benchmarks.utils import setup_test_database, summarize
+
+
+def measure_span(iterations):
+    from ext_connectivity_example.instrumentation import span
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        with span("benchmark"):
+            pass
+    return {"ns_per_span": round((time.perf_counter() - started) / iterations * 1e9, 1)}
+
+
+def measure_requests(url, count):
+    """
+    Alternates requests with instrumentation disabled and enabled, so that both get the same warm-up
+    """
+    from django.test import Client, override_settings
+
+    clients = {}
+    for enabled in (False, True):
+        with override_settings(GIOSG_INSTRUMENTATION={"enabled": enabled}):
+            # Middleware is loaded by the first request of the client
+            clients[enabled] = Client()
+            clients[enabled].get(url)
+
+    latencies = {False: [], True: []}
+    responses = {}
+    for _ in range(count):
+        for enabled, client in clients.items():
+            started = time.perf_counter()
+            responses[enabled] = client.get(url)
+            latencies[enabled].append(time.perf_counter() - started)
+            assert responses[enabled].status_code == 200
+    return {
+        f"message_list_{'enabled' if enabled else 'disabled'}": dict(
+            summarize(samples), server_timing=responses[enabled].get("Server-Timing"),
+        )
+        for enabled, samples in latencies.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    setup_test_database()
+    from chat_app.models import ChatConversation, ChatMessage, Visitor
+
+    visitor = Visitor.objects.create(
+        giosg_visitor_id="visitor", giosg_visitor_secret_id="secret", visitor_name="Visitor",
+    )
+    chat = ChatConversation.objects.create(giosg_chat_id="chat", visitor=visitor)
+    ChatMessage.objects.bulk_create([
+        ChatMessage(chat=chat, giosg_message_id=f"message-{i}", sender_id="visitor", sender_name="Visitor",
+                    message=f"Message {i}")
+        for i in range(100)
+    ])
+    url = f"/api/chats/{chat.id}/messages/"
+
+    results = {"span": measure_span(1000000), **measure_requests(url, args.requests)}
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Measures how long logging the body of one received webhook takes on the request thread.
+
+    python -m benchmarks.bench_logging --webhooks 20000
+
+"print" is how webhooks were logged before: the body was parsed and pretty printed to stdout.
+The other scenarios use giosg_api.logs with DEBUG disabled, enabled and enabled with sampling.
+Output goes to /dev/null, so the time spent writing to a real terminal or pipe is not included.
+For the queued scenarios "drain_ms" is how long the background thread needed to write the rest.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import statistics
+import time
+
+from benchmarks.utils import summarize
+from giosg_api.logs import JsonFormatter, QueueLogHandler, SampleFilter, log_payload
+
+URL = "http://localhost:8000/giosg_webhooks/messages"
+
+
+def webhook_body(number):
+    return json.dumps({
+        "action": "added",
+        "resource_id": f"message-{number}",
+        "channel": "/api/v5/orgs/benchmark-org/owned_chats/benchmark-chat/messages",
+        "app_user_id": "benchmark-app-user",
+        "resource": {
+            "id": f"message-{number}",
+            "type": "msg",
+            "chat_id": "benchmark-chat",
+            "room_id": "benchmark-room",
+            "sender_type": "visitor",
+            "sender_id": "benchmark-visitor",
+            "sender_name": None,
+            "sender_public_name": "Visitor",
+            "message": f"Message {number}, " + "lorem ipsum dolor sit amet " * 10,
+            "created_at": "2022-02-22T12:00:00.000Z",
+            "attachments": [],
+            "buttons": [],
+        },
+    }).encode("utf-8")
+
+
+def pretty_print_response(method, url, data):
+    # Logging of webhooks before giosg_api.logs
+    print("{} {}".format(method.upper(), url))
+    if isinstance(data, dict):
+        print(json.dumps(data, indent=4))
+    elif isinstance(data, str) or isinstance(data, bytes):
+        print(json.dumps(json.loads(data), indent=4))
+
+
+def measure(log, bodies):
+    samples = []
+    for body in bodies:
+        started = time.perf_counter()
+        log(body)
+        samples.append(time.perf_counter() - started)
+    result = summarize(samples)
+    result["mean_us"] = round(statistics.mean(samples) * 1000000, 2)
+    return result
+
+
+def measure_queued(bodies, devnull, level, rate):
+    logger = logging.getLogger(f"benchmark.{level}.{rate}")
+    logger.propagate = False
+    logger.setLevel(level)
+    handler = QueueLogHandler(maxsize=len(bodies), stream=devnull)
+    handler.setFormatter(JsonFormatter())
+    handler.addFilter(SampleFilter(rate))
+    logger.addHandler(handler)
+
+    result = measure(lambda body: log_payload(logger, "received webhook", URL, body), bodies)
+    started = time.perf_counter()
+    handler.flush()
+    result["drain_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    result["dropped"] = handler.dropped
+    handler.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--webhooks", type=int, default=20000)
+    parser.add_argument("--sample-rate", type=float, default=0.1)
+    args = parser.parse_args()
+
+    bodies = [webhook_body(i) for i in range(args.webhooks)]
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            results = {"print": measure(lambda body: pretty_print_response("received webhook", URL, body), bodies)}
+        results["debug_disabled"] = measure_queued(bodies, devnull, logging.INFO, 1.0)
+        results["debug_enabled"] = measure_queued(bodies, devnull, logging.DEBUG, 1.0)
+        results[f"debug_sampled_{args.sample_rate}"] = measure_queued(bodies, devnull, logging.DEBUG, args.sample_rate)
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Measures how many message webhooks per second are ingested to the database when every message
+is stored on its own and when they are stored in batches with bulk_create.
+
+    python -m benchmarks.bench_message_ingest --messages 5000 --chats 50 --batch-size 100
+
+"handler" scenarios call the webhook handlers directly, "queue" scenarios enqueue the webhooks and
+drain the queue like "process_webhooks" workers do, claiming one or --batch-size events at a time.
+Some of the webhooks are replays of already received messages, which must be skipped.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import tempfile
+import time
+
+
+def setup_database(path, chat_count):
+    os.environ["DJANGO_SETTINGS_MODULE"] = "benchmarks.settings"
+    os.environ["BENCHMARK_DB_NAME"] = path
+
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("migrate", verbosity=0)
+
+    from chat_app.models import ChatConversation, Visitor
+
+    visitor = Visitor.objects.create(
+        giosg_visitor_id="benchmark-visitor",
+        giosg_visitor_secret_id="benchmark-secret",
+        visitor_name="Benchmark visitor",
+    )
+    ChatConversation.objects.bulk_create([
+        ChatConversation(giosg_chat_id=f"chat-{i}", visitor=visitor) for i in range(chat_count)
+    ])
+
+
+def generate_payloads(message_count, chat_count, replay_ratio):
+    payloads = []
+    for i in range(message_count):
+        if payloads and random.random() < replay_ratio:
+            payloads.append(random.choice(payloads))
+            continue
+        chat_id = f"chat-{random.randrange(chat_count)}"
+        payloads.append({
+            "action": "added",
+            "resource_id": f"message-{i}",
+            "channel": f"/api/v5/orgs/benchmark-org/owned_chats/{chat_id}/messages",
+            "resource": {
+                "type": "msg",
+                "chat_id": chat_id,
+                "sender_type": "visitor",
+                "sender_id": "benchmark-visitor",
+                "sender_name": None,
+                "message": f"Message {i}",
+            },
+        })
+    return payloads
+
+
+def measure(name, payloads, ingest):
+    from chat_app.models import ChatMessage
+
+    ChatMessage.objects.all().delete()
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        ingest(payloads)
+        duration = time.perf_counter() - started
+
+    unique_count = len({p["resource_id"] for p in payloads})
+    stored_count = ChatMessage.objects.count()
+    assert stored_count == unique_count, f"{name}: stored {stored_count} messages, expected {unique_count}"
+    return {
+        "messages": len(payloads),
+        "stored": stored_count,
+        "duration_s": round(duration, 3),
+        "messages_per_second": round(len(payloads) / duration, 1),
+    }
+
+
+def run(payloads, batch_size):
+    from giosg_webhooks import queue
+    from giosg_webhooks.handlers import handle_message_webhook, ingest_messages
+    from giosg_webhooks.models import WebhookEvent
+
+    def handler_per_row(payloads):
+        for payload in payloads:
+            handle_message_webhook(payload)
+
+    def handler_batched(payloads):
+        for i in range(0, len(payloads), batch_size):
+            ingest_messages(payloads[i:i + batch_size])
+
+    def drain(limit):
+        def ingest(payloads):
+            queue.enqueue_many(WebhookEvent.KIND_MESSAGE, payloads)
+            while queue.process_batch(limit):
+                pass
+        return ingest
+
+    return {
+        "handler_per_row": measure("handler_per_row", payloads, handler_per_row),
+        "handler_batched": measure("handler_batched", payloads, handler_batched),
+        "queue_per_row": measure("queue_per_row", payloads, drain(1)),
+        "queue_batched": measure("queue_batched", payloads, drain(batch_size)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--replay-ratio", type=float, default=0.05, help="Share of webhooks which are replays")
+    args = parser.parse_args()
+
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_database(os.path.join(tmp, "benchmark.sqlite3"), args.chats)
+        payloads = generate_payloads(args.messages, args.chats, args.replay_ratio)
+        results = run(payloads, args.batch_size)
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Measures how fast new messages reach browsers subscribed to the Server-Sent Events stream
+and compares the load with browsers polling every 500 ms.
+
+    python -m benchmarks.bench_push_fanout --subscribers 1000 --events 20
+
+The app is served with uvicorn in a separate process. All subscribers listen to the same chat
+and this process writes PushEvents with the time they were sent, like a "process_webhooks" worker would.
+Latency is measured from writing the event to each subscriber receiving it.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.bench_asgi_vs_wsgi import free_port, run_server
+from benchmarks.utils import summarize
+
+POLL_INTERVAL = 0.5
+
+UVICORN = [
+    sys.executable, "-m", "uvicorn", "ext_connectivity_example.asgi:application",
+    "--log-level", "warning", "--no-access-log", "--backlog", "4096",
+]
+
+
+def prepare_database():
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("migrate", verbosity=0)
+
+    from chat_app.models import ChatConversation, Visitor
+
+    visitor = Visitor.objects.create(
+        giosg_visitor_id="benchmark-visitor", giosg_visitor_secret_id="secret", visitor_name="Benchmark visitor",
+    )
+    return ChatConversation.objects.create(giosg_chat_id="benchmark-chat", visitor=visitor)
+
+
+def publish(chat_id, number):
+    from chat_app.models import PushEvent
+
+    PushEvent.objects.create(
+        kind=PushEvent.KIND_MESSAGE, chat_id=chat_id, payload={"number": number, "sent_at": time.time()},
+    )
+
+
+async def subscribe(client, url, connected, latencies, expected):
+    async with client.stream("GET", url) as response:
+        response.raise_for_status()
+        connected.release()
+        received = 0
+        event = None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: ") and event == "message":
+                latencies.append(time.time() - json.loads(line[6:])["sent_at"])
+                received += 1
+                if received == expected:
+                    return
+
+
+async def run(base_url, chat_id, subscribers, events, interval):
+    url = f"{base_url}/api/events/?chat_id={chat_id}"
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    timeout = httpx.Timeout(60)
+    latencies = []
+    connected = asyncio.Semaphore(0)
+    loop = asyncio.get_running_loop()
+
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        started = time.perf_counter()
+        tasks = [
+            asyncio.ensure_future(subscribe(client, url, connected, latencies, events)) for _ in range(subscribers)
+        ]
+        for _ in range(subscribers):
+            await connected.acquire()
+        connect_duration = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for number in range(events):
+            await loop.run_in_executor(None, publish, chat_id, number)
+            await asyncio.sleep(interval)
+        await asyncio.wait_for(asyncio.gather(*tasks), timeout=60)
+        duration = time.perf_counter() - started
+
+    return {
+        "connect_all_s": round(connect_duration, 2),
+        "deliveries": len(latencies),
+        "expected_deliveries": subscribers * events,
+        "latency": summarize(latencies),
+        "duration_s": round(duration, 2),
+        "requests": subscribers,
+        # Every polling browser asks for both the chat list and the messages of the open chat
+        "polling_requests": int(subscribers * 2 * duration / POLL_INTERVAL),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subscribers", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.25, help="Seconds between published events")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DJANGO_SETTINGS_MODULE"] = "benchmarks.settings"
+        os.environ["BENCHMARK_DB_NAME"] = os.path.join(tmp, "benchmark.sqlite3")
+        chat = prepare_database()
+
+        with run_server(UVICORN, free_port()) as base_url:
+            results = asyncio.run(run(base_url, str(chat.id), args.subscribers, args.events, args.interval))
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
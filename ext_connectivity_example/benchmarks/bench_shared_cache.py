@@ -0,0 +1,112 @@
+"""
+Measures how many times visitors are authenticated against Giosg when messages are sent by many worker processes.
+
+    python -m benchmarks.bench_shared_cache --workers 8 --messages 1000 --visitors 100
+    python -m benchmarks.bench_shared_cache --redis-url redis://localhost:6379/15
+
+Every worker process gets the access token of the visitor and sends the message, like deliver_outbox does.
+Messages are spread over the workers round robin, so messages of a visitor are sent by many workers. Cache profiles
+(DJANGO_CACHE_PROFILE in settings.py):
+
+    locmem  every process has its own cache, each worker authenticates each visitor
+    file    processes share the cache through files in a temporary directory
+    redis   processes share the cache through Redis, only run when --redis-url is given.
+            The Redis database is flushed before the run.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+import uuid
+
+from benchmarks.fake_giosg import FakeGiosgServer
+from benchmarks.utils import setup_django
+
+
+def worker(environ, visitors, queue):
+    os.environ.update(environ)
+    setup_django()
+    from giosg_api import api, token_cache
+
+    for visitor_id, secret_id in visitors:
+        access_token = api.get_access_token_for_visitor("benchmark-org", visitor_id, secret_id)
+        api.send_message_as_visitor(visitor_id, f"chat-{visitor_id}", access_token, "Hello")
+    queue.put({"token_cache": token_cache.stats.snapshot()})
+
+
+def run_profile(server, profile_environ, worker_count, messages, visitors):
+    environ = dict(
+        profile_environ,
+        DJANGO_SETTINGS_MODULE="benchmarks.settings",
+        BENCHMARK_GIOSG_URL=server.url,
+    )
+    auth_calls_before = server.state.request_counts["auth"]
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    processes = [
+        context.Process(target=worker, args=(environ, [visitors[i] for i in messages[number::worker_count]], queue))
+        for number in range(worker_count)
+    ]
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    results = [queue.get() for _ in processes]
+    duration = time.perf_counter() - started
+    for process in processes:
+        process.join()
+
+    auth_calls = server.state.request_counts["auth"] - auth_calls_before
+    return {
+        "auth_calls": auth_calls,
+        "auth_calls_per_1k_messages": round(auth_calls / len(messages) * 1000, 1),
+        "token_local_hits": sum(result["token_cache"]["local_hits"] for result in results),
+        "messages_per_second": round(len(messages) / duration, 1),
+    }
+
+
+def flush_redis(url):
+    os.environ.update(DJANGO_CACHE_PROFILE="redis", REDIS_URL=url)
+    setup_django()
+    from django.core.cache import cache
+    cache.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--visitors", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.002, help="Response time of the fake Giosg API in seconds")
+    parser.add_argument("--redis-url", default=None)
+    args = parser.parse_args()
+
+    with FakeGiosgServer(latency=args.latency) as server:
+        visitors = []
+        for _ in range(args.visitors):
+            visitor_id, secret_id = uuid.uuid4().hex, uuid.uuid4().hex
+            server.state.visitors[secret_id] = {"id": visitor_id, "organization_id": "benchmark-org"}
+            visitors.append((visitor_id, secret_id))
+        random.seed(0)
+        messages = [random.randrange(args.visitors) for _ in range(args.messages)]
+
+        results = {}
+        with tempfile.TemporaryDirectory() as cache_dir:
+            profiles = {
+                "locmem": {"DJANGO_CACHE_PROFILE": "locmem"},
+                "file": {"DJANGO_CACHE_PROFILE": "file", "DJANGO_CACHE_DIR": cache_dir},
+            }
+            if args.redis_url:
+                flush_redis(args.redis_url)
+                profiles["redis"] = {"DJANGO_CACHE_PROFILE": "redis", "REDIS_URL": args.redis_url}
+            for name, profile_environ in profiles.items():
+                results[name] = run_profile(server, profile_environ, args.workers, messages, visitors)
+
+    summary = {"workers": args.workers, "messages": args.messages, "visitors": args.visitors}
+    print(json.dumps(dict(summary, **results), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Compares webhooks per second handled on one core when payloads are validated with the DRF serializers
+and with the fast-path decoders of giosg_webhooks/decoders.py.
+
+    python -m benchmarks.bench_webhook_decode --webhooks 20000
+
+"decode" scenarios only parse and validate the JSON body. "view" scenarios call the message webhook
+view with a request built by RequestFactory, including storing the webhook to the queue in a test
+database. The serializer view is the webhook view as it was before the decoders and deduplication.
+In "view_fast_path_retries" every webhook is delivered twice and the retries are dropped as duplicates.
+"""
+import argparse
+import json
+import time
+
+from benchmarks.utils import setup_test_database
+
+
+def generate_bodies(count, start=0):
+    return [
+        json.dumps({
+            "action": "added",
+            "resource_id": f"message-{i}",
+            "channel": "/api/v5/orgs/benchmark-org/owned_chats/benchmark-chat/messages",
+            "app_user_id": "benchmark-app-user",
+            "resource": {
+                "id": f"message-{i}",
+                "type": "msg",
+                "chat_id": "benchmark-chat",
+                "room_id": "benchmark-room",
+                "sender_type": "visitor",
+                "sender_id": "benchmark-visitor",
+                "sender_public_name": "Visitor",
+                "sender_name": None,
+                "sender_avatar": None,
+                "message": f"Message {i}",
+                "is_encrypted": False,
+                "created_at": "2022-02-22T12:00:00.000Z",
+            },
+        }).encode("utf-8")
+        for i in range(start, start + count)
+    ]
+
+
+def serializer_view():
+    from rest_framework import status
+    from rest_framework.response import Response
+    from rest_framework.views import APIView
+
+    from giosg_webhooks import serializers
+    from giosg_webhooks.models import WebhookEvent
+    from giosg_webhooks.queue import enqueue
+
+    class SerializerMessageWebhookView(APIView):
+
+        def post(self, request, *args, **kwargs):
+            serializer = serializers.MessageWebhookSerializer(data=request.data)
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            enqueue(WebhookEvent.KIND_MESSAGE, serializer.validated_data)
+            return Response(status=status.HTTP_202_ACCEPTED)
+
+    return SerializerMessageWebhookView.as_view()
+
+
+def measure(bodies, handle):
+    started = time.perf_counter()
+    for body in bodies:
+        handle(body)
+    duration = time.perf_counter() - started
+    return {
+        "webhooks": len(bodies),
+        "duration_s": round(duration, 3),
+        "webhooks_per_second": round(len(bodies) / duration, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--webhooks", type=int, default=20000)
+    args = parser.parse_args()
+
+    setup_test_database()
+    from django.test import RequestFactory
+
+    from giosg_webhooks import decoders, dedup, serializers
+    from giosg_webhooks.models import WebhookEvent
+    from giosg_webhooks.views import GiosgChatMessageWebhookView
+
+    bodies = generate_bodies(args.webhooks)
+
+    def serializer_decode(body):
+        serializer = serializers.MessageWebhookSerializer(data=json.loads(body))
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    def decoder_decode(body):
+        return decoders.decode(body, decoders.MessageWebhook).to_payload()
+
+    factory = RequestFactory()
+
+    def call_view(view):
+        def handle(body):
+            response = view(factory.post("/giosg_webhooks/messages", body, content_type="application/json"))
+            assert response.status_code in (202, 204), response.status_code
+        return handle
+
+    results = {
+        "decode_serializer": measure(bodies, serializer_decode),
+        "decode_fast_path": measure(bodies, decoder_decode),
+        "view_serializer": measure(bodies, call_view(serializer_view())),
+        "view_fast_path": measure(bodies, call_view(GiosgChatMessageWebhookView.as_view())),
+    }
+    dedup.stats.reset()
+    retried_bodies = [body for body in generate_bodies(args.webhooks, args.webhooks) for _ in range(2)]
+    results["view_fast_path_retries"] = measure(retried_bodies, call_view(GiosgChatMessageWebhookView.as_view()))
+    results["view_fast_path_retries"]["dedup"] = dedup.stats.snapshot()
+    assert WebhookEvent.objects.count() == 3 * args.webhooks
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+"""
+Local stand-in for service.giosg.com which implements the endpoints used in giosg_api/api.py.
+
+Can be used from benchmarks and tests:
+
+    with FakeGiosgServer(latency=0.02) as server:
+        settings.GIOSG_API_BASE_URL = server.url
+        ...
+
+or started standalone for manual testing:
+
+    python -m benchmarks.fake_giosg --port 8001 --latency 0.05
+
+The server is a minimal asyncio HTTP/1.1 implementation so that it can keep thousands of slow
+requests in flight without becoming the bottleneck of a benchmark itself. Slow or failing Giosg endpoints
+can be simulated with inject_fault().
+"""
+import argparse
+import asyncio
+import collections
+import json
+import re
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlencode
+
+
+def timestamp(value=None):
+    value = value or datetime.now(timezone.utc)
+    return value.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+class FakeGiosgState:
+    """
+    In-memory data of the fake Giosg service. Visitors are stored by their secret ID.
+    """
+
+    def __init__(self):
+        self.visitors = {}
+        self.chats = {}
+        self.messages = collections.defaultdict(list)
+        self.variables = collections.defaultdict(dict)
+        self.request_counts = collections.Counter()
+        self.connection_count = 0
+
+    def add_history(self, org_id, visitor_ids, chat_count, messages_per_chat, ended=True):
+        """
+        Adds chats with messages which happened in the past. Chats are divided evenly between the visitors.
+        """
+        started = datetime.now(timezone.utc) - timedelta(days=90)
+        for i in range(chat_count):
+            created_at = started + timedelta(minutes=i)
+            chat = {
+                "id": uuid.uuid4().hex,
+                "room_id": "room",
+                "room_organization_id": org_id,
+                "chat_type": "visitor",
+                "is_ended": ended,
+                "created_at": timestamp(created_at),
+                "ended_at": timestamp(created_at + timedelta(minutes=messages_per_chat + 1)) if ended else None,
+                "visitor_id": visitor_ids[i % len(visitor_ids)],
+            }
+            self.chats[chat["id"]] = chat
+            self.messages[chat["id"]] = [
+                {
+                    "id": uuid.uuid4().hex,
+                    "type": "msg",
+                    "chat_id": chat["id"],
+                    "sender_type": "visitor",
+                    "sender_id": chat["visitor_id"],
+                    "sender_name": None,
+                    "message": f"Message {j} of chat {i}",
+                    "created_at": timestamp(created_at + timedelta(minutes=j)),
+                }
+                for j in range(messages_per_chat)
+            ]
+
+
+class FakeGiosgServer:
+    """
+    Fake Giosg HTTP service running on its own event loop in a background thread.
+    Use port 0 to get a random free port.
+    """
+
+    routes = [
+        ("POST", r"^/api/v5/public/orgs/(?P<org_id>[^/]+)/auth$", "auth"),
+        ("POST", r"^/api/v5/public/orgs/(?P<org_id>[^/]+)/rooms/(?P<room_id>[^/]+)/visitors$", "create_room_visitor"),
+        ("POST", r"^/api/v5/orgs/(?P<org_id>[^/]+)/rooms/(?P<room_id>[^/]+)/visitors/(?P<visitor_id>[^/]+)/variables$",
+         "set_variable"),
+        ("POST",
+         r"^/api/v5/public/orgs/(?P<org_id>[^/]+)/rooms/(?P<room_id>[^/]+)/visitors/(?P<visitor_id>[^/]+)/chats$",
+         "create_chat"),
+        ("POST", r"^/api/v5/public/visitors/(?P<visitor_id>[^/]+)/chats/(?P<chat_id>[^/]+)/messages$", "send_message"),
+        ("GET", r"^/api/v5/orgs/(?P<org_id>[^/]+)/owned_chats/(?P<chat_id>[^/]+)/memberships$", "memberships"),
+        ("GET", r"^/api/v5/orgs/(?P<org_id>[^/]+)/owned_chats$", "list_chats"),
+        ("GET", r"^/api/v5/orgs/(?P<org_id>[^/]+)/owned_chats/(?P<chat_id>[^/]+)/messages$", "list_messages"),
+    ]
+    compiled_routes = [(method, re.compile(pattern), name) for method, pattern, name in routes]
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, connect_latency=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        # Simulates TCP and TLS handshake round trips paid for each new connection
+        self.connect_latency = connect_latency
+        self.state = FakeGiosgState()
+        # Route name -> (extra delay in seconds, error status or None), see inject_fault()
+        self.faults = {}
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._connections = {}
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def serve(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port, backlog=1024)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self._server
+
+    def start(self):
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self.serve())
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        async def close():
+            self._server.close()
+            # Closing the transports ends the keep-alive loops of open connections
+            for writer in self._connections.values():
+                writer.transport.abort()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def inject_fault(self, route, delay=0.0, status=None):
+        """
+        Makes requests to the named route "delay" seconds slower and answers them with "status" if given
+        """
+        self.faults[route] = (delay, status)
+
+    def clear_faults(self):
+        self.faults.clear()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    async def _handle_connection(self, reader, writer):
+        self.state.connection_count += 1
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.connect_latency:
+            await asyncio.sleep(self.connect_latency)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                request_line, *header_lines = head.decode("latin-1").rstrip("\r\n").split("\r\n")
+                method, target, _ = request_line.split(" ", 2)
+                headers = {}
+                for line in header_lines:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length") or 0)
+                body = await reader.readexactly(length) if length else b""
+
+                path, _, query = target.partition("?")
+                status, data = await self._dispatch(method, path, query, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                content = json.dumps(data).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(content)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + content
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            self._connections.pop(task, None)
+
+    async def _dispatch(self, method, path, query, raw_body):
+        for route_method, pattern, name in self.compiled_routes:
+            match = pattern.match(path)
+            if route_method == method and match:
+                self.state.request_counts[name] += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                delay, error_status = self.faults.get(name, (0.0, None))
+                if delay:
+                    await asyncio.sleep(delay)
+                if error_status is not None:
+                    return error_status, {"detail": HTTPStatus(error_status).phrase}
+                # Handlers of GET requests get the query parameters as their body
+                body = json.loads(raw_body) if raw_body else dict(parse_qsl(query))
+                return getattr(self, f"handle_{name}")(body, **match.groupdict())
+        return 404, {"detail": "Not found."}
+
+    def paginate(self, path, items, query):
+        """
+        Returns page of "items" in the shape of Giosg list APIs. Cursor is simply the offset of the page.
+        """
+        offset = int(query.get("cursor", 0))
+        page_size = int(query.get("page_size", 25))
+        end = offset + page_size
+        next_url = f"{self.url}{path}?{urlencode({'cursor': end, 'page_size': page_size})}"
+        return 200, {
+            "next": next_url if end < len(items) else None,
+            "previous": None,
+            "results": items[offset:end],
+        }
+
+    def handle_auth(self, body, org_id):
+        secret_id = body.get("visitor_secret_id")
+        if secret_id is None:
+            visitor_id = uuid.uuid4().hex
+            secret_id = uuid.uuid4().hex
+            self.state.visitors[secret_id] = {"id": visitor_id, "organization_id": org_id}
+        elif secret_id in self.state.visitors:
+            visitor_id = self.state.visitors[secret_id]["id"]
+        else:
+            return 401, {"detail": "Invalid visitor secret."}
+        return 200, {
+            "visitor_id": visitor_id,
+            "visitor_secret_id": secret_id,
+            "access_token": uuid.uuid4().hex,
+            "token_type": "Bearer",
+            "expires_in": 3600,
+        }
+
+    def handle_create_room_visitor(self, body, org_id, room_id):
+        return 201, {"id": body.get("id"), "room_id": room_id}
+
+    def handle_set_variable(self, body, org_id, room_id, visitor_id):
+        self.state.variables[visitor_id][body.get("key")] = body.get("value")
+        return 201, {"key": body.get("key"), "value": body.get("value")}
+
+    def handle_create_chat(self, body, org_id, room_id, visitor_id):
+        chat = {
+            "id": uuid.uuid4().hex,
+            "room_id": room_id,
+            "room_organization_id": org_id,
+            "chat_type": "visitor",
+            "is_ended": False,
+            "created_at": timestamp(),
+            "ended_at": None,
+            "visitor_id": visitor_id,
+        }
+        self.state.chats[chat["id"]] = chat
+        return 201, chat
+
+    def handle_send_message(self, body, visitor_id, chat_id):
+        message = {
+            "id": uuid.uuid4().hex,
+            "type": body.get("type", "msg"),
+            "chat_id": chat_id,
+            "sender_type": "visitor",
+            "sender_id": visitor_id,
+            "sender_name": None,
+            "message": body.get("message"),
+            "created_at": timestamp(),
+        }
+        self.state.messages[chat_id].append(message)
+        return 201, message
+
+    def handle_memberships(self, body, org_id, chat_id):
+        chat = self.state.chats.get(chat_id)
+        if chat is None:
+            return 404, {"detail": "Not found."}
+        return 200, {
+            "next": None,
+            "previous": None,
+            "results": [
+                {"member_type": "user", "member_id": "00000000-0000-0000-0000-000000000000"},
+                {"member_type": "visitor", "member_id": chat["visitor_id"]},
+            ],
+        }
+
+    def handle_list_chats(self, query, org_id):
+        chats = [chat for chat in self.state.chats.values() if chat["room_organization_id"] == org_id]
+        return self.paginate(f"/api/v5/orgs/{org_id}/owned_chats", chats, query)
+
+    def handle_list_messages(self, query, org_id, chat_id):
+        if chat_id not in self.state.chats:
+            return 404, {"detail": "Not found."}
+        messages = self.state.messages[chat_id]
+        return self.paginate(f"/api/v5/orgs/{org_id}/owned_chats/{chat_id}/messages", messages, query)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run fake Giosg service locally")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="Added latency per request in seconds")
+    parser.add_argument("--connect-latency", type=float, default=0.0,
+                        help="Added latency per new connection in seconds")
+    args = parser.parse_args()
+
+    server = FakeGiosgServer(args.host, args.port, args.latency, args.connect_latency)
+
+    async def serve():
+        await server.serve()
+        print(f"Fake Giosg service listening on {server.url}", flush=True)
+        await server._server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
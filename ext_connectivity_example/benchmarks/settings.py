@@ -0,0 +1,21 @@
+"""
+Settings used when benchmarks start the app in separate server processes.
+Database file and Giosg API address are given in environment variables.
+"""
+import os
+
+from ext_connectivity_example.settings import *  # noqa: F401,F403
+from ext_connectivity_example.settings import DATABASES, GIOSG_API_BASE_URL
+
+DEBUG = False
+
+if DATABASES["default"]["ENGINE"] == "django.db.backends.sqlite3":
+    DATABASES["default"]["NAME"] = os.environ.get("BENCHMARK_DB_NAME", DATABASES["default"]["NAME"])
+
+# Benchmarks may compare SQLite with and without the tuned pragmas
+if os.environ.get("BENCHMARK_SQLITE_PRAGMAS") == "off":
+    SQLITE_PRAGMAS = {}
+
+GIOSG_API_BASE_URL = os.environ.get("BENCHMARK_GIOSG_URL", GIOSG_API_BASE_URL)
+GIOSG_ORGANIZATION_ID = "benchmark-org"
+GIOSG_ROOM_ID = "benchmark-room"
@@ -0,0 +1,43 @@
+import os
+import statistics
+
+
+def setup_django():
+    """
+    Configures Django using the project settings so that benchmarks can use models and the API layer
+    """
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ext_connectivity_example.settings")
+    import django
+    django.setup()
+
+
+def setup_test_database():
+    """
+    Configures Django and creates a fresh test database, like the test runner does
+    """
+    setup_django()
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+
+
+def summarize(samples):
+    """
+    Returns latency summary in milliseconds for list of durations given in seconds
+    """
+    samples = sorted(samples)
+    if not samples:
+        return {}
+
+    def percentile(p):
+        return samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))] * 1000
+
+    return {
+        "count": len(samples),
+        "mean_ms": round(statistics.mean(samples) * 1000, 3),
+        "p50_ms": round(percentile(50), 3),
+        "p95_ms": round(percentile(95), 3),
+        "p99_ms": round(percentile(99), 3),
+    }
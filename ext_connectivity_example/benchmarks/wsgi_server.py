@@ -0,0 +1,58 @@
+"""
+Minimal WSGI server with a fixed number of worker threads, standing in for a
+threaded gunicorn/uwsgi deployment in benchmarks.
+
+    python -m benchmarks.wsgi_server --port 8000 --threads 8
+"""
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadPoolWSGIServer(WSGIServer):
+    """
+    Handles each request in a thread pool, so at most "threads" requests are served at the same time
+    """
+    request_queue_size = 1024
+    threads = 8
+
+    def server_activate(self):
+        super().server_activate()
+        self.executor = ThreadPoolExecutor(max_workers=self.threads)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the app with a thread pooled WSGI server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ext_connectivity_example.settings")
+    from django.core.wsgi import get_wsgi_application
+
+    ThreadPoolWSGIServer.threads = args.threads
+    server = make_server(args.host, args.port, get_wsgi_application(),
+                         server_class=ThreadPoolWSGIServer, handler_class=QuietWSGIRequestHandler)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class ChatAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat_app'
+
+    def ready(self):
+        # Registers signal handlers which invalidate cached IDs
+        from . import caching  # noqa: F401
+        # Registers signal handler which pushes changed chats to browsers
+        from . import push  # noqa: F401
+        # Registers signal handler which tunes new SQLite connections
+        from ext_connectivity_example import database  # noqa: F401
+        # Registers signal handler which times database queries of instrumented requests
+        from ext_connectivity_example import instrumentation  # noqa: F401
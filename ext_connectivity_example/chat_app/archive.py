@@ -0,0 +1,68 @@
+"""
+Retention of chat messages.
+
+Messages of chats which ended more than "days" ago are moved from ChatMessage to ArchivedChatMessage.
+ChatMessage then only holds messages of open and recently ended chats, which are the ones clients poll,
+so its indexes stay small no matter how much history there is. Archived messages are still listed by
+ChatMessageViewSet with "archived=true".
+
+Messages are moved in batches, each in its own short transaction. SQLite allows only one writer
+at a time, so the archiver pauses between batches to let webhook workers write new messages.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedChatMessage, ChatMessage
+
+logger = logging.getLogger(__name__)
+
+ARCHIVED_FIELDS = (
+    "id", "chat_id", "giosg_message_id", "created_at", "updated_at", "sender_id", "sender_name", "message",
+)
+
+
+def archive_batch(ended_before, batch_size):
+    """
+    Moves up to "batch_size" messages of chats which ended before "ended_before" to the archive.
+    Returns the number of moved messages.
+    """
+    with transaction.atomic():
+        rows = list(
+            ChatMessage.objects
+            .filter(chat__ended_at__lt=ended_before)
+            .order_by()
+            .values_list(*ARCHIVED_FIELDS)[:batch_size]
+        )
+        if not rows:
+            return 0
+        # Messages archived by a run which was interrupted before deleting them are skipped
+        ArchivedChatMessage.objects.bulk_create(
+            [ArchivedChatMessage(**dict(zip(ARCHIVED_FIELDS, row))) for row in rows],
+            ignore_conflicts=True,
+        )
+        ChatMessage.objects.filter(id__in=[row[0] for row in rows]).delete()
+    return len(rows)
+
+
+def archive_messages(days, batch_size=1000, pause=0.1, max_batches=None):
+    """
+    Moves messages of chats which ended more than "days" ago to the archive.
+    Returns the number of moved messages.
+    """
+    ended_before = timezone.now() - timedelta(days=days)
+    archived = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        moved = archive_batch(ended_before, batch_size)
+        archived += moved
+        batches += 1
+        if moved < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    logger.info("Archived %d messages of chats ended before %s", archived, ended_before.isoformat())
+    return archived
@@ -0,0 +1,140 @@
+"""
+Async versions of the views which call Giosg APIs. These are used when the app is served
+with an ASGI server (see ext_connectivity_example/asgi_urls.py), so that waiting for Giosg
+responses does not tie up a worker thread.
+
+Only the POST handlers are async. Other methods are passed on to the normal DRF viewsets. Posting a message
+only stores it to the outbox (see chat_app/outbox.py), so it is served by the normal viewset.
+"""
+import asyncio
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from rest_framework import status
+
+from . import models
+from . import serializers
+from . import visitor_pool
+from .views import ChatConversationViewSet, store_chat
+
+from giosg_api import async_api
+from giosg_api.task_graph import TaskGraphError
+
+logger = logging.getLogger(__name__)
+
+
+def parse_request_data(request):
+    """
+    Returns request payload as dict for both JSON and form encoded requests
+    """
+    if request.content_type == "application/json":
+        try:
+            return json.loads(request.body or b"{}")
+        except ValueError:
+            return None
+    return request.POST
+
+
+def async_csrf_exempt(view_func):
+    """
+    Same as django.views.decorators.csrf.csrf_exempt but keeps the view a coroutine function.
+    Like the DRF views our API views are not protected by CSRF for anonymous users.
+    """
+    view_func.csrf_exempt = True
+    return view_func
+
+
+_chat_conversation_view = ChatConversationViewSet.as_view({"get": "list", "post": "create"})
+
+
+@async_csrf_exempt
+async def chat_conversation_list(request, *args, **kwargs):
+    """
+    Async version of ChatConversationViewSet.create.
+
+    GET/POST /api/chats/
+    """
+    if request.method != "POST":
+        return await sync_to_async(_chat_conversation_view)(request, *args, **kwargs)
+
+    data = parse_request_data(request)
+    if data is None:
+        return JsonResponse({"detail": "JSON parse error"}, status=status.HTTP_400_BAD_REQUEST)
+    serializer = serializers.ChatConversationCreateSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    await perform_create_chat(serializer)
+    return JsonResponse(serializer.data, status=status.HTTP_201_CREATED)
+
+
+async def gather_tasks(**coroutines):
+    """
+    Runs given coroutines concurrently and returns their results by name. If any of them fails,
+    TaskGraphError with all errors is raised after all of them have finished.
+    """
+    names = list(coroutines)
+    outcomes = await asyncio.gather(*coroutines.values(), return_exceptions=True)
+    errors = {name: outcome for name, outcome in zip(names, outcomes) if isinstance(outcome, Exception)}
+    if errors:
+        raise TaskGraphError(errors)
+    return dict(zip(names, outcomes))
+
+
+async def perform_create_chat(serializer):
+    """
+    Async version of ChatConversationViewSet.perform_create, Giosg calls that do not depend
+    on each other are run concurrently in the same way.
+    """
+    visitor_name = serializer.validated_data["visitor_name"]
+    org_id, room_id = settings.GIOSG_ORGANIZATION_ID, settings.GIOSG_ROOM_ID
+    local_visitor = await sync_to_async(models.Visitor.objects.filter(visitor_name=visitor_name).first)()
+    if local_visitor is None:
+        local_visitor = await sync_to_async(visitor_pool.claim)(visitor_name)
+
+    if local_visitor is not None:
+        visitor_id = local_visitor.giosg_visitor_id
+
+        async def create_chat():
+            access_token = await async_api.get_access_token_for_visitor(
+                org_id, visitor_id, local_visitor.giosg_visitor_secret_id,
+            )
+            return await async_api.create_new_chat_as_visitor(org_id, room_id, visitor_id, access_token)
+
+        results = await gather_tasks(
+            name=async_api.set_visitor_name(org_id, room_id, visitor_id, visitor_name),
+            chat=create_chat(),
+        )
+    else:
+        # Visitor was not found so lets create a new one
+        visitor = await async_api.create_giosg_visitor(org_id, room_id)
+        visitor_id = visitor["visitor_id"]
+
+        def store_visitor():
+            # Store giosg visitor information to our app also. This is done also when rest of
+            # the chat start fails, so that the created Giosg visitor gets reused on next try.
+            return models.Visitor.objects.create(
+                giosg_visitor_id=visitor_id,
+                giosg_visitor_secret_id=visitor["visitor_secret_id"],
+                visitor_name=visitor_name,
+            )
+
+        try:
+            results = await gather_tasks(
+                name=async_api.set_visitor_name(org_id, room_id, visitor_id, visitor_name),
+                chat=async_api.create_new_chat_as_visitor(org_id, room_id, visitor_id, visitor["access_token"]),
+            )
+        except BaseException:
+            # Like a compensation of TaskGraph, a failure to store the visitor must not hide the Giosg error
+            try:
+                await sync_to_async(store_visitor)()
+            except Exception:
+                logger.exception("chat start: storing visitor %s failed", visitor_id)
+            raise
+        local_visitor = await sync_to_async(store_visitor)()
+
+    # Like in the sync view, the chat is stored right away so that the webhook does not need to look it up
+    await sync_to_async(store_chat)(results["chat"], local_visitor)
+    return results["chat"]
@@ -0,0 +1,240 @@
+"""
+Caches for resolving Giosg IDs to primary keys of our local models, and chats to what is needed for
+sending messages to them.
+
+Chats and visitors are looked up by their Giosg ID on every webhook, but the mapping never changes
+after the row has been created. Likewise the Giosg IDs of a chat and its visitor, which are needed for
+every posted and sent message, never change. Lookups go through a small in-process LRU cache first, then the shared
+Django cache and only then the database. New rows are added to the caches when they are created
+and entries are invalidated when the row is deleted.
+
+Other processes can not be told to drop their local entries, so local entries expire after
+GIOSG_ID_CACHE["local_timeout"] seconds. Code which notices that a cached key was stale should
+call delete() for it.
+"""
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from giosg_api.lru import LRUCache
+
+from .models import ChatConversation, Visitor
+
+# Defaults for settings.GIOSG_ID_CACHE
+DEFAULT_ID_CACHE_OPTIONS = {
+    # How many IDs are kept in the local cache of each process, per model
+    "maxsize": 10000,
+    # How long local entries are trusted, in seconds
+    "local_timeout": 300,
+    # How long entries are kept in the shared Django cache, in seconds
+    "timeout": 3600,
+}
+
+
+def get_option(name):
+    return getattr(settings, "GIOSG_ID_CACHE", {}).get(name, DEFAULT_ID_CACHE_OPTIONS[name])
+
+
+class IdCache:
+    """
+    Resolves Giosg IDs to primary keys of "model" using its "field".
+    Only existing rows are cached, missing IDs are looked up from the database every time.
+    """
+
+    def __init__(self, name, model, field):
+        self.name = name
+        self.model = model
+        self.field = field
+        self._local = None
+        self._lock = threading.Lock()
+        self.shared_hits = 0
+        self.db_lookups = 0
+
+    @property
+    def local(self):
+        if self._local is None:
+            with self._lock:
+                if self._local is None:
+                    self._local = LRUCache(get_option("maxsize"), get_option("local_timeout"))
+        return self._local
+
+    def _shared_key(self, giosg_id):
+        return f"giosg_id_{self.name}_{giosg_id}"
+
+    def get(self, giosg_id):
+        """
+        Returns primary key of the row with the given Giosg ID or None if it does not exist
+        """
+        return self.get_many([giosg_id]).get(giosg_id)
+
+    def get_many(self, giosg_ids):
+        """
+        Returns dict of Giosg ID -> primary key for those of the given IDs which exist
+        """
+        found = {}
+        missing = []
+        for giosg_id in set(giosg_ids):
+            pk = self.local.get(giosg_id)
+            if pk is None:
+                missing.append(giosg_id)
+            else:
+                found[giosg_id] = pk
+        if not missing:
+            return found
+
+        shared = cache.get_many([self._shared_key(giosg_id) for giosg_id in missing])
+        from_db = []
+        for giosg_id in missing:
+            pk = shared.get(self._shared_key(giosg_id))
+            if pk is None:
+                from_db.append(giosg_id)
+            else:
+                self.shared_hits += 1
+                self.local.set(giosg_id, pk)
+                found[giosg_id] = pk
+        if not from_db:
+            return found
+
+        self.db_lookups += 1
+        rows = self._load(from_db)
+        self.set_many(rows)
+        found.update(rows)
+        return found
+
+    def _load(self, giosg_ids):
+        return dict(
+            self.model.objects
+            .filter(**{f"{self.field}__in": giosg_ids})
+            .values_list(self.field, "pk")
+        )
+
+    def set(self, giosg_id, pk):
+        self.set_many({giosg_id: pk})
+
+    def set_many(self, pks):
+        if not pks:
+            return
+        for giosg_id, pk in pks.items():
+            self.local.set(giosg_id, pk)
+        cache.set_many({self._shared_key(giosg_id): pk for giosg_id, pk in pks.items()}, get_option("timeout"))
+
+    def delete(self, giosg_id):
+        self.local.delete(giosg_id)
+        cache.delete(self._shared_key(giosg_id))
+
+    def reset(self):
+        """
+        Drops the local cache and statistics. Shared cache entries are left as they are.
+        """
+        with self._lock:
+            self._local = None
+        self.shared_hits = 0
+        self.db_lookups = 0
+
+    def stats(self):
+        local = self.local
+        lookups = local.hits + local.misses
+        return {
+            "size": len(local),
+            "maxsize": local.maxsize,
+            "hits": local.hits,
+            "misses": local.misses,
+            "shared_hits": self.shared_hits,
+            "db_lookups": self.db_lookups,
+            "hit_rate": round(local.hits / lookups, 4) if lookups else None,
+        }
+
+
+class SendContext:
+    """
+    What is needed for sending messages to a chat, without loading the chat and its visitor
+    """
+    __slots__ = ("chat_id", "giosg_chat_id", "giosg_visitor_id", "giosg_visitor_secret_id")
+
+    def __init__(self, chat_id, giosg_chat_id, giosg_visitor_id, giosg_visitor_secret_id):
+        self.chat_id = chat_id
+        self.giosg_chat_id = giosg_chat_id
+        self.giosg_visitor_id = giosg_visitor_id
+        self.giosg_visitor_secret_id = giosg_visitor_secret_id
+
+    def __getstate__(self):
+        return (self.chat_id, self.giosg_chat_id, self.giosg_visitor_id, self.giosg_visitor_secret_id)
+
+    def __setstate__(self, state):
+        self.chat_id, self.giosg_chat_id, self.giosg_visitor_id, self.giosg_visitor_secret_id = state
+
+
+class SendContextCache(IdCache):
+    """
+    Resolves primary keys of chats (as strings) to their SendContext with one query for all missing chats.
+    Raises django.core.exceptions.ValidationError for keys which are not valid primary keys.
+    """
+
+    def __init__(self, name):
+        super().__init__(name, ChatConversation, "pk")
+
+    def _load(self, chat_ids):
+        chats = (
+            ChatConversation.objects
+            .filter(pk__in=chat_ids)
+            .select_related("visitor")
+            .only("giosg_chat_id", "visitor__giosg_visitor_id", "visitor__giosg_visitor_secret_id")
+        )
+        return {
+            str(chat.pk): SendContext(
+                chat.pk, chat.giosg_chat_id, chat.visitor.giosg_visitor_id, chat.visitor.giosg_visitor_secret_id,
+            )
+            for chat in chats
+        }
+
+
+chat_ids = IdCache("chat", ChatConversation, "giosg_chat_id")
+visitor_ids = IdCache("visitor", Visitor, "giosg_visitor_id")
+send_contexts = SendContextCache("send_context")
+
+
+def stats():
+    """
+    Returns statistics of all ID caches of this process
+    """
+    return {
+        "chat_ids": chat_ids.stats(),
+        "visitor_ids": visitor_ids.stats(),
+        "send_contexts": send_contexts.stats(),
+    }
+
+
+@receiver(post_save, sender=ChatConversation)
+def _prime_chat(instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: chat_ids.set(instance.giosg_chat_id, instance.pk))
+
+
+@receiver(post_save, sender=Visitor)
+def _prime_visitor(instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: visitor_ids.set(instance.giosg_visitor_id, instance.pk))
+
+
+@receiver(post_delete, sender=ChatConversation)
+def _invalidate_chat(instance, **kwargs):
+    chat_ids.delete(instance.giosg_chat_id)
+    send_contexts.delete(str(instance.pk))
+
+
+@receiver(post_delete, sender=Visitor)
+def _invalidate_visitor(instance, **kwargs):
+    visitor_ids.delete(instance.giosg_visitor_id)
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    if setting in ("GIOSG_ID_CACHE", "CACHES"):
+        chat_ids.reset()
+        visitor_ids.reset()
+        send_contexts.reset()
@@ -0,0 +1,159 @@
+"""
+Loading of existing chat history from Giosg and exporting it out of our database.
+
+backfill() reads the chats owned by the organization page by page. The next page of chats is fetched
+while the current one is stored, and messages of up to "concurrency" chats are fetched at the same
+time. Only chats whose visitor exists in our app are stored, like with webhooks. Rows are inserted with
+bulk_create in chunks and rows which exist already are skipped, so running it again is harmless.
+After each page of chats the URL of the next page is reported as a checkpoint from which an
+interrupted run can be resumed.
+
+export() writes chats and messages as newline-delimited JSON. Rows are streamed from the database
+with iterator(), so memory use does not depend on the amount of history.
+"""
+import json
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from giosg_api import api
+from giosg_webhooks.handlers import get_sender_name
+
+from .caching import chat_ids, visitor_ids
+from .models import ArchivedChatMessage, ChatConversation, ChatMessage
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_FIELDS = ("id", "chat_id", "giosg_message_id", "created_at", "sender_id", "sender_name", "message")
+CHAT_FIELDS = ("id", "giosg_chat_id", "visitor_id", "created_at", "updated_at", "ended_at")
+
+
+def parse_timestamp(value):
+    return parse_datetime(value) if value else None
+
+
+def store_chats(chats):
+    """
+    Stores those of the Giosg chat resources whose visitor is ours. Returns dict of Giosg chat ID -> our chat ID.
+    """
+    organization_ids = {chat["room_organization_id"] for chat in chats}
+    chat_visitors = {}
+    for organization_id in organization_ids:
+        chat_visitors.update(api.get_visitor_ids(
+            organization_id, [chat["id"] for chat in chats if chat["room_organization_id"] == organization_id],
+        ))
+    visitor_pks = visitor_ids.get_many(visitor_id for visitor_id in chat_visitors.values() if visitor_id)
+
+    new_chats = []
+    for chat in chats:
+        visitor_pk = visitor_pks.get(chat_visitors.get(chat["id"]))
+        if visitor_pk is None:
+            continue
+        ended_at = None
+        if chat.get("is_ended"):
+            ended_at = parse_timestamp(chat.get("ended_at")) or timezone.now()
+        new_chats.append(ChatConversation(
+            giosg_chat_id=chat["id"],
+            visitor_id=visitor_pk,
+            created_at=parse_timestamp(chat.get("created_at")) or timezone.now(),
+            ended_at=ended_at,
+        ))
+    ChatConversation.objects.bulk_create(new_chats, ignore_conflicts=True)
+    return chat_ids.get_many(chat.giosg_chat_id for chat in new_chats)
+
+
+def store_messages(chat_pk, messages, chunk_size):
+    """
+    Stores text messages of one chat in chunks. Returns the number of new messages.
+    """
+    stored = 0
+    messages = [message for message in messages if message["type"] == "msg"]
+    for start in range(0, len(messages), chunk_size):
+        chunk = messages[start:start + chunk_size]
+        giosg_ids = [message["id"] for message in chunk]
+        # Messages of chats which ended long ago may have been archived already
+        existing = set()
+        for model in (ChatMessage, ArchivedChatMessage):
+            existing.update(
+                model.objects.filter(giosg_message_id__in=giosg_ids).values_list("giosg_message_id", flat=True)
+            )
+        new_messages = [
+            ChatMessage(
+                giosg_message_id=message["id"],
+                chat_id=chat_pk,
+                created_at=parse_timestamp(message.get("created_at")) or timezone.now(),
+                sender_id=message["sender_id"],
+                sender_name=get_sender_name(message),
+                message=message["message"],
+            )
+            for message in chunk
+            if message["id"] not in existing
+        ]
+        ChatMessage.objects.bulk_create(new_messages, ignore_conflicts=True)
+        stored += len(new_messages)
+    return stored
+
+
+def backfill(organization_id, checkpoint=None, page_size=100, concurrency=4, chunk_size=500, on_checkpoint=None):
+    """
+    Loads chats of the organization and their messages from Giosg, starting from the "checkpoint" URL
+    if given. on_checkpoint(url) is called after each page of chats, with None when all pages are done.
+    Returns dict with the number of chats of our visitors and the number of new messages.
+    """
+    counts = {"chats": 0, "messages": 0}
+    if checkpoint:
+        pages = api.iter_pages(checkpoint)
+    else:
+        pages = api.iter_pages(api.chats_url(organization_id), {"page_size": page_size})
+
+    # Messages are only fetched in these threads, rows are written by the calling thread
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="giosg-backfill") as executor:
+        for page in pages:
+            chats = store_chats(page["results"])
+            counts["chats"] += len(chats)
+            running = {}
+            pending = list(chats.items())
+            while pending or running:
+                while pending and len(running) < concurrency:
+                    giosg_chat_id, chat_pk = pending.pop()
+                    future = executor.submit(api.get_chat_messages, organization_id, giosg_chat_id, page_size)
+                    running[future] = chat_pk
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    counts["messages"] += store_messages(running.pop(future), future.result(), chunk_size)
+            logger.info("Backfilled %d chats and %d messages", counts["chats"], counts["messages"])
+            if on_checkpoint is not None:
+                on_checkpoint(page.get("next"))
+    return counts
+
+
+def write_rows(stream, kind, queryset, fields, chunk_size):
+    count = 0
+    for row in queryset.values_list(*fields).iterator(chunk_size=chunk_size):
+        stream.write(json.dumps({"type": kind, **dict(zip(fields, row))}, cls=DjangoJSONEncoder))
+        stream.write("\n")
+        count += 1
+    return count
+
+
+def export(stream, include_archived=True, chunk_size=2000):
+    """
+    Writes all chats and then all messages to the text "stream", one JSON object per line.
+    Each object has "type" which is "chat", "message" or "archived_message". Returns dict of written counts.
+    """
+    counts = {
+        # Served by the (created_at, id) and (chat, created_at) indexes
+        "chats": write_rows(stream, "chat", ChatConversation.objects.order_by("created_at", "id"), CHAT_FIELDS,
+                            chunk_size),
+        "messages": write_rows(stream, "message", ChatMessage.objects.order_by("chat", "created_at"),
+                               MESSAGE_FIELDS, chunk_size),
+    }
+    if include_archived:
+        counts["archived_messages"] = write_rows(
+            stream, "archived_message", ArchivedChatMessage.objects.order_by("chat", "created_at"), MESSAGE_FIELDS,
+            chunk_size,
+        )
+    return counts
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chat_app.archive import archive_messages
+
+
+class Command(BaseCommand):
+    help = "Moves messages of chats which ended long ago to the archive. Run this periodically, for example daily."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=30,
+                            help="Messages of chats which ended more than this many days ago are archived")
+        parser.add_argument("--batch-size", type=int, default=1000, help="How many messages are moved at once")
+        parser.add_argument("--pause", type=float, default=0.1,
+                            help="How long to sleep between batches so that other writers get their turn, in seconds")
+        parser.add_argument("--max-batches", type=int, default=None,
+                            help="Stop after this many batches, the rest is archived on the next run")
+
+    def handle(self, *args, **options):
+        if options["days"] < 0 or options["batch_size"] < 1:
+            raise CommandError("--days must not be negative and --batch-size must be positive")
+        archived = archive_messages(
+            options["days"], options["batch_size"], options["pause"], options["max_batches"],
+        )
+        self.stdout.write(f"Archived {archived} messages")
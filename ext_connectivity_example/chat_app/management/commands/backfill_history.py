@@ -0,0 +1,52 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat_app.history import backfill
+
+
+class Command(BaseCommand):
+    help = "Loads existing chats and messages of our visitors from Giosg. Can be resumed with --checkpoint-file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--organization", default=None,
+                            help="Giosg organization ID, settings.GIOSG_ORGANIZATION_ID by default")
+        parser.add_argument("--checkpoint-file", default=None,
+                            help="File where progress is saved. An interrupted run continues from it.")
+        parser.add_argument("--page-size", type=int, default=100, help="How many chats or messages are fetched at once")
+        parser.add_argument("--concurrency", type=int, default=4,
+                            help="How many chats have their messages fetched at the same time")
+        parser.add_argument("--chunk-size", type=int, default=500, help="How many messages are inserted at once")
+
+    def handle(self, *args, **options):
+        checkpoint_file = options["checkpoint_file"]
+        checkpoint = None
+        if checkpoint_file and os.path.exists(checkpoint_file):
+            with open(checkpoint_file) as f:
+                checkpoint = json.load(f)["next"]
+            self.stdout.write(f"Continuing from {checkpoint}")
+
+        def save_checkpoint(next_url):
+            if not checkpoint_file:
+                return
+            if next_url is None:
+                # Done, next run starts from the beginning
+                if os.path.exists(checkpoint_file):
+                    os.remove(checkpoint_file)
+                return
+            # Replaced atomically so that an interrupted write does not lose the progress
+            with open(f"{checkpoint_file}.tmp", "w") as f:
+                json.dump({"next": next_url}, f)
+            os.replace(f"{checkpoint_file}.tmp", checkpoint_file)
+
+        counts = backfill(
+            options["organization"] or settings.GIOSG_ORGANIZATION_ID,
+            checkpoint=checkpoint,
+            page_size=options["page_size"],
+            concurrency=options["concurrency"],
+            chunk_size=options["chunk_size"],
+            on_checkpoint=save_checkpoint,
+        )
+        self.stdout.write(f"Backfilled {counts['chats']} chats and {counts['messages']} new messages")
@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from chat_app import outbox
+
+# How often messages sent longer than GIOSG_OUTBOX["keep_sent"] ago are deleted, in seconds
+CLEANUP_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = "Sends messages posted by our visitors to Giosg. Run this alongside the web server."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100, help="How many messages are claimed at once")
+        parser.add_argument("--concurrency", type=int, default=None,
+                            help="How many chats are sent to at the same time, GIOSG_OUTBOX['concurrency'] by default")
+        parser.add_argument("--poll-interval", type=float, default=0.2,
+                            help="How long to sleep when there is nothing to send before checking again, in seconds")
+        parser.add_argument("--once", action="store_true", help="Exit when there is nothing to send")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Delivering outbound messages")
+        next_cleanup_at = time.monotonic()
+        try:
+            while True:
+                close_old_connections()
+                if time.monotonic() >= next_cleanup_at:
+                    self.delete_sent()
+                    next_cleanup_at = time.monotonic() + CLEANUP_INTERVAL
+                try:
+                    sent = outbox.deliver_batch(options["batch_size"], options["concurrency"])
+                except Exception as ex:
+                    # Most likely the database is locked or unavailable, try again later
+                    self.stderr.write(f"Failed to deliver outbound messages: {ex!r}")
+                    sent = 0
+                if not sent:
+                    if options["once"]:
+                        return
+                    time.sleep(options["poll_interval"])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connection.close()
+
+    def delete_sent(self):
+        try:
+            outbox.delete_sent()
+        except Exception as ex:
+            self.stderr.write(f"Failed to delete sent messages: {ex!r}")
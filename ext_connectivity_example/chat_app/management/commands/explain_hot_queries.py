@@ -0,0 +1,136 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Min, Q
+from django.test import RequestFactory
+from django.utils import timezone
+from rest_framework.request import Request
+
+from chat_app.archive import ARCHIVED_FIELDS
+from chat_app.models import ChatConversation, ChatMessage, OutboundMessage, Visitor
+from chat_app.pagination import ChatConversationCursorPagination
+from chat_app.views import ChatConversationViewSet, ChatMessageViewSet
+from giosg_webhooks.models import WebhookEvent
+
+# Plan lines which mean that the whole table is read
+SEQUENTIAL_SCAN_PATTERNS = {
+    "sqlite": re.compile(r"\bSCAN (?!.*\bUSING\b.*\bINDEX\b)"),
+    "postgresql": re.compile(r"\bSeq Scan\b"),
+    "mysql": re.compile(r"\btype\W+ALL\b"),
+}
+
+
+def sample(model, field, default):
+    value = model.objects.values_list(field, flat=True).first()
+    return default if value is None else value
+
+
+def get_hot_queries():
+    """
+    Returns (name, queryset) pairs of the queries run by chat_app.views and by the webhook
+    handlers for every request or webhook. Values are sampled from the database when possible.
+    """
+    chat_pk = sample(ChatConversation, "pk", "00000000-0000-0000-0000-000000000000")
+    giosg_chat_id = sample(ChatConversation, "giosg_chat_id", "chat")
+    giosg_visitor_id = sample(Visitor, "giosg_visitor_id", "visitor")
+    visitor_name = sample(Visitor, "visitor_name", "visitor")
+    giosg_message_id = sample(ChatMessage, "giosg_message_id", "message")
+    now = timezone.now()
+
+    chat_list = ChatConversationViewSet().get_queryset().order_by(*ChatConversationCursorPagination.ordering)
+    page_size = ChatConversationCursorPagination.page_size
+    message_list_view = ChatMessageViewSet(kwargs={"chat_id": chat_pk}, request=Request(RequestFactory().get("/")))
+    archived_list_view = ChatMessageViewSet(
+        kwargs={"chat_id": chat_pk}, request=Request(RequestFactory().get("/", {"archived": "true"})),
+    )
+    return [
+        # chat_app.views
+        ("chat list", chat_list[:page_size]),
+        ("chat list next page", chat_list.filter(created_at__gte=now)[:page_size]),
+        ("chats changed since", chat_list.filter(updated_at__gte=now)[:page_size]),
+        ("message list", message_list_view.get_queryset()[:100]),
+        ("messages after message", message_list_view.get_queryset().filter(
+            Q(created_at__gt=now) | Q(created_at=now, id__gt=chat_pk),
+        )[:100]),
+        ("archived message list", archived_list_view.get_queryset()[:100]),
+        ("visitor by name", Visitor.objects.filter(visitor_name=visitor_name)),
+        ("pooled visitors", Visitor.objects.filter(visitor_name__isnull=True).order_by("created_at")[:3]),
+        ("chat with visitor by id", ChatConversation.objects.select_related("visitor").filter(id=chat_pk)),
+        # giosg_webhooks handlers
+        ("chats by giosg id", ChatConversation.objects.filter(giosg_chat_id__in=[giosg_chat_id])),
+        ("visitors by giosg id", Visitor.objects.filter(giosg_visitor_id__in=[giosg_visitor_id])),
+        ("messages by giosg id", ChatMessage.objects.filter(giosg_message_id__in=[giosg_message_id])),
+        ("message by giosg id", ChatMessage.objects.filter(giosg_message_id=giosg_message_id)),
+        # chat_app.archive
+        ("messages to archive", ChatMessage.objects.filter(
+            chat__ended_at__lt=now,
+        ).values_list(*ARCHIVED_FIELDS)[:1000]),
+        # chat_app.outbox
+        ("outbound messages of chat", OutboundMessage.objects.filter(chat_id=chat_pk).order_by("id")),
+        ("expired outbound leases", OutboundMessage.objects.filter(
+            status=OutboundMessage.STATUS_SENDING, locked_until__lt=now,
+        )),
+        ("pending outbound messages", OutboundMessage.objects.filter(
+            status=OutboundMessage.STATUS_PENDING, available_at__lte=now,
+        ).order_by("id")[:500]),
+        ("oldest outbound message per chat", OutboundMessage.objects.filter(
+            chat_id__in=[chat_pk],
+            status__in=[OutboundMessage.STATUS_PENDING, OutboundMessage.STATUS_SENDING],
+        ).values("chat_id").annotate(first_id=Min("id"))),
+        ("sent outbound messages to delete", OutboundMessage.objects.filter(sent_at__lt=now)),
+        # giosg_webhooks queue
+        ("expired webhook leases", WebhookEvent.objects.filter(
+            status=WebhookEvent.STATUS_PROCESSING, locked_until__lt=now,
+        )),
+        ("pending webhooks", WebhookEvent.objects.filter(
+            status=WebhookEvent.STATUS_PENDING, available_at__lte=now,
+        ).order_by("id")[:50]),
+        ("oldest webhook per chat", WebhookEvent.objects.filter(
+            ordering_key__in=[giosg_chat_id],
+            status__in=[WebhookEvent.STATUS_PENDING, WebhookEvent.STATUS_PROCESSING],
+        ).values("ordering_key").annotate(first_id=Min("id"))),
+    ]
+
+
+class Command(BaseCommand):
+    help = "Runs EXPLAIN for queries run on every API request and webhook and reports sequential scans."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verbose-plans", action="store_true", help="Print query plans of all queries")
+        parser.add_argument("--fail-on-scan", action="store_true",
+                            help="Exit with an error if any query does a sequential scan")
+
+    def handle(self, *args, **options):
+        pattern = SEQUENTIAL_SCAN_PATTERNS.get(connection.vendor)
+        if pattern is None:
+            raise CommandError(f"Query plans of {connection.vendor} databases are not supported")
+
+        scans = []
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                # With small tables Postgres prefers sequential scans even when there is an index.
+                # We want to know if a query could use an index at all.
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_seqscan TO off")
+
+            for name, queryset in get_hot_queries():
+                plan = queryset.explain()
+                scanning = [line for line in plan.splitlines() if pattern.search(line)]
+                if scanning:
+                    scans.append(name)
+                    self.stdout.write(self.style.WARNING(f"SCAN  {name}"))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f"OK    {name}"))
+                if scanning or options["verbose_plans"]:
+                    self.stdout.write(f"      {queryset.query}")
+                    for line in plan.splitlines():
+                        self.stdout.write(f"      {line}")
+
+        if scans:
+            message = f"{len(scans)} queries do sequential scans: {', '.join(scans)}"
+            if options["fail_on_scan"]:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS("No sequential scans"))
@@ -0,0 +1,26 @@
+import gzip
+import json
+import sys
+
+from django.core.management.base import BaseCommand
+
+from chat_app.history import export
+
+
+class Command(BaseCommand):
+    help = "Exports chats and messages as newline-delimited JSON. Output is compressed if the file name ends with .gz."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", default="-", help="Output file, standard output by default")
+        parser.add_argument("--no-archived", action="store_true", help="Leave archived messages out")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="How many rows are read at once")
+
+    def handle(self, *args, **options):
+        output = options["output"]
+        if output == "-":
+            counts = export(sys.stdout, not options["no_archived"], options["chunk_size"])
+        else:
+            opener = gzip.open if output.endswith(".gz") else open
+            with opener(output, "wt", encoding="utf-8") as stream:
+                counts = export(stream, not options["no_archived"], options["chunk_size"])
+        self.stderr.write(f"Exported {json.dumps(counts)}")
@@ -0,0 +1,48 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from chat_app import visitor_pool
+
+
+class Command(BaseCommand):
+    help = (
+        "Keeps a pool of Giosg visitors created ahead of time, so that chats of new users start faster. "
+        "Run this alongside the web server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=5,
+                            help="How often the pool is checked, in seconds")
+        parser.add_argument("--once", action="store_true", help="Refill the pool once and exit")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Maintaining visitor pool")
+        org_id, room_id = settings.GIOSG_ORGANIZATION_ID, settings.GIOSG_ROOM_ID
+        warm_tokens = visitor_pool.tokens_are_shared()
+        if not warm_tokens:
+            self.stderr.write(
+                "Cache is local to this process, so access tokens of pooled visitors are not warmed up and chats "
+                "of new users still authenticate their visitor. Use DJANGO_CACHE_PROFILE=file or redis."
+            )
+        try:
+            while True:
+                close_old_connections()
+                try:
+                    created = visitor_pool.refill(org_id, room_id)
+                    if created:
+                        self.stdout.write(f"Added {created} visitors to the pool")
+                    if warm_tokens:
+                        visitor_pool.warm_tokens(org_id)
+                except Exception as ex:
+                    # Most likely Giosg or the database is unavailable, try again later
+                    self.stderr.write(f"Failed to maintain visitor pool: {ex!r}")
+                if options["once"]:
+                    return
+                time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connection.close()
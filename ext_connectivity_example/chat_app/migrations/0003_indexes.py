@@ -0,0 +1,47 @@
+# Generated by Django 4.0.2 on 2026-10-18 16:40
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def remove_duplicate_messages(apps, schema_editor):
+    """
+    Replayed webhooks could create the same message many times before giosg_message_id was unique.
+    Keeps the first copy of each message.
+    """
+    ChatMessage = apps.get_model("chat_app", "ChatMessage")
+    duplicated_ids = (
+        ChatMessage.objects
+        .values("giosg_message_id")
+        .annotate(count=Count("id"))
+        .filter(count__gt=1)
+        .values_list("giosg_message_id", flat=True)
+    )
+    for giosg_message_id in duplicated_ids.iterator():
+        copies = ChatMessage.objects.filter(giosg_message_id=giosg_message_id).order_by("created_at", "id")
+        ChatMessage.objects.filter(pk__in=list(copies.values_list("pk", flat=True)[1:])).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_app', '0002_remove_visitor_giosg_visitor_global_id_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_messages, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='giosg_message_id',
+            field=models.CharField(max_length=256, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='visitor',
+            name='giosg_visitor_id',
+            field=models.CharField(db_index=True, max_length=256),
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['chat', 'created_at'], name='chatmessage_chat_created_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.0.2 on 2026-10-18 17:05
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def set_updated_at(apps, schema_editor):
+    ChatConversation = apps.get_model("chat_app", "ChatConversation")
+    ChatConversation.objects.update(updated_at=F("created_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_app', '0003_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatconversation',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(set_updated_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='chatconversation',
+            index=models.Index(fields=['created_at', 'id'], name='chat_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatconversation',
+            index=models.Index(fields=['updated_at'], name='chat_updated_idx'),
+        ),
+    ]
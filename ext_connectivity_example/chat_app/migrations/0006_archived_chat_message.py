@@ -0,0 +1,44 @@
+# Generated by Django 4.0.2 on 2026-10-18 17:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_app', '0005_push_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedChatMessage',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('giosg_message_id', models.CharField(db_index=True, max_length=256)),
+                ('created_at', models.DateTimeField()),
+                ('sender_id', models.CharField(max_length=256)),
+                ('sender_name', models.CharField(max_length=256)),
+                ('message', models.CharField(max_length=2048)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='chatconversation',
+            name='ended_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='chatconversation',
+            index=models.Index(fields=['ended_at'], name='chat_ended_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedchatmessage',
+            name='chat',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='chat_app.chatconversation'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedchatmessage',
+            index=models.Index(fields=['chat', 'created_at'], name='archivedmessage_chat_idx'),
+        ),
+    ]
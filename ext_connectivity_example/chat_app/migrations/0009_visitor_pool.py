@@ -0,0 +1,18 @@
+# Generated by Django 4.0.2 on 2026-10-18 17:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_app', '0008_outbound_message'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='visitor',
+            name='visitor_name',
+            field=models.CharField(max_length=256, null=True, unique=True),
+        ),
+    ]
@@ -1,4 +1,6 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils import timezone
 import uuid
 
 
@@ -6,12 +8,14 @@ class Visitor(models.Model):
     """
     Model for storing information about Giosg visitors. This could link one-to-one to our third-party
     application user.
+
+    Visitors without a name are waiting in the visitor pool to be given to a new user, see chat_app/visitor_pool.py.
     """
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    giosg_visitor_id = models.CharField(max_length=256)
+    giosg_visitor_id = models.CharField(max_length=256, db_index=True)
     giosg_visitor_secret_id = models.CharField(max_length=256)
     created_at = models.DateTimeField(auto_now_add=True)
-    visitor_name = models.CharField(unique=True, max_length=256)
+    visitor_name = models.CharField(unique=True, null=True, max_length=256)
 
 
 class ChatConversation(models.Model):
@@ -22,7 +26,21 @@ class ChatConversation(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     giosg_chat_id = models.CharField(max_length=256, unique=True)
     visitor = models.ForeignKey(Visitor, on_delete=models.CASCADE)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add, so that chats loaded from Giosg history keep their creation time
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Set when the chat ends on Giosg platform. Messages of chats which ended long ago are archived.
+    ended_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Chat list is paginated by creation time
+            models.Index(fields=["created_at", "id"], name="chat_created_idx"),
+            # Clients poll for chats changed since their previous request
+            models.Index(fields=["updated_at"], name="chat_updated_idx"),
+            # Chats whose messages are archived are looked up by their end time
+            models.Index(fields=["ended_at"], name="chat_ended_idx"),
+        ]
 
 
 class ChatMessage(models.Model):
@@ -31,8 +49,105 @@ class ChatMessage(models.Model):
     """
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     chat = models.ForeignKey(ChatConversation, null=True, on_delete=models.CASCADE)
-    giosg_message_id = models.CharField(max_length=256)
-    created_at = models.DateTimeField(auto_now_add=True)
+    giosg_message_id = models.CharField(max_length=256, unique=True)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    sender_id = models.CharField(max_length=256)
+    sender_name = models.CharField(max_length=256)
+    message = models.CharField(max_length=2048)
+    # Messages can be edited through the API, pollers notice it from the ETag of the message list
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Messages are listed per chat in the order they were created
+            models.Index(fields=["chat", "created_at"], name="chatmessage_chat_created_idx"),
+        ]
+
+
+class ArchivedChatMessage(models.Model):
+    """
+    Message of a chat which ended long ago. Messages are moved here from ChatMessage by the
+    "archive_messages" command, so that the ChatMessage table only holds messages of recent chats.
+    Rows keep the primary key, creation and modification time they had in ChatMessage.
+    """
+    id = models.UUIDField(primary_key=True, editable=False)
+    chat = models.ForeignKey(ChatConversation, null=True, on_delete=models.CASCADE)
+    giosg_message_id = models.CharField(max_length=256, db_index=True)
+    created_at = models.DateTimeField()
     sender_id = models.CharField(max_length=256)
     sender_name = models.CharField(max_length=256)
     message = models.CharField(max_length=2048)
+    # Copied from ChatMessage and set again when the archived message is edited
+    updated_at = models.DateTimeField(editable=False)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Archived messages are listed per chat in the order they were created
+            models.Index(fields=["chat", "created_at"], name="archivedmessage_chat_idx"),
+        ]
+
+
+class PushEvent(models.Model):
+    """
+    Change which is pushed to browsers connected to the event stream (see chat_app/push.py).
+    Events are written by whichever process ingests the change and read by every web server process,
+    so this table works as a small shared log. Old events are deleted after a while.
+    """
+    KIND_CHAT = "chat"
+    KIND_MESSAGE = "message"
+    KIND_CHOICES = [
+        (KIND_CHAT, "Chat"),
+        (KIND_MESSAGE, "Message"),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # Not a foreign key, so that events can outlive their chat
+    chat_id = models.UUIDField()
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class OutboundMessage(models.Model):
+    """
+    Message posted by our visitor which is waiting to be sent to Giosg by the "deliver_outbox" workers
+    (see chat_app/outbox.py). Messages of the same chat are sent one at a time in the order they were
+    posted. Sent messages are kept for a while so that clients can follow their delivery status.
+    """
+    STATUS_PENDING = "pending"
+    STATUS_SENDING = "sending"
+    STATUS_SENT = "sent"
+    STATUS_DEAD = "dead"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_SENDING, "Sending"),
+        (STATUS_SENT, "Sent"),
+        (STATUS_DEAD, "Dead"),
+    ]
+
+    # Sequential, so that messages are delivered in the order they were posted
+    id = models.BigAutoField(primary_key=True)
+    chat = models.ForeignKey(ChatConversation, on_delete=models.CASCADE)
+    message = models.CharField(max_length=2048)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    giosg_message_id = models.CharField(max_length=256, blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers claim the oldest pending messages
+            models.Index(fields=["status", "id"], name="outbound_status_idx"),
+            # Only the oldest unsent message of each chat can be claimed
+            models.Index(fields=["chat", "status"], name="outbound_chat_status_idx"),
+            # Sent messages are deleted after a while
+            models.Index(fields=["sent_at"], name="outbound_sent_idx"),
+        ]
+
+    def __str__(self):
+        return f"Outbound message {self.id} ({self.status})"
@@ -0,0 +1,221 @@
+"""
+Outbox of messages sent by our visitors.
+
+Posting a message only stores it as an OutboundMessage and returns, so the visitor does not wait for
+the Giosg round trip and a failing Giosg call does not lose the message. Workers (see management command
+"deliver_outbox") claim messages and send them to Giosg.
+
+Messages of the same chat are sent strictly in the order they were posted: only the oldest unsent message
+of each chat can be claimed, and it is claimed together with the pending messages following it. The run
+of each chat is sent one message after another in a thread of the shared task graph pool, and runs of
+different chats are sent at the same time. Database rows are only updated by the calling thread. Giosg IDs of
+the chats and their visitors come from the send context cache (see chat_app/caching.py), not from the database.
+
+A failed message is retried with exponential backoff and the rest of its run is put back to wait for it.
+After too many attempts, or right away if Giosg rejects the message, it is marked "dead" and skipped.
+A message whose response was lost may be sent twice, Giosg calls are not idempotent.
+"""
+import logging
+import traceback
+from concurrent.futures import FIRST_COMPLETED, wait
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db.models import Min
+from django.utils import timezone
+
+from giosg_api import api
+from giosg_api.task_graph import get_executor
+
+from . import caching
+from .models import OutboundMessage
+
+logger = logging.getLogger(__name__)
+
+# Defaults for settings.GIOSG_OUTBOX
+DEFAULT_OUTBOX_OPTIONS = {
+    # How many times sending a message is attempted before it is marked dead
+    "max_attempts": 8,
+    # Delay before the first retry in seconds, doubled for each following attempt
+    "retry_delay": 1,
+    "max_retry_delay": 60,
+    # How long a worker may send a message before it is given to another worker, in seconds
+    "lease": 60,
+    # How many chats are sent to at the same time by one worker
+    "concurrency": 8,
+    # How long sent messages are kept for delivery status lookups, in seconds
+    "keep_sent": 3600,
+}
+
+
+def get_option(name):
+    return getattr(settings, "GIOSG_OUTBOX", {}).get(name, DEFAULT_OUTBOX_OPTIONS[name])
+
+
+def enqueue(chat_id, message):
+    """
+    Stores message to be sent to the chat
+    """
+    return OutboundMessage.objects.create(chat_id=chat_id, message=message)
+
+
+def claim(limit=100):
+    """
+    Claims up to "limit" messages for sending. Returns dict of chat ID -> claimed messages of the chat
+    in the order they must be sent.
+    """
+    now = timezone.now()
+    # Give messages of crashed workers back to the outbox
+    OutboundMessage.objects.filter(
+        status=OutboundMessage.STATUS_SENDING, locked_until__lt=now,
+    ).update(status=OutboundMessage.STATUS_PENDING, locked_until=None)
+
+    candidates = list(
+        OutboundMessage.objects
+        .filter(status=OutboundMessage.STATUS_PENDING, available_at__lte=now)
+        .order_by("id")
+        .values_list("id", "chat_id")[:limit * 5]
+    )
+    if not candidates:
+        return {}
+
+    # Only the oldest unsent message of each chat may be sent
+    heads = dict(
+        OutboundMessage.objects
+        .filter(
+            chat_id__in={chat_id for _, chat_id in candidates},
+            status__in=[OutboundMessage.STATUS_PENDING, OutboundMessage.STATUS_SENDING],
+        )
+        .values("chat_id")
+        .annotate(first_id=Min("id"))
+        .values_list("chat_id", "first_id")
+    )
+    runs = {}
+    for message_id, chat_id in candidates:
+        if chat_id in runs:
+            runs[chat_id].append(message_id)
+        elif heads.get(chat_id) == message_id:
+            runs[chat_id] = [message_id]
+
+    claimed_ids = []
+    locked_until = now + timedelta(seconds=get_option("lease"))
+    for head_id, *rest in runs.values():
+        # Conditional update makes sure that only one worker gets the head, and with it the rest of the run
+        updated = OutboundMessage.objects.filter(id=head_id, status=OutboundMessage.STATUS_PENDING).update(
+            status=OutboundMessage.STATUS_SENDING,
+            locked_until=locked_until,
+        )
+        if not updated:
+            continue
+        rest = rest[:limit - len(claimed_ids) - 1]
+        if rest:
+            OutboundMessage.objects.filter(id__in=rest).update(
+                status=OutboundMessage.STATUS_SENDING,
+                locked_until=locked_until,
+            )
+        claimed_ids.extend([head_id, *rest])
+        if len(claimed_ids) >= limit:
+            break
+
+    claimed = {}
+    for message in OutboundMessage.objects.filter(id__in=claimed_ids).order_by("id"):
+        claimed.setdefault(message.chat_id, []).append(message)
+    return claimed
+
+
+def send_run(context, messages):
+    """
+    Sends messages of one chat in order, stopping at the first failure. Returns list of sent message
+    responses and the error, or None if all were sent. Does not touch the database.
+    """
+    sent = []
+    try:
+        access_token = api.get_access_token_for_visitor(
+            settings.GIOSG_ORGANIZATION_ID, context.giosg_visitor_id, context.giosg_visitor_secret_id,
+        )
+        for message in messages:
+            sent.append(api.send_message_as_visitor(
+                context.giosg_visitor_id, context.giosg_chat_id, access_token, message.message,
+            ))
+    except Exception as ex:
+        return sent, ex
+    return sent, None
+
+
+def is_rejected(error):
+    """
+    Returns True if Giosg refused the message, so that sending it again would not help
+    """
+    if not isinstance(error, requests.HTTPError) or error.response is None:
+        return False
+    return 400 <= error.response.status_code < 500 and error.response.status_code != 429
+
+
+def fail(message, error):
+    message.attempts += 1
+    message.last_error = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+    message.locked_until = None
+    if message.attempts >= get_option("max_attempts") or is_rejected(error):
+        message.status = OutboundMessage.STATUS_DEAD
+        logger.error("Outbound message %s failed %s times, giving up: %r", message.id, message.attempts, error)
+    else:
+        delay = min(get_option("retry_delay") * 2 ** (message.attempts - 1), get_option("max_retry_delay"))
+        message.status = OutboundMessage.STATUS_PENDING
+        message.available_at = timezone.now() + timedelta(seconds=delay)
+        logger.warning("Outbound message %s failed, retrying in %ss: %r", message.id, delay, error)
+    message.save(update_fields=["attempts", "last_error", "locked_until", "status", "available_at"])
+
+
+def record(messages, sent, error):
+    """
+    Stores outcome of send_run()
+    """
+    now = timezone.now()
+    for message, response in zip(messages, sent):
+        message.status = OutboundMessage.STATUS_SENT
+        message.sent_at = now
+        message.locked_until = None
+        message.giosg_message_id = response["id"]
+    OutboundMessage.objects.bulk_update(messages[:len(sent)], ["status", "sent_at", "locked_until", "giosg_message_id"])
+    if error is None:
+        return
+    fail(messages[len(sent)], error)
+    # Rest of the run waits until the failed message has been sent
+    OutboundMessage.objects.filter(id__in=[message.id for message in messages[len(sent) + 1:]]).update(
+        status=OutboundMessage.STATUS_PENDING, locked_until=None,
+    )
+
+
+def deliver_batch(limit=100, concurrency=None):
+    """
+    Claims and sends one batch of messages, runs of at most "concurrency" chats at the same time.
+    Returns the number of sent messages.
+    """
+    concurrency = concurrency or get_option("concurrency")
+    claimed = claim(limit)
+    contexts = caching.send_contexts.get_many([str(chat_id) for chat_id in claimed])
+    # Messages of a chat deleted after they were claimed were deleted with it
+    pending = [(contexts[str(chat_id)], messages) for chat_id, messages in claimed.items() if str(chat_id) in contexts]
+    sent_count = 0
+    running = {}
+    while pending or running:
+        while pending and len(running) < concurrency:
+            context, messages = pending.pop()
+            running[get_executor().submit(send_run, context, messages)] = messages
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            messages = running.pop(future)
+            sent, error = future.result()
+            record(messages, sent, error)
+            sent_count += len(sent)
+    return sent_count
+
+
+def delete_sent():
+    """
+    Deletes messages which were sent longer than "keep_sent" seconds ago. Returns the number of deleted rows.
+    """
+    sent_before = timezone.now() - timedelta(seconds=get_option("keep_sent"))
+    deleted, _ = OutboundMessage.objects.filter(sent_at__lt=sent_before).delete()
+    return deleted
@@ -0,0 +1,22 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ChatConversationCursorPagination(CursorPagination):
+    """
+    Keyset pagination for the chat list. Pages are read from the (created_at, id) index, so
+    fetching a page costs the same no matter how many chats there are.
+    """
+    ordering = ("created_at", "id")
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
+
+
+class ChatMessageCursorPagination(CursorPagination):
+    """
+    Keyset pagination for messages of a chat, read from the (chat, created_at) index
+    """
+    ordering = ("created_at", "id")
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 500
@@ -0,0 +1,346 @@
+"""
+Server push of new chats and messages to browsers with Server-Sent Events.
+
+Whichever process ingests a change (usually a "process_webhooks" worker) writes it to the PushEvent table.
+Each web server process runs one hub which tails that table and fans new events out to all of its
+connected browsers, so the database is polled once per process instead of once per browser.
+
+The event stream is served at /api/events/ by the ASGI app (see ext_connectivity_example/asgi.py).
+Every browser gets chat events, message events only if it subscribed to the chat with ?chat_id=<id>.
+Browsers which reconnect send the id of the last event they got and missed events are replayed.
+
+Event ids are allocated when a transaction inserts the event but become visible when it commits, so with
+concurrent writers an event can show up after events with higher ids. The hub remembers the ids it skipped
+over and reads them again until they appear or GIOSG_PUSH["missing_timeout"] passes (ids of rolled back
+transactions never appear).
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import ChatConversation, PushEvent
+
+logger = logging.getLogger(__name__)
+
+EVENTS_PATH = "/api/events/"
+
+# Defaults for settings.GIOSG_PUSH
+DEFAULT_PUSH_OPTIONS = {
+    # How often the hub checks for new events, in seconds
+    "poll_interval": 0.05,
+    # How many events are read at once
+    "batch_size": 500,
+    # Comment sent to idle connections so that proxies do not close them, in seconds
+    "heartbeat": 15,
+    # How long events are kept for replaying to reconnecting browsers, in seconds
+    "retention": 300,
+    # Events waiting to be sent to one browser. Slower browsers are disconnected and replay when they reconnect.
+    "queue_size": 1000,
+    # How long the hub keeps looking for events whose ids were skipped, in seconds
+    "missing_timeout": 5,
+}
+
+
+def get_option(name):
+    return getattr(settings, "GIOSG_PUSH", {}).get(name, DEFAULT_PUSH_OPTIONS[name])
+
+
+def publish_messages(messages):
+    """
+    Publishes created ChatMessage objects to connected browsers
+    """
+    from .serializers import ChatMessageSerializer
+
+    PushEvent.objects.bulk_create([
+        PushEvent(kind=PushEvent.KIND_MESSAGE, chat_id=message.chat_id, payload=data)
+        for message, data in zip(messages, ChatMessageSerializer(messages, many=True).data)
+    ])
+
+
+def publish_chat(chat):
+    """
+    Publishes created or changed ChatConversation to connected browsers
+    """
+    from .serializers import ChatConversationSerializer
+
+    PushEvent.objects.create(kind=PushEvent.KIND_CHAT, chat_id=chat.pk, payload=ChatConversationSerializer(chat).data)
+
+
+@receiver(post_save, sender=ChatConversation)
+def _publish_saved_chat(instance, **kwargs):
+    transaction.on_commit(lambda: publish_chat(instance))
+
+
+def fetch_events(after_id, limit, chat_id=None, missing_ids=()):
+    """
+    Returns events newer than "after_id" and events with "missing_ids" as (id, kind, chat_id, payload) tuples
+    """
+    condition = Q(id__gt=after_id)
+    if missing_ids:
+        condition |= Q(id__in=missing_ids)
+    queryset = PushEvent.objects.filter(condition).order_by("id")
+    if chat_id is not None:
+        queryset = queryset.filter(Q(kind=PushEvent.KIND_CHAT) | Q(chat_id=chat_id))
+    return list(queryset.values_list("id", "kind", "chat_id", "payload")[:limit])
+
+
+def latest_event_id():
+    return PushEvent.objects.order_by("-id").values_list("id", flat=True).first() or 0
+
+
+def delete_old_events():
+    """
+    Deletes events older than the retention. Called by the hubs and the "process_webhooks" command,
+    so that the table does not grow when no browsers are connected or the app is served with WSGI.
+    """
+    return PushEvent.objects.filter(
+        created_at__lt=timezone.now() - timedelta(seconds=get_option("retention"))
+    ).delete()[0]
+
+
+def format_event(event_id, kind, payload):
+    data = json.dumps(payload, cls=DjangoJSONEncoder, separators=(",", ":"))
+    return f"id: {event_id}\nevent: {kind}\ndata: {data}\n\n".encode("utf-8")
+
+
+class Subscriber:
+    """
+    One connected browser. Hub puts (event_id, formatted_event) tuples to its queue,
+    None means that the browser fell too far behind and must be disconnected.
+    """
+    __slots__ = ("chat_id", "queue", "replayed_until", "__weakref__")
+
+    def __init__(self, chat_id=None):
+        self.chat_id = chat_id
+        self.queue = asyncio.Queue(get_option("queue_size"))
+        # Events up to this id were already sent while replaying
+        self.replayed_until = 0
+
+    def put(self, event_id, frame):
+        try:
+            self.queue.put_nowait((event_id, frame))
+        except asyncio.QueueFull:
+            # The browser replays missed events when it reconnects
+            self.close()
+
+    def close(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class PushHub:
+    """
+    Tails the PushEvent table while there are subscribers and fans events out to them.
+    One hub is used per event loop.
+    """
+
+    def __init__(self):
+        self.subscribers = set()
+        self.chat_subscribers = {}
+        self.last_id = None
+        # Skipped event id -> time.monotonic() until which it is looked for
+        self.missing = {}
+        self._task = None
+        # All database access of the hub happens in one thread which keeps its connection open
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="push-hub")
+
+    async def run_sync(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def subscribe(self, chat_id=None):
+        subscriber = Subscriber(chat_id)
+        if self.last_id is None:
+            self.last_id = await self.run_sync(latest_event_id)
+        self.subscribers.add(subscriber)
+        if chat_id is not None:
+            self.chat_subscribers.setdefault(chat_id, set()).add(subscriber)
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+        if subscriber.chat_id is not None:
+            chat_subscribers = self.chat_subscribers.get(subscriber.chat_id)
+            if chat_subscribers is not None:
+                chat_subscribers.discard(subscriber)
+                if not chat_subscribers:
+                    del self.chat_subscribers[subscriber.chat_id]
+
+    def dispatch(self, event_id, kind, chat_id, payload):
+        frame = format_event(event_id, kind, payload)
+        if kind == PushEvent.KIND_CHAT:
+            receivers = self.subscribers
+        else:
+            receivers = self.chat_subscribers.get(str(chat_id), ())
+        for subscriber in list(receivers):
+            subscriber.put(event_id, frame)
+
+    def receive(self, events):
+        """
+        Dispatches events read with fetch_events() which were not dispatched yet
+        """
+        now = time.monotonic()
+        for event in events:
+            event_id = event[0]
+            if event_id > self.last_id:
+                # Ids skipped over may still be committed. Huge gaps are not from concurrent writers.
+                deadline = now + get_option("missing_timeout")
+                for missing_id in range(max(self.last_id + 1, event_id - get_option("batch_size")), event_id):
+                    self.missing[missing_id] = deadline
+                self.last_id = event_id
+            elif self.missing.pop(event_id, None) is None:
+                continue
+            self.dispatch(*event)
+        for missing_id, deadline in list(self.missing.items()):
+            if deadline <= now:
+                del self.missing[missing_id]
+
+    async def _run(self):
+        cleaned_at = 0
+        try:
+            while self.subscribers:
+                try:
+                    events = await self.run_sync(
+                        fetch_events, self.last_id, get_option("batch_size"), None, list(self.missing),
+                    )
+                    if time.monotonic() - cleaned_at > 60:
+                        cleaned_at = time.monotonic()
+                        await self.run_sync(delete_old_events)
+                except Exception:
+                    logger.exception("Failed to read push events")
+                    # Reconnect on next try
+                    await self.run_sync(connection.close)
+                    await asyncio.sleep(1)
+                    continue
+
+                self.receive(events)
+                if len(events) < get_option("batch_size"):
+                    await asyncio.sleep(get_option("poll_interval"))
+        finally:
+            self._task = None
+            self.last_id = None
+            self.missing = {}
+
+
+_hubs = weakref.WeakKeyDictionary()
+
+
+def get_hub():
+    """
+    Returns hub of the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    hub = _hubs.get(loop)
+    if hub is None:
+        hub = _hubs[loop] = PushHub()
+    return hub
+
+
+async def event_stream_app(scope, receive, send):
+    """
+    ASGI app serving the Server-Sent Events stream
+
+    GET /api/events/?chat_id=<chat id>
+    """
+    if scope["method"] != "GET":
+        await send_error(send, 405, "Only GET requests supported")
+        return
+
+    chat_id = parse_qs(scope["query_string"].decode("latin-1")).get("chat_id", [None])[0]
+    if chat_id is not None:
+        try:
+            chat_id = str(uuid.UUID(chat_id))
+        except ValueError:
+            await send_error(send, 400, "Invalid chat_id")
+            return
+    last_event_id = dict(scope["headers"]).get(b"last-event-id", b"")
+    last_event_id = int(last_event_id) if last_event_id.isdigit() else None
+
+    hub = get_hub()
+    subscriber = await hub.subscribe(chat_id)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream"),
+                (b"cache-control", b"no-cache"),
+                # Tells nginx not to buffer the stream
+                (b"x-accel-buffering", b"no"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": b"retry: 2000\n\n", "more_body": True})
+
+        if last_event_id is not None:
+            await replay(hub, subscriber, last_event_id, send)
+
+        while not disconnected.done():
+            next_event = asyncio.ensure_future(subscriber.queue.get())
+            await asyncio.wait({next_event, disconnected}, timeout=get_option("heartbeat"),
+                               return_when=asyncio.FIRST_COMPLETED)
+            if not next_event.done():
+                next_event.cancel()
+                if not disconnected.done():
+                    await send({"type": "http.response.body", "body": b": heartbeat\n\n", "more_body": True})
+                continue
+
+            # Send everything that is waiting at once
+            items = [next_event.result()]
+            while not subscriber.queue.empty():
+                items.append(subscriber.queue.get_nowait())
+            if None in items:
+                break
+            body = b"".join(frame for event_id, frame in items if event_id > subscriber.replayed_until)
+            if body:
+                await send({"type": "http.response.body", "body": body, "more_body": True})
+    finally:
+        hub.unsubscribe(subscriber)
+        disconnected.cancel()
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def replay(hub, subscriber, last_event_id, send):
+    """
+    Sends events which the browser missed while it was disconnected
+    """
+    while True:
+        events = await hub.run_sync(fetch_events, last_event_id, get_option("batch_size"), subscriber.chat_id)
+        if not events:
+            return
+        body = b"".join(format_event(event_id, kind, payload) for event_id, kind, _, payload in events)
+        await send({"type": "http.response.body", "body": body, "more_body": True})
+        last_event_id = subscriber.replayed_until = events[-1][0]
+
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def send_error(send, status, detail):
+    body = json.dumps({"detail": detail}).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode("latin-1"))],
+    })
+    await send({"type": "http.response.body", "body": body})
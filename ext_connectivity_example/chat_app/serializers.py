@@ -1,8 +1,11 @@
 from rest_framework import serializers
+
+from ext_connectivity_example.instrumentation import TimedListSerializer, TimedSerializerMixin
+
 from . import models
 
 
-class ChatConversationSerializer(serializers.ModelSerializer):
+class ChatConversationSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer used when listing chat conversations
     """
@@ -11,29 +14,51 @@ class ChatConversationSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.ChatConversation
         fields = "__all__"
+        list_serializer_class = TimedListSerializer
 
     def get_visitor_name(self, obj):
         return obj.visitor.visitor_name
 
 
-class ChatConversationCreateSerializer(serializers.Serializer):
+class ChatConversationCreateSerializer(TimedSerializerMixin, serializers.Serializer):
     """
     Serializer used when creating chat conversations
     """
     visitor_name = serializers.CharField(max_length=256)
 
 
-class ChatMessageSerializer(serializers.ModelSerializer):
+class ChatMessageSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer used when listing chat messages
     """
     class Meta:
         model = models.ChatMessage
         fields = "__all__"
+        list_serializer_class = TimedListSerializer
+
+
+class ArchivedChatMessageSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """
+    Serializer used when listing archived chat messages. Output is the same as for chat messages.
+    """
+    class Meta:
+        model = models.ArchivedChatMessage
+        exclude = ("archived_at",)
+        list_serializer_class = TimedListSerializer
 
 
-class ChatMessageCreateSerializer(serializers.Serializer):
+class ChatMessageCreateSerializer(TimedSerializerMixin, serializers.Serializer):
     """
     Serializer used when creating chat messages
     """
     message = serializers.CharField(max_length=2048)
+
+
+class OutboundMessageSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """
+    Serializer used for delivery status of messages posted by our visitor
+    """
+    class Meta:
+        model = models.OutboundMessage
+        exclude = ("locked_until", "last_error")
+        list_serializer_class = TimedListSerializer
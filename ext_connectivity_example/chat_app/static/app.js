@@ -2,6 +2,16 @@ const STATE = {
   lastChatListUpdate: new Date(),
   lastMessageUpdate: new Date(),
   currentChatId: undefined,
+  // Chats by id, only chats changed since "chatsSince" are fetched after the first load
+  chats: new Map(),
+  chatsSince: undefined,
+  // Id of the newest message shown, only messages after it are fetched
+  lastMessageId: undefined,
+  shownMessageIds: new Set(),
+  // Server pushes new chats and messages while connected, polling is only a fallback
+  eventSource: undefined,
+  pushConnected: false,
+  messagePoller: undefined,
 };
 
 /**
@@ -10,9 +20,48 @@ const STATE = {
 const startApp = () => {
   setupClickHandlers();
   refreshChatList(true);
+  connectEvents();
   setInterval(refreshChatList, 500);
 };
 
+const connectEvents = () => {
+  if (!window.EventSource) {
+    return;
+  }
+  if (STATE.eventSource) {
+    STATE.eventSource.close();
+  }
+  let url = "/api/events/";
+  if (STATE.currentChatId) {
+    url += `?chat_id=${STATE.currentChatId}`;
+  }
+  const source = new EventSource(url);
+  source.addEventListener("open", () => {
+    STATE.pushConnected = true;
+    // Catch up with anything that happened while we were not connected
+    refreshChatList(true);
+    if (STATE.currentChatId) {
+      refreshMessageList(true);
+    }
+  });
+  source.addEventListener("error", () => {
+    // Browser reconnects by itself unless the server does not support push at all (WSGI)
+    STATE.pushConnected = false;
+  });
+  source.addEventListener("chat", (event) => {
+    const chat = JSON.parse(event.data);
+    STATE.chats.set(chat.id, chat);
+    renderChatList();
+  });
+  source.addEventListener("message", (event) => {
+    const message = JSON.parse(event.data);
+    if (message.chat === STATE.currentChatId) {
+      appendMessages([message]);
+    }
+  });
+  STATE.eventSource = source;
+};
+
 const setupClickHandlers = () => {
   // Start chat button, creates new visitor and chat
   const startBtn = document.getElementById("start-chat");
@@ -73,28 +122,50 @@ const setupClickHandlers = () => {
   });
 };
 
+const fetchChats = async () => {
+  // Chat list is paginated, follow "next" links until we have all new and changed chats
+  let url = "/api/chats/";
+  if (STATE.chatsSince) {
+    url += `?since=${encodeURIComponent(STATE.chatsSince)}`;
+  }
+  let since;
+  while (url) {
+    const response = await fetch(url);
+    const page = await response.json();
+    since = since || page.since;
+    page.results.forEach((chat) => STATE.chats.set(chat.id, chat));
+    url = page.next;
+  }
+  STATE.chatsSince = since;
+};
+
 const refreshChatList = async (force) => {
+  if (!force && STATE.pushConnected) {
+    return;
+  }
   if (force || new Date() - STATE.lastChatListUpdate > 1000) {
-    const response = await fetch("/api/chats/");
-    const chatList = await response.json();
-    console.log("Fetched chats:", chatList);
-
-    const chatListEl = document.getElementById("chat-list");
-    chatListEl.innerHTML = "";
-    chatList.forEach((chat) => {
-      const chatRow = document.createElement("a");
-      chatRow.href = "#";
-      chatRow.className = "list-group-item list-group-item-action";
-      chatRow.innerText = `Chat of "${chat.visitor_name}"`;
-      chatListEl.appendChild(chatRow);
-      chatRow.addEventListener("click", async () => {
-        showChat(chat.id);
-      });
-    });
+    await fetchChats();
+    console.log("Fetched chats:", STATE.chats);
+    renderChatList();
     STATE.lastChatListUpdate = new Date();
   }
 };
 
+const renderChatList = () => {
+  const chatListEl = document.getElementById("chat-list");
+  chatListEl.innerHTML = "";
+  STATE.chats.forEach((chat) => {
+    const chatRow = document.createElement("a");
+    chatRow.href = "#";
+    chatRow.className = "list-group-item list-group-item-action";
+    chatRow.innerText = `Chat of "${chat.visitor_name}"`;
+    chatListEl.appendChild(chatRow);
+    chatRow.addEventListener("click", async () => {
+      showChat(chat.id);
+    });
+  });
+};
+
 const refreshVisitorList = async () => {
   const response = await fetch("/api/visitors");
   const visitorList = await response.json();
@@ -120,29 +191,59 @@ const showChat = async (chatId) => {
   conversations.style.display = "none";
   const chatHistory = document.getElementById("chat-history");
   chatHistory.style.display = "block";
+  // Subscribe to messages of this chat
+  STATE.pushConnected = false;
+  connectEvents();
   await refreshMessageList(true);
-  setInterval(refreshMessageList, 500);
+  clearInterval(STATE.messagePoller);
+  STATE.messagePoller = setInterval(refreshMessageList, 500);
+};
+
+const fetchNewMessages = async () => {
+  let url = `/api/chats/${STATE.currentChatId}/messages/`;
+  if (STATE.lastMessageId) {
+    url += `?after=${STATE.lastMessageId}`;
+  }
+  const messages = [];
+  while (url) {
+    // Server answers with 304 when nothing has changed and the browser gives us the cached page
+    const response = await fetch(url);
+    const page = await response.json();
+    messages.push(...page.results);
+    url = page.next;
+  }
+  return messages;
 };
 
 const refreshMessageList = async (force) => {
+  if (!force && STATE.pushConnected) {
+    return;
+  }
   if (force || new Date() - STATE.lastMessageUpdate > 1000) {
     console.log("Fetching messages..");
-    const response = await fetch(`/api/chats/${STATE.currentChatId}/messages/`);
-    const messageList = await response.json();
-    console.log("Messages", messageList);
-
-    const messageListEl = document.getElementById("message-list");
-    messageListEl.innerHTML = "";
-    messageList.forEach((message) => {
-      const messageRow = document.createElement("a");
-      messageRow.href = "#";
-      messageRow.className = "list-group-item";
-      messageRow.innerText = `${message.sender_name}: "${message.message}"`;
-      messageListEl.appendChild(messageRow);
-    });
+    const messageList = await fetchNewMessages();
+    console.log("New messages", messageList);
+    appendMessages(messageList);
     STATE.lastMessageUpdate = new Date();
   }
 };
 
+const appendMessages = (messageList) => {
+  const messageListEl = document.getElementById("message-list");
+  messageList.forEach((message) => {
+    // Pushed and fetched messages may overlap
+    if (STATE.shownMessageIds.has(message.id)) {
+      return;
+    }
+    STATE.shownMessageIds.add(message.id);
+    const messageRow = document.createElement("a");
+    messageRow.href = "#";
+    messageRow.className = "list-group-item";
+    messageRow.innerText = `${message.sender_name}: "${message.message}"`;
+    messageListEl.appendChild(messageRow);
+    STATE.lastMessageId = message.id;
+  });
+};
+
 // Start our simple chat app
 startApp();
@@ -1,3 +1,832 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from benchmarks.fake_giosg import FakeGiosgServer
+from ext_connectivity_example import instrumentation
+from ext_connectivity_example.cache_serializers import CompactSerializer
+from giosg_api import api, resilience, token_cache
+from giosg_api.task_graph import TaskGraph, TaskGraphError
+
+from . import archive, async_views, caching, history, outbox, push, visitor_pool
+from .models import ArchivedChatMessage, ChatConversation, ChatMessage, OutboundMessage, PushEvent, Visitor
+from .serializers import ChatConversationCreateSerializer
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+
+class ChatConversationListTests(TestCase):
+
+    def create_chats(self, count):
+        start = ChatConversation.objects.count()
+        for i in range(start, start + count):
+            visitor = Visitor.objects.create(
+                giosg_visitor_id=f"visitor-{i}",
+                giosg_visitor_secret_id=f"secret-{i}",
+                visitor_name=f"Visitor {i}",
+            )
+            ChatConversation.objects.create(giosg_chat_id=f"chat-{i}", visitor=visitor)
+
+    def test_query_count_does_not_depend_on_number_of_chats(self):
+        self.create_chats(1)
+        with self.assertNumQueries(1):
+            self.client.get("/api/chats/")
+
+        self.create_chats(30)
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/chats/")
+        self.assertEqual(len(response.json()["results"]), 31)
+
+    def test_pages_are_followed_with_cursor(self):
+        self.create_chats(5)
+        response = self.client.get("/api/chats/?page_size=2")
+        names = [chat["visitor_name"] for chat in response.json()["results"]]
+        while response.json()["next"]:
+            response = self.client.get(response.json()["next"])
+            names += [chat["visitor_name"] for chat in response.json()["results"]]
+        self.assertEqual(names, [f"Visitor {i}" for i in range(5)])
+
+    def test_since_returns_only_changed_chats(self):
+        self.create_chats(3)
+        since = self.client.get("/api/chats/").json()["since"]
+        self.assertEqual(self.client.get("/api/chats/", {"since": since}).json()["results"], [])
+
+        chat = ChatConversation.objects.get(giosg_chat_id="chat-1")
+        chat.save()
+        results = self.client.get("/api/chats/", {"since": since}).json()["results"]
+        self.assertEqual([result["giosg_chat_id"] for result in results], ["chat-1"])
+
+    def test_invalid_since_is_rejected(self):
+        response = self.client.get("/api/chats/", {"since": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("since", response.json())
+
+    def test_since_accepts_timestamps_with_timezone(self):
+        self.create_chats(1)
+        response = self.client.get("/api/chats/", {"since": (timezone.now() - timezone.timedelta(hours=1)).isoformat()})
+        self.assertEqual(len(response.json()["results"]), 1)
+
+
+class ChatMessageListTests(TestCase):
+
+    def setUp(self):
+        visitor = Visitor.objects.create(
+            giosg_visitor_id="visitor", giosg_visitor_secret_id="secret", visitor_name="Visitor",
+        )
+        self.chat = ChatConversation.objects.create(giosg_chat_id="chat", visitor=visitor)
+        self.url = f"/api/chats/{self.chat.id}/messages/"
+
+    def create_messages(self, count):
+        start = ChatMessage.objects.count()
+        return [
+            ChatMessage.objects.create(
+                chat=self.chat, giosg_message_id=f"message-{i}", sender_id="visitor", sender_name="Visitor",
+                message=f"Message {i}",
+            )
+            for i in range(start, start + count)
+        ]
+
+    def test_after_returns_only_newer_messages(self):
+        messages = self.create_messages(5)
+        response = self.client.get(self.url, {"after": messages[2].id})
+        self.assertEqual([m["giosg_message_id"] for m in response.json()["results"]], ["message-3", "message-4"])
+
+    def test_unknown_after_is_rejected(self):
+        self.assertEqual(self.client.get(self.url, {"after": "not-a-message"}).status_code, 400)
+
+    def test_unchanged_poll_returns_304(self):
+        last = self.create_messages(3)[-1]
+        response = self.client.get(self.url, {"after": last.id})
+        etag = response["ETag"]
+
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {"after": last.id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+        self.create_messages(1)
+        response = self.client.get(self.url, {"after": last.id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m["giosg_message_id"] for m in response.json()["results"]], ["message-3"])
+
+    def test_edited_message_changes_etag(self):
+        message = self.create_messages(2)[0]
+        etag = self.client.get(self.url)["ETag"]
+
+        response = self.client.patch(
+            f"{self.url}{message.id}/", {"message": "Edited"}, content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"][0]["message"], "Edited")
+
+
+class MessageArchiveTests(TestCase):
+
+    def setUp(self):
+        self.visitor = Visitor.objects.create(
+            giosg_visitor_id="visitor", giosg_visitor_secret_id="secret", visitor_name="Visitor",
+        )
+
+    def create_chat(self, giosg_chat_id, ended_days_ago, message_count):
+        ended_at = None if ended_days_ago is None else timezone.now() - timezone.timedelta(days=ended_days_ago)
+        chat = ChatConversation.objects.create(giosg_chat_id=giosg_chat_id, visitor=self.visitor, ended_at=ended_at)
+        for i in range(message_count):
+            ChatMessage.objects.create(
+                chat=chat, giosg_message_id=f"{giosg_chat_id}-message-{i}", sender_id="visitor",
+                sender_name="Visitor", message=f"Message {i}",
+            )
+        return chat
+
+    def test_messages_of_chats_ended_long_ago_are_moved_in_batches(self):
+        old_chat = self.create_chat("old", 40, 5)
+        self.create_chat("recent", 10, 2)
+        self.create_chat("open", None, 2)
+        created = dict(ChatMessage.objects.filter(chat=old_chat).values_list("id", "created_at"))
+
+        # Three batches, each a select, an insert and a delete in a transaction (a savepoint in tests)
+        with self.assertNumQueries(3 * 5):
+            self.assertEqual(archive.archive_messages(30, batch_size=2, pause=0), 5)
+        self.assertEqual(dict(ArchivedChatMessage.objects.values_list("id", "created_at")), created)
+        self.assertEqual(
+            set(ChatMessage.objects.values_list("chat__giosg_chat_id", flat=True)), {"recent", "open"},
+        )
+        self.assertEqual(archive.archive_messages(30, pause=0), 0)
+
+    def test_archived_messages_are_listed(self):
+        chat = self.create_chat("old", 40, 3)
+        url = f"/api/chats/{chat.id}/messages/"
+        live = self.client.get(url).json()["results"]
+        archive.archive_messages(30, pause=0)
+
+        self.assertEqual(self.client.get(url).json()["results"], [])
+        archived = self.client.get(url, {"archived": "true"}).json()["results"]
+        self.assertEqual(archived, live)
+        response = self.client.get(url, {"archived": "true", "after": live[0]["id"]})
+        self.assertEqual(response.json()["results"], live[1:])
+
+
+class HistoryTests(TestCase):
+
+    def setUp(self):
+        # IDs cached by other tests point to rows which were rolled back
+        cache.clear()
+        caching.chat_ids.reset()
+        caching.visitor_ids.reset()
+        self.server = FakeGiosgServer().start()
+        self.addCleanup(self.server.stop)
+        settings_override = override_settings(GIOSG_API_BASE_URL=self.server.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        Visitor.objects.create(giosg_visitor_id="our-visitor", giosg_visitor_secret_id="secret", visitor_name="Visitor")
+        # Every other chat belongs to a visitor which is not ours
+        self.server.state.add_history("org", ["our-visitor", "other-visitor"], chat_count=6, messages_per_chat=3)
+
+    def test_chats_of_our_visitors_are_loaded_with_their_history(self):
+        counts = history.backfill("org", page_size=2, chunk_size=2)
+        self.assertEqual(counts, {"chats": 3, "messages": 9})
+        chat = ChatConversation.objects.order_by("created_at").first()
+        giosg_chat = self.server.state.chats[chat.giosg_chat_id]
+        self.assertEqual(chat.created_at.isoformat()[:23], giosg_chat["created_at"][:23])
+        self.assertIsNotNone(chat.ended_at)
+        self.assertEqual(
+            list(chat.chatmessage_set.order_by("created_at").values_list("giosg_message_id", flat=True)),
+            [message["id"] for message in self.server.state.messages[chat.giosg_chat_id]],
+        )
+
+    def test_backfill_continues_from_checkpoint(self):
+        checkpoints = []
+        history.backfill("org", page_size=2, on_checkpoint=checkpoints.append)
+        self.assertEqual(len(checkpoints), 3)
+        self.assertIsNone(checkpoints[-1])
+
+        ChatConversation.objects.all().delete()
+        counts = history.backfill("org", checkpoint=checkpoints[1], page_size=2)
+        self.assertEqual(counts, {"chats": 1, "messages": 3})
+
+    def test_export_writes_one_object_per_line(self):
+        history.backfill("org")
+        archive.archive_messages(30, batch_size=4, pause=0, max_batches=1)
+        stream = io.StringIO()
+        counts = history.export(stream, chunk_size=2)
+        self.assertEqual(counts, {"chats": 3, "messages": 5, "archived_messages": 4})
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([line["type"] for line in lines], ["chat"] * 3 + ["message"] * 5 + ["archived_message"] * 4)
+
+
+@override_settings(GIOSG_INSTRUMENTATION={"enabled": True})
+class InstrumentationTests(TestCase):
+
+    def setUp(self):
+        instrumentation.request_duration.reset()
+        instrumentation.span_duration.reset()
+
+    def server_timing(self, response):
+        return {entry.split(";")[0] for entry in response["Server-Timing"].split(", ")}
+
+    def test_spans_are_returned_in_server_timing_header(self):
+        response = self.client.get("/api/chats/")
+        self.assertEqual(self.server_timing(response), {"db", "serialize", "total"})
+
+    def test_giosg_calls_of_concurrent_tasks_are_recorded(self):
+        with FakeGiosgServer() as server, override_settings(GIOSG_API_BASE_URL=server.url):
+            response = self.client.post("/api/chats/", {"visitor_name": "Visitor"}, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        self.assertLessEqual({
+            "giosg.create_giosg_visitor", "giosg.set_visitor_name", "giosg.create_new_chat_as_visitor", "validate",
+        }, self.server_timing(response))
+
+    def test_metrics_include_histograms_and_cache_statistics(self):
+        self.client.get("/api/chats/")
+        metrics = self.client.get("/metrics").content.decode()
+        self.assertIn('http_request_duration_seconds_count{view="chatconversation-list"} 1', metrics)
+        self.assertIn('http_request_span_duration_seconds_count{view="chatconversation-list",span="db"} 1', metrics)
+        self.assertIn('giosg_id_cache_hits{cache="chat_ids"}', metrics)
+        self.assertIn("giosg_webhook_dedup_received", metrics)
+
+    @override_settings(GIOSG_INSTRUMENTATION={"enabled": False})
+    def test_disabled_instrumentation_adds_no_header(self):
+        self.assertNotIn("Server-Timing", self.client.get("/api/chats/"))
+
+
+@override_settings(
+    GIOSG_HTTP_CLIENT={"timeout": (1, 5), "endpoint_timeouts": {"auth": (1, 0.2)}},
+    GIOSG_RESILIENCE={"window": 4, "min_calls": 2, "max_concurrent_calls": 1, "bulkhead_timeout": 0.05},
+)
+class GiosgOutageTests(TestCase):
+
+    def setUp(self):
+        resilience.stats.reset()
+        self.server = FakeGiosgServer().start()
+        self.addCleanup(self.server.stop)
+        settings_override = override_settings(GIOSG_API_BASE_URL=self.server.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        visitor = Visitor.objects.create(
+            giosg_visitor_id="outage-visitor", giosg_visitor_secret_id="secret", visitor_name="Visitor",
+        )
+        self.chat = ChatConversation.objects.create(giosg_chat_id="outage-chat", visitor=visitor)
+        token_cache.store_token({"visitor_id": "outage-visitor", "access_token": "token", "expires_in": 3600})
+
+    def start_chat(self):
+        return self.client.post("/api/chats/", {"visitor_name": "New visitor"}, content_type="application/json")
+
+    def test_circuit_opens_after_timeouts_and_local_reads_keep_working(self):
+        self.server.inject_fault("auth", delay=1)
+        for _ in range(2):
+            started = time.monotonic()
+            response = self.start_chat()
+            self.assertEqual(response.status_code, 503)
+            self.assertLess(time.monotonic() - started, 1)
+
+        # Circuit is open, Giosg is not called at all
+        response = self.start_chat()
+        self.assertEqual(response.status_code, 503)
+        self.assertGreater(int(response["Retry-After"]), 1)
+        self.assertEqual(self.server.state.request_counts["auth"], 2)
+        self.assertEqual(resilience.stats.snapshot()["rejected_open"], 1)
+
+        self.assertEqual(self.client.get("/api/chats/").status_code, 200)
+        self.assertEqual(self.client.get(f"/api/chats/{self.chat.id}/messages/").status_code, 200)
+
+    def test_bulkhead_rejects_calls_over_the_limit(self):
+        self.server.inject_fault("send_message", delay=0.1)
+        slow_call = threading.Thread(target=api.send_message_as_visitor, args=("outage-visitor", "chat", "token", "Hi"))
+        slow_call.start()
+        self.addCleanup(slow_call.join)
+        while not self.server.state.request_counts["send_message"]:
+            time.sleep(0.01)
+
+        with self.assertRaises(resilience.GiosgUnavailable):
+            api.send_message_as_visitor("outage-visitor", "chat", "token", "Hi")
+        self.assertEqual(resilience.stats.snapshot()["rejected_busy"], 1)
+
+    def test_failed_trial_call_opens_circuit_again(self):
+        breaker = resilience.CircuitBreaker(window=4, min_calls=2, failure_rate=0.5, open_seconds=0)
+        for _ in range(2):
+            breaker.record(False)
+        self.assertEqual(breaker.state, "half_open")
+
+        trial = breaker.before_call()
+        self.assertTrue(trial)
+        # Only one trial call is let through at a time
+        with self.assertRaises(resilience.GiosgUnavailable):
+            breaker.before_call()
+        breaker.record(False, trial)
+        self.assertEqual(resilience.stats.snapshot()["opened"], 2)
+
+        breaker.record(True, breaker.before_call())
+        self.assertEqual(breaker.state, "closed")
+
+
+class IdCacheTests(TestCase):
+
+    def setUp(self):
+        # Shared entries outlive the test transactions
+        cache.clear()
+        caching.chat_ids.reset()
+        caching.visitor_ids.reset()
+        caching.send_contexts.reset()
+        self.visitor = Visitor.objects.create(giosg_visitor_id="cached-visitor", visitor_name="Visitor")
+        self.chat = ChatConversation.objects.create(giosg_chat_id="cached-chat", visitor=self.visitor)
+
+    def assertCached(self, id_cache, giosg_id, pk):
+        self.assertEqual(id_cache.local.get(giosg_id), pk)
+        self.assertEqual(cache.get(id_cache._shared_key(giosg_id)), pk)
+
+    def assertNotCached(self, id_cache, giosg_id):
+        self.assertIsNone(id_cache.local.get(giosg_id))
+        self.assertIsNone(cache.get(id_cache._shared_key(giosg_id)))
+
+    def test_deleted_chat_is_dropped_from_both_tiers(self):
+        self.assertEqual(caching.chat_ids.get("cached-chat"), self.chat.pk)
+        caching.send_contexts.get(str(self.chat.pk))
+        self.assertCached(caching.chat_ids, "cached-chat", self.chat.pk)
+
+        self.chat.delete()
+        self.assertNotCached(caching.chat_ids, "cached-chat")
+        self.assertNotCached(caching.send_contexts, str(self.chat.pk))
+        self.assertIsNone(caching.chat_ids.get("cached-chat"))
+
+    def test_deleted_visitor_is_dropped_from_both_tiers(self):
+        self.assertEqual(caching.visitor_ids.get("cached-visitor"), self.visitor.pk)
+        self.assertCached(caching.visitor_ids, "cached-visitor", self.visitor.pk)
+
+        self.visitor.delete()
+        self.assertNotCached(caching.visitor_ids, "cached-visitor")
+        self.assertNotCached(caching.chat_ids, "cached-chat")
+
+    def test_shared_entry_is_used_by_other_processes(self):
+        caching.chat_ids.get("cached-chat")
+        # Local cache of another process starts empty
+        caching.chat_ids.reset()
+        with self.assertNumQueries(0):
+            self.assertEqual(caching.chat_ids.get("cached-chat"), self.chat.pk)
+        self.assertEqual(caching.chat_ids.stats()["shared_hits"], 1)
+
+
+class TaskGraphTests(TestCase):
+
+    def test_failed_tasks_are_compensated_in_reverse_order(self):
+        compensated = []
+        started = []
+        graph = TaskGraph("test")
+        graph.add("visitor", lambda: "visitor", compensate=compensated.append)
+        graph.add("chat", lambda visitor: f"chat of {visitor}", depends_on=["visitor"], compensate=compensated.append)
+
+        def fail(error):
+            def task(chat):
+                started.append(chat)
+                raise error
+            return task
+
+        graph.add("name", fail(ValueError("name")), depends_on=["chat"])
+        graph.add("message", fail(KeyError("message")), depends_on=["chat"])
+        graph.add("after_name", lambda name: started.append(name), depends_on=["name"])
+
+        with self.assertRaises(TaskGraphError) as raised:
+            graph.run()
+        self.assertEqual(set(raised.exception.errors), {"name", "message"})
+        self.assertIsInstance(raised.exception.errors["name"], ValueError)
+        self.assertEqual(compensated, ["chat of visitor", "visitor"])
+        # Tasks depending on failed ones are not started
+        self.assertEqual(started, ["chat of visitor", "chat of visitor"])
+
+    def test_giosg_error_of_async_chat_start_is_raised_after_visitor_is_stored(self):
+        with FakeGiosgServer() as server, override_settings(GIOSG_API_BASE_URL=server.url):
+            server.inject_fault("create_chat", status=400)
+            serializer = ChatConversationCreateSerializer(data={"visitor_name": "Async visitor"})
+            serializer.is_valid(raise_exception=True)
+            with self.assertRaises(TaskGraphError) as raised:
+                async_to_sync(async_views.perform_create_chat)(serializer)
+        self.assertEqual(set(raised.exception.errors), {"chat"})
+        self.assertTrue(Visitor.objects.filter(visitor_name="Async visitor").exists())
+
+
+class TokenCacheTests(TestCase):
+
+    def setUp(self):
+        token_cache.reset()
+        token_cache.stats.reset()
+
+    def authenticate(self, organization_id, visitor_secret_id):
+        self.fail("Visitor should not be authenticated")
+
+    def test_token_stored_by_other_process_is_kept_in_memory(self):
+        token_cache.store_token({"visitor_id": "shared-visitor", "access_token": "token", "expires_in": 3600})
+        # Like another process which has not seen the token yet
+        token_cache.reset()
+        self.assertEqual(token_cache.get_token("org", "shared-visitor", "secret", self.authenticate), "token")
+        self.assertEqual(token_cache.get_token("org", "shared-visitor", "secret", self.authenticate), "token")
+        self.assertEqual(token_cache.stats.snapshot()["local_hits"], 1)
+
+    @override_settings(GIOSG_TOKEN_RENEW_AFTER=0)
+    def test_token_in_memory_is_not_used_after_its_renewal_time(self):
+        token_cache.store_token({"visitor_id": "renewed-visitor", "access_token": "old", "expires_in": 3600})
+        # Another process renewed the token
+        cache.set("access_token_renewed-visitor", f"{int(time.time()) + 3600}:new")
+        self.assertEqual(token_cache.get_token("org", "renewed-visitor", "secret", self.authenticate), "new")
+        self.assertEqual(token_cache.stats.snapshot()["local_hits"], 0)
+
+    def test_concurrent_misses_authenticate_once(self):
+        calls = []
+
+        def authenticate(organization_id, visitor_secret_id):
+            calls.append(visitor_secret_id)
+            time.sleep(0.1)
+            visitor = {"visitor_id": "coalesced-visitor", "access_token": "token", "expires_in": 3600}
+            token_cache.store_token(visitor)
+            return visitor
+
+        tokens = []
+        threads = [
+            threading.Thread(target=lambda: tokens.append(
+                token_cache.get_token("org", "coalesced-visitor", "secret", authenticate),
+            ))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(tokens, ["token"] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(token_cache.stats.snapshot()["coalesced_waits"], 4)
+
+    def test_token_is_renewed_in_background_after_80_percent_of_its_lifetime(self):
+        renewed = threading.Event()
+
+        def authenticate(organization_id, visitor_secret_id):
+            visitor = {"visitor_id": "renewing-visitor", "access_token": "new", "expires_in": 3600}
+            token_cache.store_token(visitor)
+            renewed.set()
+            return visitor
+
+        stored_at = time.time()
+        token_cache.store_token({"visitor_id": "renewing-visitor", "access_token": "old", "expires_in": 100})
+        _, renew_at = token_cache._decode_entry(cache.get("access_token_renewing-visitor"))
+        self.assertAlmostEqual(renew_at, stored_at + 80, delta=1)
+        self.assertEqual(token_cache.get_token("org", "renewing-visitor", "secret", self.authenticate), "old")
+
+        # 80 % of the lifetime has passed
+        token_cache.reset()
+        cache.set("access_token_renewing-visitor", token_cache._encode_entry("old", time.time() - 1), 20)
+        self.assertEqual(token_cache.get_token("org", "renewing-visitor", "secret", authenticate), "old")
+        self.assertTrue(renewed.wait(5))
+        while not token_cache.stats.snapshot()["background_refreshes"]:
+            time.sleep(0.01)
+        self.assertEqual(token_cache.get_token("org", "renewing-visitor", "secret", self.authenticate), "new")
+
+    def test_entries_of_other_formats_are_fetched_again(self):
+        # Raw token stored by older versions
+        cache.set("access_token_old-format-visitor", "token", 60)
+        visitor = {"visitor_id": "old-format-visitor", "access_token": "new", "expires_in": 3600}
+
+        def authenticate(organization_id, visitor_secret_id):
+            token_cache.store_token(visitor)
+            return visitor
+
+        self.assertEqual(token_cache.get_token("org", "old-format-visitor", "secret", authenticate), "new")
+
+    def test_compact_serializer_stores_strings_as_text(self):
+        serializer = CompactSerializer()
+        self.assertEqual(serializer.dumps("1700000000:token"), b"\x011700000000:token")
+        # Redis stores integers as they are and returns them as bytes
+        self.assertEqual(serializer.dumps(42), 42)
+        self.assertEqual(serializer.loads(b"42"), 42)
+        for value in ("1700000000:token", "", b"\x01bytes", {"token": "token"}):
+            self.assertEqual(serializer.loads(serializer.dumps(value)), value)
+
+
+class OutboxTests(TestCase):
+
+    def setUp(self):
+        self.server = FakeGiosgServer().start()
+        self.addCleanup(self.server.stop)
+        settings_override = override_settings(GIOSG_API_BASE_URL=self.server.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.chats = []
+        for i in range(2):
+            visitor = Visitor.objects.create(
+                giosg_visitor_id=f"outbox-visitor-{i}", giosg_visitor_secret_id="secret", visitor_name=f"Visitor {i}",
+            )
+            token_cache.store_token({
+                "visitor_id": visitor.giosg_visitor_id, "access_token": "token", "expires_in": 3600,
+            })
+            self.chats.append(ChatConversation.objects.create(giosg_chat_id=f"outbox-chat-{i}", visitor=visitor))
+
+    def post_message(self, chat, message):
+        return self.client.post(
+            f"/api/chats/{chat.id}/messages/", {"message": message}, content_type="application/json",
+        )
+
+    def sent_messages(self, chat):
+        return [message["message"] for message in self.server.state.messages[chat.giosg_chat_id]]
+
+    def test_posted_message_is_only_stored(self):
+        # Chat lookup and insert
+        with self.assertNumQueries(2):
+            response = self.post_message(self.chats[0], "Hello")
+        self.assertEqual(response.status_code, 202)
+        # Chat is known from the send context cache
+        with self.assertNumQueries(1):
+            self.post_message(self.chats[0], "Again")
+        self.assertEqual(response.json()["status"], OutboundMessage.STATUS_PENDING)
+        self.assertEqual(self.server.state.request_counts["send_message"], 0)
+
+        statuses = self.client.get(f"/api/chats/{self.chats[0].id}/outbox/").json()
+        self.assertEqual(
+            [(status["message"], status["status"]) for status in statuses],
+            [("Hello", "pending"), ("Again", "pending")],
+        )
+        self.assertEqual(self.post_message(ChatConversation(), "Hello").status_code, 404)
+        self.assertEqual(self.client.post("/api/chats/not-a-chat/messages/", {"message": "Hello"}).status_code, 404)
+
+    def test_deleted_chat_is_not_sent_to(self):
+        self.assertEqual(self.post_message(self.chats[0], "Hello").status_code, 202)
+        self.chats[0].visitor.delete()
+        self.assertEqual(self.post_message(self.chats[0], "Hello").status_code, 404)
+
+    def test_messages_are_sent_in_order_of_each_chat(self):
+        for i in range(3):
+            for chat in self.chats:
+                self.post_message(chat, f"Message {i}")
+        self.assertEqual(outbox.deliver_batch(), 6)
+
+        for chat in self.chats:
+            self.assertEqual(self.sent_messages(chat), ["Message 0", "Message 1", "Message 2"])
+        self.assertEqual(set(OutboundMessage.objects.values_list("status", flat=True)), {OutboundMessage.STATUS_SENT})
+        self.assertFalse(OutboundMessage.objects.filter(giosg_message_id="").exists())
+
+    def test_failed_message_is_retried_before_the_rest_of_the_chat(self):
+        self.server.inject_fault("send_message", status=503)
+        self.post_message(self.chats[0], "First")
+        self.post_message(self.chats[0], "Second")
+        self.assertEqual(outbox.deliver_batch(), 0)
+
+        first, second = OutboundMessage.objects.order_by("id")
+        self.assertEqual((first.status, first.attempts), (OutboundMessage.STATUS_PENDING, 1))
+        self.assertGreater(first.available_at, timezone.now())
+        self.assertEqual((second.status, second.attempts), (OutboundMessage.STATUS_PENDING, 0))
+        # Second message waits for the first one
+        self.assertEqual(outbox.deliver_batch(), 0)
+        self.assertEqual(self.server.state.request_counts["send_message"], 1)
+
+        self.server.clear_faults()
+        OutboundMessage.objects.filter(id=first.id).update(available_at=timezone.now())
+        self.assertEqual(outbox.deliver_batch(), 2)
+        self.assertEqual(self.sent_messages(self.chats[0]), ["First", "Second"])
+
+    def test_rejected_message_is_not_retried(self):
+        self.server.inject_fault("send_message", status=403)
+        self.post_message(self.chats[0], "Hello")
+        outbox.deliver_batch()
+        message = OutboundMessage.objects.get()
+        self.assertEqual((message.status, message.attempts), (OutboundMessage.STATUS_DEAD, 1))
+
+
+@override_settings(GIOSG_VISITOR_POOL={"low_watermark": 2, "high_watermark": 3, "concurrency": 2})
+class VisitorPoolTests(TestCase):
+
+    def setUp(self):
+        self.server = FakeGiosgServer().start()
+        self.addCleanup(self.server.stop)
+        settings_override = override_settings(GIOSG_API_BASE_URL=self.server.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def start_chat(self, visitor_name):
+        return self.client.post("/api/chats/", {"visitor_name": visitor_name}, content_type="application/json")
+
+    def test_pool_is_refilled_below_low_watermark(self):
+        self.assertEqual(visitor_pool.refill("org", "room"), 3)
+        self.assertEqual(visitor_pool.refill("org", "room"), 0)
+        visitor_pool.claim("First pooled")
+        visitor_pool.claim("Second pooled")
+        self.assertEqual(visitor_pool.refill("org", "room"), 2)
+        self.assertEqual(visitor_pool.pooled().count(), 3)
+
+    def test_new_user_gets_pooled_visitor(self):
+        visitor_pool.refill("org", "room")
+        pooled_ids = set(visitor_pool.pooled().values_list("giosg_visitor_id", flat=True))
+        auth_calls = self.server.state.request_counts["auth"]
+
+        response = self.start_chat("Pooled visitor")
+        self.assertEqual(response.status_code, 201)
+        visitor = Visitor.objects.get(visitor_name="Pooled visitor")
+        self.assertIn(visitor.giosg_visitor_id, pooled_ids)
+        self.assertIn(ChatConversation.objects.get(visitor=visitor).giosg_chat_id, self.server.state.chats)
+        # Token was cached when the visitor was created and the visitor already joined the room
+        self.assertEqual(self.server.state.request_counts["auth"], auth_calls)
+        self.assertEqual(self.server.state.request_counts["create_room_visitor"], 3)
+        self.assertEqual(visitor_pool.pooled().count(), 2)
+
+    @override_settings(GIOSG_ORGANIZATION_ID="org", GIOSG_ROOM_ID="room")
+    def test_tokens_are_not_warmed_up_in_process_local_cache(self):
+        stderr = io.StringIO()
+        call_command("maintain_visitor_pool", "--once", stdout=io.StringIO(), stderr=stderr)
+        self.assertIn("Cache is local to this process", stderr.getvalue())
+        self.assertEqual(visitor_pool.pooled().count(), 3)
+        self.assertEqual(self.server.state.request_counts["auth"], 3)
+
+        with tempfile.TemporaryDirectory() as cache_dir, override_settings(CACHES={"default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": cache_dir,
+        }}):
+            self.assertTrue(visitor_pool.tokens_are_shared())
+
+    def test_visitor_is_created_when_pool_is_empty(self):
+        response = self.start_chat("Unpooled visitor")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.server.state.request_counts["create_room_visitor"], 1)
+        self.assertTrue(Visitor.objects.filter(visitor_name="Unpooled visitor").exists())
+
+
+class PushEventTests(TestCase):
+
+    def setUp(self):
+        self.visitor = Visitor.objects.create(
+            giosg_visitor_id="visitor", giosg_visitor_secret_id="secret", visitor_name="Visitor",
+        )
+
+    def create_chat(self, giosg_chat_id):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ChatConversation.objects.create(giosg_chat_id=giosg_chat_id, visitor=self.visitor)
+
+    def test_saved_chats_are_published(self):
+        chat = self.create_chat("chat")
+        event = PushEvent.objects.get()
+        self.assertEqual((event.kind, event.chat_id, event.payload["giosg_chat_id"]), ("chat", chat.id, "chat"))
+
+    def test_subscribers_get_messages_of_their_chat_only(self):
+        chat = self.create_chat("chat")
+        other_chat = self.create_chat("other-chat")
+        push.publish_messages([
+            ChatMessage.objects.create(
+                chat=c, giosg_message_id=f"message-{c.giosg_chat_id}", sender_id="visitor", sender_name="Visitor",
+                message="Hello",
+            )
+            for c in (chat, other_chat)
+        ])
+
+        events = push.fetch_events(0, 100, chat_id=chat.id)
+        self.assertEqual([kind for _, kind, _, _ in events], ["chat", "chat", "message"])
+        self.assertEqual(events[-1][3]["giosg_message_id"], "message-chat")
+
+    def test_events_committed_out_of_id_order_are_dispatched_once(self):
+        chat = self.create_chat("chat")
+        hub = push.PushHub()
+        hub.last_id = push.latest_event_id()
+        dispatched = []
+        hub.dispatch = lambda event_id, *rest: dispatched.append(event_id)
+
+        def poll():
+            hub.receive(push.fetch_events(hub.last_id, 100, missing_ids=list(hub.missing)))
+
+        events = [PushEvent.objects.create(kind="chat", chat_id=chat.id, payload={}) for _ in range(3)]
+        # Transaction of the second event commits after the third
+        late_id = events[1].id
+        events[1].delete()
+        poll()
+        self.assertEqual(dispatched, [events[0].id, events[2].id])
+
+        PushEvent.objects.create(id=late_id, kind="chat", chat_id=chat.id, payload={})
+        poll()
+        poll()
+        self.assertEqual(dispatched, [events[0].id, events[2].id, late_id])
+        self.assertEqual(hub.missing, {})
+
+    def test_old_events_are_deleted_without_connected_browsers(self):
+        chat = self.create_chat("chat")
+        PushEvent.objects.update(created_at=timezone.now() - timezone.timedelta(seconds=301))
+        new_event = PushEvent.objects.create(kind="chat", chat_id=chat.id, payload={})
+
+        call_command("process_webhooks", "--workers=0", "--stats-interval=0", stdout=io.StringIO())
+        self.assertEqual(list(PushEvent.objects.all()), [new_event])
+
+    @override_settings(GIOSG_PUSH={"missing_timeout": 0})
+    def test_missing_events_are_not_waited_for_after_timeout(self):
+        chat = self.create_chat("chat")
+        hub = push.PushHub()
+        hub.last_id = push.latest_event_id()
+        hub.dispatch = lambda *event: None
+        # Id of a rolled back transaction never shows up
+        hub.receive([(hub.last_id + 2, "chat", chat.id, {})])
+        self.assertEqual(hub.missing, {})
+
+
+class FakeConnection:
+    """
+    Connection of FakeConnectionPool which fails health checks when it is not "healthy"
+    """
+
+    def __init__(self, healthy=True):
+        self.healthy = healthy
+        self.closed = 0
+        self.isolation_level = 1
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, sql):
+        if not self.healthy:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+
+class FakeConnectionPool:
+    """
+    Stands in for psycopg2.pool.ThreadedConnectionPool, hands out the connections in "connections"
+    """
+    connections = []
+
+    def __init__(self, minconn, maxconn, **conn_params):
+        self.connections = list(FakeConnectionPool.connections)
+        self.returned = []
+
+    def getconn(self):
+        return self.connections.pop(0)
+
+    def putconn(self, connection, close=False):
+        self.returned.append((connection, close))
+
+
+@unittest.skipUnless(psycopg2, "psycopg2 is not installed")
+class ConnectionPoolBackendTests(TestCase):
+
+    def setUp(self):
+        from ext_connectivity_example.db_backends.postgresql_pool import base
+
+        self.base = base
+        for target, value in [
+            ("psycopg2.pool.ThreadedConnectionPool", FakeConnectionPool),
+            # Needs a real connection
+            ("psycopg2.extras.register_default_jsonb", lambda **kwargs: None),
+        ]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(base._pools.clear)
+
+    def connect(self, connections, max_size=2):
+        FakeConnectionPool.connections = connections
+        wrapper = self.base.DatabaseWrapper({
+            "NAME": "test", "OPTIONS": {}, "CONN_HEALTH_CHECKS": True, "CONN_MAX_AGE": 0, "TIME_ZONE": None,
+            "AUTOCOMMIT": True, "ATOMIC_REQUESTS": False, "POOL": {"max_size": max_size, "timeout": 0.1},
+        }, alias=f"pool-test-{self.id()}")
+        return wrapper, wrapper.get_new_connection({})
+
+    def assertAllSlotsFree(self, pool, max_size=2):
+        for _ in range(max_size):
+            self.assertTrue(pool._slots.acquire(blocking=False))
+        self.assertFalse(pool._slots.acquire(blocking=False))
+
+    def test_healthy_connection_is_checked_out_and_returned(self):
+        healthy = FakeConnection()
+        wrapper, connection = self.connect([healthy])
+        self.assertIs(connection, healthy)
+        self.assertEqual(wrapper.pool._pool.returned, [])
+
+        wrapper.connection = connection
+        wrapper._close()
+        self.assertEqual(wrapper.pool._pool.returned, [(healthy, False)])
+        self.assertAllSlotsFree(wrapper.pool)
+
+    def test_connection_failing_health_check_is_closed_and_next_one_is_used(self):
+        broken, healthy = FakeConnection(healthy=False), FakeConnection()
+        wrapper, connection = self.connect([broken, healthy])
+        self.assertIs(connection, healthy)
+        self.assertEqual(wrapper.pool._pool.returned, [(broken, True)])
+
+    def test_error_is_raised_when_no_connection_is_healthy(self):
+        broken = [FakeConnection(healthy=False) for _ in range(3)]
+        with self.assertRaises(OperationalError):
+            self.connect(broken)
+        pool = self.base._pools[(f"pool-test-{self.id()}", os.getpid())]
+        # Every connection is returned once
+        self.assertEqual(pool._pool.returned, [(connection, True) for connection in broken])
+        self.assertAllSlotsFree(pool)
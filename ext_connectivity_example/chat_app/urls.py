@@ -1,11 +1,12 @@
 from django.urls import path
 from rest_framework import routers
 
-from .views import ChatConversationViewSet, ChatMessageViewSet, ChatView
+from .views import ChatConversationViewSet, ChatMessageViewSet, ChatView, OutboundMessageViewSet
 
 router = routers.SimpleRouter()
 router.register(r'api/chats', ChatConversationViewSet)
 router.register(r"api/chats/(?P<chat_id>[\w-]+)/messages", ChatMessageViewSet, basename="chat-messages")
+router.register(r"api/chats/(?P<chat_id>[\w-]+)/outbox", OutboundMessageViewSet, basename="chat-outbox")
 
 
 urlpatterns = [
@@ -1,13 +1,38 @@
+import hashlib
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Count, Max, Q
 from django.views.generic import TemplateView
 from django.conf import settings
+from django.http import Http404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags, quote_etag
 from rest_framework import viewsets
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework import status
 
+from . import caching
 from . import models
+from . import outbox
+from . import pagination
 from . import serializers
+from . import visitor_pool
 
 from giosg_api import api
+from giosg_api.task_graph import TaskGraph
+
+
+def store_chat(chat_response, visitor):
+    """
+    Stores chat started by our app to the local database
+    """
+    chat, _ = models.ChatConversation.objects.get_or_create(
+        giosg_chat_id=chat_response["id"],
+        defaults={"visitor": visitor},
+    )
+    return chat
 
 
 class ChatView(TemplateView):
@@ -24,14 +49,36 @@ class ChatConversationViewSet(viewsets.ModelViewSet):
     APIs for listing, updating, retrieving and creating chat conversations.
 
     GET/PUT/PATCH/POST/DELETE /api/chats
+
+    Chat list is paginated with a cursor, follow the "next" links to get all chats. Response also contains
+    "since" timestamp. When it is given as "since" query parameter, only chats created or changed after the
+    previous request are returned.
     """
     serializer_class = serializers.ChatConversationSerializer
-    queryset = models.ChatConversation.objects.all()
+    # Visitor is needed for the visitor name of each chat
+    queryset = models.ChatConversation.objects.select_related("visitor")
+    pagination_class = pagination.ChatConversationCursorPagination
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        since = self.request.query_params.get("since")
+        if since:
+            since_datetime = parse_datetime(since)
+            if since_datetime is None:
+                raise ValidationError({"since": "Invalid timestamp"})
+            queryset = queryset.filter(updated_at__gte=since_datetime)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        # Taken before the query so that changes made while the query runs are returned on next request
+        since = timezone.now()
+        response = super().list(request, *args, **kwargs)
+        response.data["since"] = since.isoformat()
+        return response
 
     def create(self, request, *args, **kwargs):
         """
-        When new chat gets POSTed, we first send it to Giosg as we can then get it
-        back with webhook and add it to our own database
+        When new chat gets POSTed, we first send it to Giosg and then add it to our own database
         """
         serializer = serializers.ChatConversationCreateSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -40,36 +87,60 @@ class ChatConversationViewSet(viewsets.ModelViewSet):
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
     def perform_create(self, serializer):
+        """
+        Starts a new chat. Giosg calls that do not depend on each other are run concurrently:
+
+            new visitor:      create visitor -> set name
+                                             -> create chat
+            existing visitor: access token -> create chat
+                              set name
+
+        New users get a visitor from the visitor pool (see chat_app/visitor_pool.py) when it has any,
+        their chat is then started like for an existing visitor.
+        """
+        visitor_name = serializer.validated_data["visitor_name"]
+        org_id, room_id = settings.GIOSG_ORGANIZATION_ID, settings.GIOSG_ROOM_ID
         try:
-            local_visitor = models.Visitor.objects.get(visitor_name=serializer.validated_data["visitor_name"])
-            visitor_secret_id = local_visitor.giosg_visitor_secret_id
-            visitor_id = local_visitor.giosg_visitor_id
-            access_token = api.get_access_token_for_visitor(settings.GIOSG_ORGANIZATION_ID, visitor_id, visitor_secret_id)
+            local_visitor = models.Visitor.objects.get(visitor_name=visitor_name)
         except models.Visitor.DoesNotExist:
-            # Visitor was not found so lets create a new one
-            visitor = api.create_giosg_visitor(settings.GIOSG_ORGANIZATION_ID, settings.GIOSG_ROOM_ID)
-            visitor_id = visitor["visitor_id"]
-            visitor_secret_id = visitor["visitor_secret_id"]
-            access_token = visitor["access_token"]
-
-            # Store giosg visitor informatio to our app also
-            local_visitor = models.Visitor.objects.create(
-                giosg_visitor_id=visitor_id,
-                giosg_visitor_secret_id=visitor_secret_id,
-                visitor_name=serializer.validated_data["visitor_name"]
-            )
+            local_visitor = visitor_pool.claim(visitor_name)
 
-        # Always update visitors name
-        api.set_visitor_name(settings.GIOSG_ORGANIZATION_ID, settings.GIOSG_ROOM_ID, visitor_id, serializer.validated_data["visitor_name"])
+        graph = TaskGraph("chat start")
+        if local_visitor is not None:
+            visitor_id = local_visitor.giosg_visitor_id
+            graph.add("access_token", lambda: api.get_access_token_for_visitor(
+                org_id, visitor_id, local_visitor.giosg_visitor_secret_id,
+            ))
+            graph.add("name", lambda: api.set_visitor_name(org_id, room_id, visitor_id, visitor_name))
+            graph.add("chat", lambda access_token: api.create_new_chat_as_visitor(
+                org_id, room_id, visitor_id, access_token,
+            ), depends_on=["access_token"])
+            results = graph.run()
+        else:
+            def store_visitor(visitor):
+                # Store giosg visitor information to our app also. This is done also when rest of
+                # the chat start fails, so that the created Giosg visitor gets reused on next try.
+                return models.Visitor.objects.create(
+                    giosg_visitor_id=visitor["visitor_id"],
+                    giosg_visitor_secret_id=visitor["visitor_secret_id"],
+                    visitor_name=visitor_name,
+                )
 
-        # Start new chat
-        chat_response = api.create_new_chat_as_visitor(settings.GIOSG_ORGANIZATION_ID, settings.GIOSG_ROOM_ID, visitor_id, access_token)
-        # NOTE: We could create the ChatConversation object to our local database here but it is not needed as
-        # we get it back as a webook, we then handle all messages in same place.
-        # models.ChatConversation.objects.create(
-        #     giosg_chat_id=chat_response["id"],
-        #     visitor=local_visitor,
-        # )
+            # Visitor was not found so lets create a new one
+            graph.add("visitor", lambda: api.create_giosg_visitor(org_id, room_id), compensate=store_visitor)
+            graph.add("name", lambda visitor: api.set_visitor_name(
+                org_id, room_id, visitor["visitor_id"], visitor_name,
+            ), depends_on=["visitor"])
+            graph.add("chat", lambda visitor: api.create_new_chat_as_visitor(
+                org_id, room_id, visitor["visitor_id"], visitor["access_token"],
+            ), depends_on=["visitor"])
+            results = graph.run()
+            local_visitor = store_visitor(results["visitor"])
+
+        chat_response = results["chat"]
+        # We store the chat right away as we know its visitor already. This way the chat webhook
+        # does not need to ask chat memberships from Giosg to find out if the chat is ours.
+        store_chat(chat_response, local_visitor)
 
         return chat_response
 
@@ -79,40 +150,100 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
     APIs for listing, updating, retrieving and creating chat messages.
 
     GET/PUT/PATCH/POST/DELETE /api/chats/<chat_id>/messages
+
+    Message list is paginated with a cursor. With "after=<message id>" only messages after the given
+    message are returned, so polling clients only fetch new messages. Responses have an ETag and
+    a poll with matching If-None-Match header gets an empty 304 response.
+
+    Messages of chats which ended long ago are moved to the archive (see chat_app/archive.py).
+    They are listed with "archived=true".
     """
-    serializer_class = serializers.ChatMessageSerializer
+    pagination_class = pagination.ChatMessageCursorPagination
+
+    @property
+    def archived(self):
+        return self.request.query_params.get("archived") in ("true", "1")
+
+    def get_serializer_class(self):
+        if self.archived:
+            return serializers.ArchivedChatMessageSerializer
+        return serializers.ChatMessageSerializer
 
     def get_queryset(self):
-        return models.ChatMessage.objects.filter(chat_id=self.kwargs["chat_id"])
+        model = models.ArchivedChatMessage if self.archived else models.ChatMessage
+        # Served by the (chat, created_at) index
+        return model.objects.filter(chat_id=self.kwargs["chat_id"]).order_by("created_at", "id")
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        after = self.request.query_params.get("after")
+        if after:
+            try:
+                previous = queryset.values("created_at", "id").get(id=after)
+            except (queryset.model.DoesNotExist, DjangoValidationError):
+                raise ValidationError({"after": "Message was not found from this chat"})
+            queryset = queryset.filter(
+                Q(created_at__gt=previous["created_at"]) | Q(created_at=previous["created_at"], id__gt=previous["id"])
+            )
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        # Only the messages which would be returned are aggregated, so an idle poll with "after"
+        # is answered without loading or serializing any messages. Edited messages change "last_updated_at".
+        state = queryset.order_by().aggregate(
+            count=Count("id"), last_created_at=Max("created_at"), last_updated_at=Max("updated_at"),
+        )
+        etag = quote_etag(hashlib.md5(
+            f"{request.get_full_path()}:{state['count']}:{state['last_created_at']}:{state['last_updated_at']}"
+            .encode("utf-8")
+        ).hexdigest())
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            page = self.paginate_queryset(queryset)
+            response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+        response["ETag"] = etag
+        # Browsers have to check with us every time but can reuse the response when it has not changed
+        response["Cache-Control"] = "private, no-cache"
+        return response
+
+    def perform_update(self, serializer):
+        # Archived messages do not update it automatically
+        serializer.save(updated_at=timezone.now())
 
     def create(self, request, *args, **kwargs):
         """
-        When new message gets POSTed, we first send it to Giosg as we can then get it
-        back with webhook and add it to our own database
+        New messages are stored to the outbox and sent to Giosg by the "deliver_outbox" workers
+        (see chat_app/outbox.py). We get them back with webhooks and add them to the message list then,
+        so that all messages are handled in the same place. Delivery status can be followed from
+        /api/chats/<chat_id>/outbox.
         """
         serializer = serializers.ChatMessageCreateSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
-        headers = self.get_success_headers(serializer.data)
-        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+        outbound_message = self.perform_create(serializer)
+        data = serializers.OutboundMessageSerializer(outbound_message).data
+        return Response(data, status=status.HTTP_202_ACCEPTED)
 
     def perform_create(self, serializer):
-        chat_id = self.kwargs["chat_id"]
-        chat = models.ChatConversation.objects.get(id=chat_id)
-        visitor_id = chat.visitor.giosg_visitor_id
-        visitor_token = api.get_access_token_for_visitor(
-            settings.GIOSG_ORGANIZATION_ID,
-            visitor_id,
-            chat.visitor.giosg_visitor_secret_id,
-        )
-        msg_data = api.send_message_as_visitor(visitor_id, chat.giosg_chat_id, visitor_token, serializer.validated_data["message"])
-
-        # NOTE: We could create the ChatMessage object to our local database here but it is not needed as
-        # we get it back as a webook, we then handle all messages in same place.
-        # models.ChatMessage.objects.create(
-        #     chat=chat,
-        #     giosg_message_id=msg_data["id"],
-        #     sender_id=msg_data["sender_id"],
-        #     sender_name="You",
-        #     message=msg_data["message"],
-        # )
+        # Existence of the chat is checked from the send context cache, usually without a query
+        try:
+            context = caching.send_contexts.get(self.kwargs["chat_id"])
+        except DjangoValidationError:
+            context = None
+        if context is None:
+            raise Http404
+        return outbox.enqueue(context.chat_id, serializer.validated_data["message"])
+
+
+class OutboundMessageViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Delivery status of the messages posted to the chat which are not sent yet or were sent recently.
+
+    GET /api/chats/<chat_id>/outbox
+    """
+    serializer_class = serializers.OutboundMessageSerializer
+
+    def get_queryset(self):
+        # Served by the (chat, status) index
+        return models.OutboundMessage.objects.filter(chat_id=self.kwargs["chat_id"]).order_by("id")
@@ -0,0 +1,110 @@
+"""
+Pool of Giosg visitors created ahead of time.
+
+Creating a Giosg visitor takes two calls to Giosg (authentication and joining the room) which must finish
+before the chat of a new user can be started. "./manage.py maintain_visitor_pool" creates visitors in the
+background and stores them as Visitor rows without a name. When a new user starts a chat, a pooled visitor
+is given the name of the user with one UPDATE and the chat is started like for an existing visitor. The
+command also keeps access tokens of the pooled visitors in the cache, so usually no extra Giosg calls are needed.
+That requires a cache shared with the web servers (DJANGO_CACHE_PROFILE "file" or "redis"). With a process local
+cache the tokens are not warmed up and the chat start authenticates the pooled visitor.
+
+The pool is refilled up to GIOSG_VISITOR_POOL["high_watermark"] visitors whenever it has fewer than
+"low_watermark" of them. When the pool is empty, new visitors are created while the user waits, like before.
+Pooled visitors are joined to settings.GIOSG_ROOM_ID, delete them when the room is changed.
+"""
+from concurrent.futures import wait
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from giosg_api import api
+from giosg_api.task_graph import get_executor
+
+from .models import Visitor
+
+# Defaults for settings.GIOSG_VISITOR_POOL
+DEFAULT_VISITOR_POOL_OPTIONS = {
+    # Pool is refilled when it has fewer visitors than this
+    "low_watermark": 10,
+    # and refilled up to this many visitors
+    "high_watermark": 50,
+    # How many visitors are created at the same time
+    "concurrency": 4,
+}
+
+# How many pooled visitors a chat start tries to claim before giving up, when other requests claim them first
+CLAIM_CANDIDATES = 3
+
+
+def get_option(name):
+    return getattr(settings, "GIOSG_VISITOR_POOL", {}).get(name, DEFAULT_VISITOR_POOL_OPTIONS[name])
+
+
+def pooled():
+    """
+    Returns queryset of the visitors waiting in the pool
+    """
+    return Visitor.objects.filter(visitor_name__isnull=True)
+
+
+def claim(visitor_name):
+    """
+    Gives a pooled visitor to a new user with the given name. Returns the visitor or None if the pool is empty.
+    """
+    candidates = pooled().order_by("created_at").values(
+        "id", "giosg_visitor_id", "giosg_visitor_secret_id", "created_at",
+    )[:CLAIM_CANDIDATES]
+    for candidate in candidates:
+        # Conditional update makes sure that only one request gets the visitor
+        if pooled().filter(id=candidate["id"]).update(visitor_name=visitor_name):
+            return Visitor(visitor_name=visitor_name, **candidate)
+    return None
+
+
+def refill(organization_id, room_id):
+    """
+    Creates visitors to the pool up to "high_watermark" if it has fewer than "low_watermark" visitors.
+    Returns the number of created visitors. Visitors created before a failed call are stored.
+    """
+    size = pooled().count()
+    if size >= get_option("low_watermark"):
+        return 0
+
+    missing = get_option("high_watermark") - size
+    created = 0
+    while created < missing:
+        futures = [
+            get_executor().submit(api.create_giosg_visitor, organization_id, room_id)
+            for _ in range(min(get_option("concurrency"), missing - created))
+        ]
+        wait(futures)
+        visitors = [future.result() for future in futures if future.exception() is None]
+        Visitor.objects.bulk_create([
+            Visitor(giosg_visitor_id=visitor["visitor_id"], giosg_visitor_secret_id=visitor["visitor_secret_id"])
+            for visitor in visitors
+        ])
+        created += len(visitors)
+        for future in futures:
+            if future.exception() is not None:
+                raise future.exception()
+    return created
+
+
+def tokens_are_shared():
+    """
+    Returns True if tokens stored to the cache by this process are seen by the web server processes
+    """
+    return not isinstance(caches["default"], (LocMemCache, DummyCache))
+
+
+def warm_tokens(organization_id):
+    """
+    Makes sure that the access tokens of the pooled visitors are in the cache and renews them before they expire
+    """
+    visitors = pooled().values_list("giosg_visitor_id", "giosg_visitor_secret_id")
+    list(get_executor().map(
+        lambda visitor: api.get_access_token_for_visitor(organization_id, *visitor), visitors,
+    ))
@@ -12,5 +12,17 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ext_connectivity_example.settings')
+# Serve views which call Giosg APIs as async views, see asgi_urls.py
+os.environ.setdefault('DJANGO_ROOT_URLCONF', 'ext_connectivity_example.asgi_urls')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from chat_app.push import EVENTS_PATH, event_stream_app  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # Django 4.0 can not stream responses from async views, so the Server-Sent Events stream is served
+    # directly by an ASGI app, see chat_app/push.py
+    if scope["type"] == "http" and scope["path"] == EVENTS_PATH:
+        return await event_stream_app(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,21 @@
+"""
+URL configuration used when the app is served by an ASGI server, see asgi.py.
+
+Views that call Giosg APIs are replaced with their async versions, everything else
+is served by the same views as in urls.py.
+"""
+from django.urls import include, path, re_path
+
+from chat_app import async_views as chat_app_async_views
+from giosg_webhooks import async_views as giosg_webhooks_async_views
+
+from . import urls
+
+urlpatterns = [
+    path('giosg_webhooks/chats', giosg_webhooks_async_views.giosg_chat_webhook, name='giosg_chat_webhook'),
+    path('giosg_webhooks/messages', giosg_webhooks_async_views.giosg_message_webhook, name='giosg_message_webhook'),
+    path('giosg_webhooks/messages/batch', giosg_webhooks_async_views.giosg_message_batch_webhook,
+         name='giosg_message_batch_webhook'),
+    re_path(r'^api/chats/$', chat_app_async_views.chat_conversation_list),
+    path('', include(urls.urlpatterns)),
+]
@@ -0,0 +1,24 @@
+"""
+Serializer of the Redis cache profile, see CACHES in settings.py.
+
+Most of our cache entries are access tokens ("<renew at>:<token>" strings) and primary keys of Giosg IDs.
+Django's default Redis serializer pickles everything but integers, which adds a pickle header to every
+token and makes them unreadable from redis-cli. Strings are stored as plain UTF-8 instead, after a marker
+byte which can not start an integer or a pickle.
+"""
+from django.core.cache.backends.redis import RedisSerializer
+
+STRING_MARKER = b"\x01"
+
+
+class CompactSerializer(RedisSerializer):
+
+    def dumps(self, obj):
+        if type(obj) is str:
+            return STRING_MARKER + obj.encode("utf-8")
+        return super().dumps(obj)
+
+    def loads(self, data):
+        if data[:1] == STRING_MARKER:
+            return data[1:].decode("utf-8")
+        return super().loads(data)
@@ -0,0 +1,19 @@
+"""
+Tuning of SQLite connections.
+
+SQLite allows only one writer at a time. In WAL mode readers do not block the writer and the writer
+does not block readers, and with synchronous=NORMAL commits do not wait for fsync of the database file.
+Pragmas in settings.SQLITE_PRAGMAS are applied to every new SQLite connection.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def _apply_sqlite_pragmas(connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, "SQLITE_PRAGMAS", {}).items():
+            cursor.execute(f"PRAGMA {name} = {value}")
@@ -0,0 +1,137 @@
+"""
+PostgreSQL backend which takes connections from a pool shared by all threads of the process,
+instead of opening a new connection whenever Django needs one.
+
+Configure the pool with the "POOL" key of the database settings:
+
+    "POOL": {"min_size": 2, "max_size": 20, "timeout": 10}
+
+When all "max_size" connections are in use, threads wait at most "timeout" seconds for one to be returned.
+Closing a Django connection returns it to the pool. With "CONN_HEALTH_CHECKS": True connections are
+checked with "SELECT 1" when they are taken from the pool and when a persistent connection is reused by
+a new request, like Django 4.1 does.
+"""
+import os
+import threading
+
+import psycopg2
+import psycopg2.extras
+import psycopg2.pool
+from django.db import OperationalError
+from django.db.backends.postgresql import base
+
+DEFAULT_POOL_OPTIONS = {
+    "min_size": 1,
+    "max_size": 20,
+    "timeout": 10,
+}
+
+
+class ConnectionPool:
+    """
+    Thread safe pool which blocks, instead of failing, when all connections are in use
+    """
+
+    def __init__(self, conn_params, min_size, max_size, timeout):
+        self.timeout = timeout
+        self._pool = psycopg2.pool.ThreadedConnectionPool(min_size, max_size, **conn_params)
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise OperationalError("Timed out waiting for a connection from the database connection pool")
+        try:
+            return self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, connection, close=False):
+        try:
+            self._pool.putconn(connection, close=close)
+        finally:
+            self._slots.release()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, conn_params, options):
+    # Connections can not be shared with forked processes, so each process has its own pools
+    key = (alias, os.getpid())
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = ConnectionPool(
+                    conn_params, options["min_size"], options["max_size"], options["timeout"],
+                )
+    return pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+        self.health_check_done = False
+
+    @property
+    def pool_options(self):
+        return {**DEFAULT_POOL_OPTIONS, **self.settings_dict.get("POOL", {})}
+
+    @property
+    def health_checks_enabled(self):
+        return self.settings_dict.get("CONN_HEALTH_CHECKS", False)
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool = get_pool(self.alias, conn_params, self.pool_options)
+        # At most every connection of the pool can be broken, for example after a database restart
+        for _ in range(self.pool_options["max_size"] + 1):
+            connection = pool.getconn()
+            if not connection.closed and (not self.health_checks_enabled or self._ping(connection)):
+                break
+            pool.putconn(connection, close=True)
+        else:
+            raise OperationalError("No healthy connection available from the database connection pool")
+        self.health_check_done = True
+
+        # Same as in the PostgreSQL backend of Django
+        options = self.settings_dict["OPTIONS"]
+        try:
+            self.isolation_level = options["isolation_level"]
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+        return connection
+
+    def _ping(self, connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+        except psycopg2.Error:
+            return False
+        return True
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                # Pool rolls back unfinished transactions of returned connections
+                self.pool.putconn(self.connection, close=bool(self.connection.closed))
+
+    def close_if_unusable_or_obsolete(self):
+        # Called when requests start and finish. Persistent connection is checked again on its next use.
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def ensure_connection(self):
+        if self.connection is not None and self.health_checks_enabled and not self.health_check_done:
+            self.health_check_done = True
+            if not self.is_usable():
+                self.close()
+        super().ensure_connection()
@@ -0,0 +1,257 @@
+"""
+Timing of the request hot path.
+
+When GIOSG_INSTRUMENTATION["enabled"] is set, TimingMiddleware collects timing spans of each request:
+
+    db               every database query
+    giosg.<function> every call of a giosg_api.api or giosg_api.async_api function (see timed())
+    validate         validation of request data by DRF serializers (see TimedSerializerMixin)
+    serialize        serialization of response data by DRF serializers
+    decode           decoding of webhook payloads
+
+Spans with the same name are summed up and returned in the Server-Timing header of the response, so they
+show up in the network panel of browser developer tools. Durations of requests and spans are also recorded
+to histograms by view, which the /metrics endpoint returns in Prometheus text format together with the
+statistics of the ID caches, token cache, webhook deduplication and outbound Giosg calls.
+
+Spans are collected to a list in a context variable. Context variables are copied to the threads of task
+graphs and to sync_to_async threads, so concurrent Giosg calls of a request are recorded as well.
+When instrumentation is disabled the middleware is not used at all and each span only checks that
+the context variable is not set.
+"""
+import asyncio
+import bisect
+import functools
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework import serializers
+
+# Defaults for settings.GIOSG_INSTRUMENTATION
+DEFAULT_INSTRUMENTATION_OPTIONS = {
+    "enabled": False,
+    # Whether spans are returned in the Server-Timing header. Disable if clients should not see them.
+    "server_timing": True,
+}
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_spans = ContextVar("giosg_spans", default=None)
+
+
+def get_option(name):
+    return getattr(settings, "GIOSG_INSTRUMENTATION", {}).get(name, DEFAULT_INSTRUMENTATION_OPTIONS[name])
+
+
+class span:
+    """
+    Context manager which records how long its block took as a span of the current request
+    """
+    __slots__ = ("name", "spans", "started_at")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.spans = _spans.get()
+        if self.spans is not None:
+            self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.spans is not None:
+            self.spans.append((self.name, time.perf_counter() - self.started_at))
+
+
+def timed(func):
+    """
+    Decorator which records calls of a Giosg API function as "giosg.<function name>" spans
+    """
+    name = f"giosg.{func.__name__}"
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _time_query(execute, sql, params, many, context):
+    spans = _spans.get()
+    if spans is None:
+        return execute(sql, params, many, context)
+    started_at = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        spans.append(("db", time.perf_counter() - started_at))
+
+
+@receiver(connection_created)
+def _install_query_timer(connection, **kwargs):
+    # Installed on all connections so that enabling instrumentation in tests works. Costs one
+    # context variable lookup per query when the request is not instrumented.
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+class TimedSerializerMixin:
+    """
+    Records validation and serialization of DRF serializers as spans. List serializers of many=True
+    are timed when Meta.list_serializer_class is TimedListSerializer.
+    """
+
+    def is_valid(self, *args, **kwargs):
+        with span("validate"):
+            return super().is_valid(*args, **kwargs)
+
+    @property
+    def data(self):
+        with span("serialize"):
+            return super().data
+
+
+class TimedListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    pass
+
+
+class Histogram:
+    """
+    Cumulative histogram in the style of Prometheus client libraries, with one series per label values
+    """
+
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = {"counts": [0] * (len(BUCKETS) + 1), "sum": 0.0}
+            series["counts"][bisect.bisect_left(BUCKETS, value)] += 1
+            series["sum"] += value
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: dict(value, counts=list(value["counts"])) for key, value in self._series.items()}
+        for label_values, data in sorted(series.items()):
+            labels = ",".join(f'{name}="{value}"' for name, value in zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip((*BUCKETS, "+Inf"), data["counts"]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {data['sum']}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+request_duration = Histogram("http_request_duration_seconds", "Duration of requests by view", ("view",))
+span_duration = Histogram(
+    "http_request_span_duration_seconds", "Time spent in database, Giosg API and serialization by view per request",
+    ("view", "span"),
+)
+
+
+class TimingMiddleware(MiddlewareMixin):
+    """
+    Collects spans of each request, see the module docstring. Should be the first middleware,
+    so that the total duration covers the other middleware.
+    """
+
+    def __init__(self, get_response):
+        if not get_option("enabled"):
+            raise MiddlewareNotUsed()
+        super().__init__(get_response)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        spans = []
+        token = _spans.set(spans)
+        started_at = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _spans.reset(token)
+        return self.record(request, response, spans, time.perf_counter() - started_at)
+
+    async def __acall__(self, request):
+        spans = []
+        token = _spans.set(spans)
+        started_at = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _spans.reset(token)
+        return self.record(request, response, spans, time.perf_counter() - started_at)
+
+    def record(self, request, response, spans, duration):
+        totals = {}
+        for name, elapsed in spans:
+            total = totals.setdefault(name, [0.0, 0])
+            total[0] += elapsed
+            total[1] += 1
+
+        match = request.resolver_match
+        view = match.view_name if match is not None else "unmatched"
+        request_duration.observe(duration, view)
+        for name, (total, _) in totals.items():
+            span_duration.observe(total, view, name)
+
+        if get_option("server_timing"):
+            response["Server-Timing"] = ", ".join([
+                *(f'{name};dur={total * 1000:.2f};desc="{count}x"' for name, (total, count) in totals.items()),
+                f"total;dur={duration * 1000:.2f}",
+            ])
+        return response
+
+
+def _stat_lines(prefix, stats, labels=""):
+    return [
+        f"{prefix}_{name}{labels} {value}"
+        for name, value in stats.items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    ]
+
+
+def metrics(request):
+    """
+    Returns request histograms and cache statistics of this process in Prometheus text format
+
+    GET /metrics
+    """
+    from chat_app import caching
+    from giosg_api import resilience, token_cache
+    from giosg_webhooks import dedup
+
+    lines = [*request_duration.render(), *span_duration.render()]
+    for cache_name, stats in caching.stats().items():
+        lines.extend(_stat_lines("giosg_id_cache", stats, f'{{cache="{cache_name}"}}'))
+    lines.extend(_stat_lines("giosg_token_cache", token_cache.stats.snapshot()))
+    lines.extend(_stat_lines("giosg_webhook_dedup", dedup.stats.snapshot()))
+    lines.extend(_stat_lines("giosg_calls", resilience.stats.snapshot()))
+    return HttpResponse("\n".join(lines) + "\n", content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -10,8 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
+import sys
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -47,6 +51,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Removes itself unless GIOSG_INSTRUMENTATION["enabled"] is set
+    'ext_connectivity_example.instrumentation.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,9 +60,12 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Answers 503 when a view fails because Giosg is unavailable
+    'giosg_api.resilience.GiosgUnavailableMiddleware',
 ]
 
-ROOT_URLCONF = 'ext_connectivity_example.urls'
+# asgi.py switches to 'ext_connectivity_example.asgi_urls' which serves async versions of the API views
+ROOT_URLCONF = os.environ.get('DJANGO_ROOT_URLCONF', 'ext_connectivity_example.urls')
 
 TEMPLATES = [
     {
@@ -80,13 +89,98 @@ WSGI_APPLICATION = 'ext_connectivity_example.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DJANGO_DB_PROFILE selects the database: "sqlite" (default) for local development or "postgres" for
+# production, configured with the POSTGRES_* environment variables. SQLite serializes all writes, so it
+# does not scale to many concurrent webhooks.
+DB_PROFILE = os.environ.get('DJANGO_DB_PROFILE', 'sqlite')
+
+if DB_PROFILE == 'postgres':
+    DATABASES = {
+        'default': {
+            # Django PostgreSQL backend with a connection pool shared by the threads of the process,
+            # see ext_connectivity_example/db_backends/postgresql_pool/base.py
+            'ENGINE': 'ext_connectivity_example.db_backends.postgresql_pool',
+            'NAME': os.environ.get('POSTGRES_DB', 'ext_connectivity_example'),
+            'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            # Keep connections open between requests and check that they still work before reusing them
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            'POOL': {
+                'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', '2')),
+                'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', '20')),
+                'timeout': 10,
+            },
+        }
+    }
+elif DB_PROFILE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+            'OPTIONS': {
+                # Seconds a writer waits for the write lock before failing with "database is locked"
+                'timeout': 20,
+            },
+        }
     }
+else:
+    raise ImproperlyConfigured(f'Unknown DJANGO_DB_PROFILE "{DB_PROFILE}", use "sqlite" or "postgres"')
+
+# Applied to every new SQLite connection, see ext_connectivity_example/database.py
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'temp_store': 'MEMORY',
+    # Negative value is in KiB
+    'cache_size': -20000,
 }
 
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+# DJANGO_CACHE_PROFILE selects where visitor access tokens and Giosg ID mappings are cached:
+# "locmem" (default) keeps a separate cache in each process, so every worker authenticates each visitor itself.
+# "file" shares the cache between the processes of one host through files in DJANGO_CACHE_DIR. Adding keys is
+# not atomic there, so two processes may occasionally authenticate the same visitor at the same time.
+# "redis" shares it between all hosts through the Redis server at REDIS_URL (requires the redis package).
+# Tokens and IDs are also kept in the memory of each process, see GIOSG_TOKEN_LOCAL_CACHE and GIOSG_ID_CACHE.
+CACHE_PROFILE = os.environ.get('DJANGO_CACHE_PROFILE', 'locmem')
+
+if CACHE_PROFILE == 'locmem':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+elif CACHE_PROFILE == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('DJANGO_CACHE_DIR', '/var/tmp/ext_connectivity_example_cache'),
+            'OPTIONS': {
+                'MAX_ENTRIES': 100000,
+            },
+        }
+    }
+elif CACHE_PROFILE == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL', 'redis://localhost:6379/0'),
+            'OPTIONS': {
+                # Stores tokens as plain strings instead of pickles, see ext_connectivity_example/cache_serializers.py
+                'serializer': 'ext_connectivity_example.cache_serializers.CompactSerializer',
+            },
+        }
+    }
+else:
+    raise ImproperlyConfigured(f'Unknown DJANGO_CACHE_PROFILE "{CACHE_PROFILE}", use "locmem", "file" or "redis"')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -124,6 +218,58 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Logging
+# https://docs.djangoproject.com/en/4.0/topics/logging/
+
+# Records are written as JSON lines by a background thread, see giosg_api/logs.py. Payloads of Giosg API
+# calls and webhooks are logged at DEBUG level, set GIOSG_LOG_LEVEL=DEBUG to see them and
+# GIOSG_LOG_PAYLOAD_SAMPLE_RATE to keep only a share of them.
+GIOSG_LOG_LEVEL = os.environ.get('GIOSG_LOG_LEVEL', 'INFO')
+# Records are still created but not written while "./manage.py test" runs, so that its output stays readable
+LOG_HANDLER = 'null' if sys.argv[1:2] == ['test'] else 'console'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {
+            '()': 'giosg_api.logs.JsonFormatter',
+        },
+    },
+    'filters': {
+        'sample_payloads': {
+            '()': 'giosg_api.logs.SampleFilter',
+            'rate': float(os.environ.get('GIOSG_LOG_PAYLOAD_SAMPLE_RATE', '1.0')),
+            'level': 'DEBUG',
+        },
+    },
+    'handlers': {
+        'console': {
+            '()': 'giosg_api.logs.QueueLogHandler',
+            'maxsize': 10000,
+            'formatter': 'json',
+            'filters': ['sample_payloads'],
+        },
+        'null': {
+            'class': 'logging.NullHandler',
+        },
+    },
+    'loggers': {
+        'giosg_api': {
+            'handlers': [LOG_HANDLER],
+            'level': GIOSG_LOG_LEVEL,
+        },
+        'giosg_webhooks': {
+            'handlers': [LOG_HANDLER],
+            'level': GIOSG_LOG_LEVEL,
+        },
+        'chat_app': {
+            'handlers': [LOG_HANDLER],
+            'level': GIOSG_LOG_LEVEL,
+        },
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
@@ -134,3 +280,100 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 GIOSG_API_TOKEN = "<copy your api token here>"
 GIOSG_ORGANIZATION_ID = "<copy your giosg org id here>"
 GIOSG_ROOM_ID = "<copy room id here>"
+GIOSG_API_BASE_URL = "https://service.giosg.com"
+
+# Shared outbound HTTP client used for all Giosg API calls, see giosg_api/client.py for all options.
+# Connections are kept alive and pooled between requests.
+GIOSG_HTTP_CLIENT = {
+    "pool_maxsize": 20,
+    "timeout": (3.05, 10),
+    "retries": 3,
+    "backoff_factor": 0.2,
+}
+
+# Outbound Giosg calls go through a bulkhead which caps their concurrency and a circuit breaker which
+# fails them fast when Giosg is failing, see giosg_api/resilience.py for all options.
+GIOSG_RESILIENCE = {
+    "max_concurrent_calls": 16,
+    "bulkhead_timeout": 0.5,
+    "failure_rate": 0.5,
+    "open_seconds": 10,
+}
+
+# Size of the thread pool used for running independent Giosg calls concurrently, for example when starting a chat.
+# Setting this to 1 makes them run one after another.
+GIOSG_TASK_GRAPH_MAX_WORKERS = 32
+
+# Visitor access tokens are renewed in the background when this share of their lifetime has passed
+GIOSG_TOKEN_RENEW_AFTER = 0.8
+
+# Access tokens read from the shared cache are kept in the memory of each process for "timeout" seconds,
+# but never past their renewal time, see giosg_api/token_cache.py
+GIOSG_TOKEN_LOCAL_CACHE = {
+    "maxsize": 10000,
+    "timeout": 60,
+}
+
+# "./manage.py maintain_visitor_pool" creates Giosg visitors ahead of time for new users. The pool is refilled
+# up to "high_watermark" visitors when it has fewer than "low_watermark", see chat_app/visitor_pool.py.
+# Their access tokens are warmed up only with a shared DJANGO_CACHE_PROFILE ("file" or "redis").
+GIOSG_VISITOR_POOL = {
+    "low_watermark": 10,
+    "high_watermark": 50,
+    "concurrency": 4,
+}
+
+# Messages posted by visitors are stored to an outbox and sent to Giosg by "./manage.py deliver_outbox",
+# see chat_app/outbox.py for all options.
+GIOSG_OUTBOX = {
+    "max_attempts": 8,
+    "retry_delay": 1,
+    "max_retry_delay": 60,
+    "concurrency": 8,
+    "keep_sent": 3600,
+}
+
+# Received webhooks are queued to the database and processed by "./manage.py process_webhooks",
+# see giosg_webhooks/queue.py for all options.
+GIOSG_WEBHOOK_QUEUE = {
+    "max_attempts": 8,
+    "retry_delay": 2,
+    "max_retry_delay": 300,
+    "lease": 60,
+}
+
+# Retried webhooks are dropped by their (channel, resource_id, action), see giosg_webhooks/dedup.py
+GIOSG_WEBHOOK_DEDUP = {
+    "window": 24 * 3600,
+    "maxsize": 100000,
+    "stats_interval": 300,
+}
+
+# Giosg chat and visitor IDs are resolved to local primary keys through an in-process LRU cache backed by
+# the Django cache, see chat_app/caching.py
+GIOSG_ID_CACHE = {
+    "maxsize": 10000,
+    "local_timeout": 300,
+    "timeout": 3600,
+}
+
+# Visitors of chats are remembered so that chat webhooks do not need to fetch chat memberships from Giosg
+# every time. Memberships of at most GIOSG_MEMBERSHIP_CONCURRENCY chats are fetched at the same time.
+GIOSG_CHAT_VISITOR_TIMEOUT = 7 * 24 * 3600
+GIOSG_CHAT_VISITOR_MISSING_TIMEOUT = 60
+GIOSG_MEMBERSHIP_CONCURRENCY = 4
+
+# New chats and messages are pushed to browsers with Server-Sent Events when served with ASGI,
+# see chat_app/push.py for all options.
+GIOSG_PUSH = {
+    "poll_interval": 0.05,
+    "heartbeat": 15,
+    "retention": 300,
+}
+
+# Timing of database queries, Giosg API calls and serializers of each request. Timings are returned in
+# Server-Timing headers and as histograms from /metrics, see ext_connectivity_example/instrumentation.py.
+GIOSG_INSTRUMENTATION = {
+    "enabled": os.environ.get('GIOSG_INSTRUMENTATION', '0') == '1',
+    "server_timing": True,
+}
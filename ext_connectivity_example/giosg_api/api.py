@@ -1,155 +1,269 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, wait
+
 import requests
-import json
 from django.conf import settings
 from django.core.cache import cache
-from giosg_api.utils import pretty_print_response
+from giosg_api import token_cache
+from giosg_api.client import get_client
+from giosg_api.task_graph import get_executor
+from giosg_api.logs import log_payload
+from ext_connectivity_example.instrumentation import timed
 
+logger = logging.getLogger(__name__)
 
-def _set_visitor_token_to_cache(visitor):
-    """
-    Helper for storing visitor access token in local cache
-    """
-    visitor_id = visitor["visitor_id"]
-    visitor_token = visitor["access_token"]
-    cache_ttl = int(visitor["expires_in"]) - 10
-    cache.set(f"access_token_{visitor_id}", visitor_token, cache_ttl)
+# Cached in place of visitor ID for chats which have no visitor member
+NO_VISITOR = ""
 
 
+@timed
 def get_access_token_for_visitor(organization_id, visitor_id, visitor_secret_id):
     """
-    Returns visitor access token from local cache or authenticates against Giosg server if not found
+    Returns visitor access token from local cache or authenticates against Giosg server if not found.
+    Concurrent refreshes of the same token are coalesced, see giosg_api/token_cache.py
     """
-    token = cache.get(f"access_token_{visitor_id}")
-    if not token:
-        visitor = authenticate_giosg_visitor(organization_id, visitor_secret_id)
-        return visitor["access_token"]
-    return token
+    return token_cache.get_token(organization_id, visitor_id, visitor_secret_id, authenticate_giosg_visitor)
 
 
+@timed
 def create_giosg_visitor(organization_id, room_id):
     """
     Creates new Giosg visitor and assigns that visitor into a room
     """
     # See: https://docs.giosg.com/api_reference/giosg_live/giosg_public_http_api/general/#authenticate-a-new-visitor
-    visitor_auth_url = f"https://service.giosg.com/api/v5/public/orgs/{organization_id}/auth"
+    visitor_auth_url = f"/api/v5/public/orgs/{organization_id}/auth"
     auth_payload = {
         "visitor_secret_id": None,
     }
-    auth_response = requests.post(visitor_auth_url, data=json.dumps(auth_payload), headers={
-        "Content-Type": "application/json",
-    })
+    auth_response = get_client().post(visitor_auth_url, endpoint="auth", json=auth_payload)
     auth_response.raise_for_status()
     visitor = auth_response.json()
-    pretty_print_response("post", visitor_auth_url, visitor)
+    log_payload(logger, "post", auth_response.url, visitor)
 
     visitor_id = visitor["visitor_id"]
     visitor_token = visitor["access_token"]
-    _set_visitor_token_to_cache(visitor)
+    token_cache.store_token(visitor)
 
     # See: https://docs.giosg.com/api_reference/giosg_live/giosg_public_http_api/visitors/#create-a-new-room-visitor
-    visitor_api_url = f"https://service.giosg.com/api/v5/public/orgs/{organization_id}/rooms/{room_id}/visitors"
-    visitor_response = requests.post(visitor_api_url, data=json.dumps({"id": visitor_id}), headers={
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {visitor_token}"
-    })
+    visitor_api_url = f"/api/v5/public/orgs/{organization_id}/rooms/{room_id}/visitors"
+    visitor_response = get_client().post(
+        visitor_api_url, endpoint="create_room_visitor", json={"id": visitor_id},
+        headers={"Authorization": f"Bearer {visitor_token}"},
+    )
     visitor_response.raise_for_status()
-    pretty_print_response("post", visitor_api_url, visitor_response)
+    log_payload(logger, "post", visitor_response.url, visitor_response.content)
 
     return visitor
 
 
+@timed
 def authenticate_giosg_visitor(organization_id, visitor_secret_id):
     """
     Authenticates existing Giosg visitors against Giosg servers
     """
     # See: https://docs.giosg.com/api_reference/giosg_live/giosg_public_http_api/general/#authenticate-a-new-visitor
-    visitor_auth_url = f"https://service.giosg.com/api/v5/public/orgs/{organization_id}/auth"
+    visitor_auth_url = f"/api/v5/public/orgs/{organization_id}/auth"
     auth_payload = {
         "visitor_secret_id": visitor_secret_id,
     }
-    auth_response = requests.post(visitor_auth_url, data=json.dumps(auth_payload), headers={
-        "Content-Type": "application/json",
-    })
+    auth_response = get_client().post(visitor_auth_url, endpoint="auth", json=auth_payload)
     auth_response.raise_for_status()
     visitor = auth_response.json()
-    pretty_print_response("post", visitor_auth_url, visitor)
-    _set_visitor_token_to_cache(visitor)
+    log_payload(logger, "post", auth_response.url, visitor)
+    token_cache.store_token(visitor)
 
     return visitor
 
 
+@timed
 def set_visitor_name(organization_id, room_id, visitor_id, visitor_name):
     """
     Set visitors name
     """
     # Add name for the visitor
     # See: https://docs.giosg.com/api_reference/giosg_live/giosg_http_api/visitors/#room-visitor-variables
-    visitor_variable_url = f"https://service.giosg.com/api/v5/orgs/{organization_id}/rooms/{room_id}/visitors/{visitor_id}/variables"
-    variable_response = requests.post(visitor_variable_url, data=json.dumps({"key": "username", "value": visitor_name}), headers={
-        "Content-Type": "application/json",
-        "Authorization": f"Token {settings.GIOSG_API_TOKEN}"
-    })
+    visitor_variable_url = f"/api/v5/orgs/{organization_id}/rooms/{room_id}/visitors/{visitor_id}/variables"
+    variable_response = get_client().post(
+        visitor_variable_url, endpoint="set_variable", json={"key": "username", "value": visitor_name},
+        headers={"Authorization": f"Token {settings.GIOSG_API_TOKEN}"},
+    )
     variable_response.raise_for_status()
     variables = variable_response.json()
-    pretty_print_response("post", visitor_variable_url, variables)
+    log_payload(logger, "post", variable_response.url, variables)
     return variables
 
 
+@timed
 def create_new_chat_as_visitor(organization_id, room_id, visitor_id, access_token):
     """
     Create a new chat as a visitor to Giosg platform
     """
     # https://docs.giosg.com/api_reference/giosg_live/giosg_public_http_api/chats/#create-a-new-chat
-    chat_api_url = f"https://service.giosg.com/api/v5/public/orgs/{organization_id}/rooms/{room_id}/visitors/{visitor_id}/chats"
-    chat_response = requests.post(chat_api_url, headers={
+    chat_api_url = f"/api/v5/public/orgs/{organization_id}/rooms/{room_id}/visitors/{visitor_id}/chats"
+    chat_response = get_client().post(chat_api_url, endpoint="create_chat", headers={
         "Content-Type": "application/json",
         "Authorization": f"Bearer {access_token}"
     })
     try:
         chat_response.raise_for_status()
     except requests.HTTPError as ex:
-        print("Failed to create new visitor chat:", chat_response.content)
+        logger.error("Failed to create new visitor chat: %s", chat_response.content)
         raise ex
     chat_data = chat_response.json()
-    pretty_print_response("post", chat_api_url, chat_data)
+    log_payload(logger, "post", chat_response.url, chat_data)
+    # We already know the visitor of the chat, so there is no need to ask it from memberships later
+    remember_chat_visitor(chat_data["id"], visitor_id)
     return chat_data
 
 
+@timed
 def send_message_as_visitor(visitor_id, chat_id, access_token, message):
     """
     Send a message to existing chat
     """
-    api_url = f"https://service.giosg.com/api/v5/public/visitors/{visitor_id}/chats/{chat_id}/messages"
+    api_url = f"/api/v5/public/visitors/{visitor_id}/chats/{chat_id}/messages"
     payload = {
         "type": "msg",
         "message": message
     }
-    msg_response = requests.post(api_url, json.dumps(payload), headers={
-        "Content-Type": "application/json",
+    msg_response = get_client().post(api_url, endpoint="send_message", json=payload, headers={
         "Authorization": f"Bearer {access_token}"
     })
     msg_response.raise_for_status()
     msg_data = msg_response.json()
-    pretty_print_response("post", api_url, msg_data)
+    log_payload(logger, "post", msg_response.url, msg_data)
     return msg_data
 
 
+def _chat_visitor_key(chat_id):
+    return f"chat_visitor_{chat_id}"
+
+
+def remember_chat_visitor(chat_id, visitor_id):
+    """
+    Stores visitor of the chat to cache so that get_visitor_id() does not need to ask it from Giosg
+    """
+    if visitor_id is None:
+        timeout = getattr(settings, "GIOSG_CHAT_VISITOR_MISSING_TIMEOUT", 60)
+    else:
+        timeout = getattr(settings, "GIOSG_CHAT_VISITOR_TIMEOUT", 7 * 24 * 3600)
+    cache.set(_chat_visitor_key(chat_id), visitor_id or NO_VISITOR, timeout)
+
+
+def get_cached_visitor_id(chat_id):
+    """
+    Returns cached visitor ID of the chat, NO_VISITOR if chat is known to have no visitor
+    or None if nothing is cached
+    """
+    return cache.get(_chat_visitor_key(chat_id))
+
+
+@timed
 def get_visitor_id(organization_id, chat_id):
     """
-    Get visitor_id from chat memberships
+    Get visitor_id from chat memberships. Result is cached and it is known without any requests
+    for chats created with create_new_chat_as_visitor().
     """
+    visitor_id = get_cached_visitor_id(chat_id)
+    if visitor_id is not None:
+        return visitor_id or None
+
     # See: https://docs.giosg.com/api_reference/giosg_live/giosg_http_api/chats/#chat-memberships
-    api_url = f"https://service.giosg.com/api/v5/orgs/{organization_id}/owned_chats/{chat_id}/memberships"
-    response = requests.get(api_url, headers={
+    api_url = f"/api/v5/orgs/{organization_id}/owned_chats/{chat_id}/memberships"
+    while api_url:
+        response = get_client().get(api_url, endpoint="memberships", headers={
+            "Content-Type": "application/json",
+            "Authorization": f"Token {settings.GIOSG_API_TOKEN}",
+        })
+        response.raise_for_status()
+        page = response.json()
+        log_payload(logger, "get", response.url, page)
+
+        visitor_member = next((m for m in page["results"] if m["member_type"] == "visitor"), None)
+        if visitor_member is not None:
+            # No need to fetch rest of the pages
+            visitor_id = visitor_member["member_id"]
+            break
+        api_url = page.get("next")
+
+    remember_chat_visitor(chat_id, visitor_id)
+    return visitor_id
+
+
+@timed
+def get_visitor_ids(organization_id, chat_ids):
+    """
+    Resolves visitors of many chats with get_visitor_id(). Memberships of at most
+    GIOSG_MEMBERSHIP_CONCURRENCY chats are fetched at the same time.
+
+    Returns dict of chat ID -> visitor ID. Chats whose lookup failed are left out.
+    """
+    max_concurrency = getattr(settings, "GIOSG_MEMBERSHIP_CONCURRENCY", 4)
+    chat_ids = list(chat_ids)
+    visitor_ids = {}
+    running = {}
+    while chat_ids or running:
+        while chat_ids and len(running) < max_concurrency:
+            chat_id = chat_ids.pop()
+            running[get_executor().submit(get_visitor_id, organization_id, chat_id)] = chat_id
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            chat_id = running.pop(future)
+            try:
+                visitor_ids[chat_id] = future.result()
+            except Exception:
+                logger.exception("Failed to resolve visitor of chat %s", chat_id)
+    return visitor_ids
+
+
+@timed
+def get_page(api_url, params=None):
+    """
+    Returns one page of a paginated Giosg list API
+    """
+    response = get_client().get(api_url, endpoint="list", params=params, headers={
         "Content-Type": "application/json",
         "Authorization": f"Token {settings.GIOSG_API_TOKEN}",
     })
     response.raise_for_status()
-    memberships = response.json()["results"]
-    pretty_print_response("post", api_url, response.json())
+    page = response.json()
+    log_payload(logger, "get", response.url, page)
+    return page
 
-    try:
-        visitor_member = next(filter(lambda m: m["member_type"] == "visitor", memberships))
-        return visitor_member["member_id"]
-    except StopIteration:
-        return None
+
+def iter_pages(api_url, params=None, prefetch=True):
+    """
+    Yields pages of a paginated Giosg list API by following the "next" links. With "prefetch"
+    the next page is requested in the background while the caller handles the current one.
+    """
+    if not prefetch:
+        while api_url:
+            page = get_page(api_url, params)
+            yield page
+            api_url, params = page.get("next"), None
+        return
+
+    future = get_executor().submit(get_page, api_url, params)
+    while future is not None:
+        page = future.result()
+        # "next" links contain the query parameters already
+        future = get_executor().submit(get_page, page["next"]) if page.get("next") else None
+        yield page
+
+
+def chats_url(organization_id):
+    # See: https://docs.giosg.com/api_reference/giosg_live/giosg_http_api/chats/
+    return f"/api/v5/orgs/{organization_id}/owned_chats"
+
+
+@timed
+def get_chat_messages(organization_id, chat_id, page_size=100):
+    """
+    Returns all messages of the chat. Pages are fetched one after another.
+    """
+    # See: https://docs.giosg.com/api_reference/giosg_live/giosg_http_api/chats/#chat-messages
+    api_url = f"/api/v5/orgs/{organization_id}/owned_chats/{chat_id}/messages"
+    messages = []
+    for page in iter_pages(api_url, {"page_size": page_size}, prefetch=False):
+        messages.extend(page["results"])
+    return messages
@@ -0,0 +1,165 @@
+"""
+Async versions of the functions in giosg_api.api. These are meant to be awaited from async views
+when the app is served by an ASGI server.
+"""
+import logging
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from giosg_api import api, token_cache
+from giosg_api.async_client import get_async_client
+from giosg_api.logs import log_payload
+from ext_connectivity_example.instrumentation import timed
+
+logger = logging.getLogger(__name__)
+
+
+@timed
+async def get_access_token_for_visitor(organization_id, visitor_id, visitor_secret_id):
+    """
+    Returns visitor access token from local cache or authenticates against Giosg server if not found.
+    Concurrent refreshes of the same token are coalesced, see giosg_api/token_cache.py
+    """
+    return await token_cache.aget_token(organization_id, visitor_id, visitor_secret_id, authenticate_giosg_visitor)
+
+
+@timed
+async def create_giosg_visitor(organization_id, room_id):
+    """
+    Creates new Giosg visitor and assigns that visitor into a room
+    """
+    # See: https://docs.giosg.com/api_reference/giosg_live/giosg_public_http_api/general/#authenticate-a-new-visitor
+    visitor_auth_url = f"/api/v5/public/orgs/{organization_id}/auth"
+    auth_payload = {
+        "visitor_secret_id": None,
+    }
+    auth_response = await get_async_client().post(visitor_auth_url, endpoint="auth", json=auth_payload)
+    auth_response.raise_for_status()
+    visitor = auth_response.json()
+    log_payload(logger, "post", auth_response.url, visitor)
+
+    visitor_id = visitor["visitor_id"]
+    visitor_token = visitor["access_token"]
+    await sync_to_async(token_cache.store_token)(visitor)
+
+    # See: https://docs.giosg.com/api_reference/giosg_live/giosg_public_http_api/visitors/#create-a-new-room-visitor
+    visitor_api_url = f"/api/v5/public/orgs/{organization_id}/rooms/{room_id}/visitors"
+    visitor_response = await get_async_client().post(
+        visitor_api_url, endpoint="create_room_visitor", json={"id": visitor_id},
+        headers={"Authorization": f"Bearer {visitor_token}"},
+    )
+    visitor_response.raise_for_status()
+    log_payload(logger, "post", visitor_response.url, visitor_response.content)
+
+    return visitor
+
+
+@timed
+async def authenticate_giosg_visitor(organization_id, visitor_secret_id):
+    """
+    Authenticates existing Giosg visitors against Giosg servers
+    """
+    # See: https://docs.giosg.com/api_reference/giosg_live/giosg_public_http_api/general/#authenticate-a-new-visitor
+    visitor_auth_url = f"/api/v5/public/orgs/{organization_id}/auth"
+    auth_payload = {
+        "visitor_secret_id": visitor_secret_id,
+    }
+    auth_response = await get_async_client().post(visitor_auth_url, endpoint="auth", json=auth_payload)
+    auth_response.raise_for_status()
+    visitor = auth_response.json()
+    log_payload(logger, "post", auth_response.url, visitor)
+    await sync_to_async(token_cache.store_token)(visitor)
+
+    return visitor
+
+
+@timed
+async def set_visitor_name(organization_id, room_id, visitor_id, visitor_name):
+    """
+    Set visitors name
+    """
+    # See: https://docs.giosg.com/api_reference/giosg_live/giosg_http_api/visitors/#room-visitor-variables
+    visitor_variable_url = f"/api/v5/orgs/{organization_id}/rooms/{room_id}/visitors/{visitor_id}/variables"
+    variable_response = await get_async_client().post(
+        visitor_variable_url, endpoint="set_variable", json={"key": "username", "value": visitor_name},
+        headers={"Authorization": f"Token {settings.GIOSG_API_TOKEN}"},
+    )
+    variable_response.raise_for_status()
+    variables = variable_response.json()
+    log_payload(logger, "post", variable_response.url, variables)
+    return variables
+
+
+@timed
+async def create_new_chat_as_visitor(organization_id, room_id, visitor_id, access_token):
+    """
+    Create a new chat as a visitor to Giosg platform
+    """
+    # https://docs.giosg.com/api_reference/giosg_live/giosg_public_http_api/chats/#create-a-new-chat
+    chat_api_url = f"/api/v5/public/orgs/{organization_id}/rooms/{room_id}/visitors/{visitor_id}/chats"
+    chat_response = await get_async_client().post(chat_api_url, endpoint="create_chat", headers={
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {access_token}"
+    })
+    try:
+        chat_response.raise_for_status()
+    except httpx.HTTPStatusError as ex:
+        logger.error("Failed to create new visitor chat: %s", chat_response.content)
+        raise ex
+    chat_data = chat_response.json()
+    log_payload(logger, "post", chat_response.url, chat_data)
+    # We already know the visitor of the chat, so there is no need to ask it from memberships later
+    await sync_to_async(api.remember_chat_visitor)(chat_data["id"], visitor_id)
+    return chat_data
+
+
+@timed
+async def send_message_as_visitor(visitor_id, chat_id, access_token, message):
+    """
+    Send a message to existing chat
+    """
+    api_url = f"/api/v5/public/visitors/{visitor_id}/chats/{chat_id}/messages"
+    payload = {
+        "type": "msg",
+        "message": message
+    }
+    msg_response = await get_async_client().post(api_url, endpoint="send_message", json=payload, headers={
+        "Authorization": f"Bearer {access_token}"
+    })
+    msg_response.raise_for_status()
+    msg_data = msg_response.json()
+    log_payload(logger, "post", msg_response.url, msg_data)
+    return msg_data
+
+
+@timed
+async def get_visitor_id(organization_id, chat_id):
+    """
+    Get visitor_id from chat memberships. Result is cached and it is known without any requests
+    for chats created with create_new_chat_as_visitor().
+    """
+    visitor_id = await sync_to_async(api.get_cached_visitor_id)(chat_id)
+    if visitor_id is not None:
+        return visitor_id or None
+
+    # See: https://docs.giosg.com/api_reference/giosg_live/giosg_http_api/chats/#chat-memberships
+    api_url = f"/api/v5/orgs/{organization_id}/owned_chats/{chat_id}/memberships"
+    while api_url:
+        response = await get_async_client().get(api_url, endpoint="memberships", headers={
+            "Content-Type": "application/json",
+            "Authorization": f"Token {settings.GIOSG_API_TOKEN}",
+        })
+        response.raise_for_status()
+        page = response.json()
+        log_payload(logger, "get", response.url, page)
+
+        visitor_member = next((m for m in page["results"] if m["member_type"] == "visitor"), None)
+        if visitor_member is not None:
+            # No need to fetch rest of the pages
+            visitor_id = visitor_member["member_id"]
+            break
+        api_url = page.get("next")
+
+    await sync_to_async(api.remember_chat_visitor)(chat_id, visitor_id)
+    return visitor_id
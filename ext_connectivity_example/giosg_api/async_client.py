@@ -0,0 +1,133 @@
+import asyncio
+import socket
+import weakref
+
+import httpx
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from giosg_api.client import DEFAULT_CLIENT_OPTIONS
+from giosg_api.resilience import AsyncBulkhead, CircuitBreaker, GiosgUnavailable
+
+
+def _httpx_timeout(timeout):
+    connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    return httpx.Timeout(read_timeout, connect=connect_timeout)
+
+
+class AsyncGiosgClient:
+    """
+    Asyncio counterpart of giosg_api.client.GiosgClient built on httpx.AsyncClient.
+
+    Connections are pooled the same way but a single event loop can keep thousands of
+    requests in flight without tying up a thread for each of them. Accepts the same options as
+    GiosgClient, options that only make sense for requests (pool_connections, pool_block) are ignored.
+    max_connections caps the number of concurrent connections, by default there is no limit.
+    Must be created in the event loop which uses it.
+    """
+
+    def __init__(self, base_url, pool_maxsize=20, max_connections=None, keep_alive=True, timeout=(3.05, 10),
+                 retries=3, backoff_factor=0.2, retry_statuses=(502, 503, 504), retry_methods=("GET",),
+                 endpoint_timeouts=None, breaker=None, bulkhead=None, **kwargs):
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=pool_maxsize if keep_alive else 0,
+        )
+        # httpx transport retries only connection errors, status based retries are done in _request_with_retries().
+        # httpx writes request headers and body separately, without TCP_NODELAY the body would wait
+        # for delayed ACK of the headers.
+        transport = httpx.AsyncHTTPTransport(
+            retries=retries,
+            limits=limits,
+            socket_options=[(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)],
+        )
+        self.client = httpx.AsyncClient(
+            base_url=base_url.rstrip("/"),
+            timeout=_httpx_timeout(timeout),
+            transport=transport,
+            headers=None if keep_alive else {"Connection": "close"},
+        )
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_methods = frozenset(retry_methods)
+        self.endpoint_timeouts = {
+            endpoint: _httpx_timeout(value) for endpoint, value in (endpoint_timeouts or {}).items()
+        }
+        self.breaker = breaker or CircuitBreaker.from_settings()
+        self.bulkhead = bulkhead or AsyncBulkhead.from_settings()
+
+    async def request(self, method, path, endpoint=None, **kwargs):
+        """
+        Same as GiosgClient.request(), transport errors are raised as GiosgUnavailable
+        """
+        if endpoint in self.endpoint_timeouts:
+            kwargs.setdefault("timeout", self.endpoint_timeouts[endpoint])
+        trial = self.breaker.before_call()
+        success = None
+        try:
+            async with self.bulkhead:
+                response = await self._request_with_retries(method, path, **kwargs)
+            success = response.status_code < 500
+            return response
+        except httpx.TransportError as ex:
+            success = False
+            raise GiosgUnavailable(f"{method} {path} failed: {ex!r}") from ex
+        finally:
+            self.breaker.record(success, trial)
+
+    async def _request_with_retries(self, method, path, **kwargs):
+        attempt = 0
+        while True:
+            response = await self.client.request(method, path, **kwargs)
+            retryable = method in self.retry_methods and response.status_code in self.retry_statuses
+            if not retryable or attempt >= self.retries:
+                return response
+            await response.aclose()
+            await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+            attempt += 1
+
+    async def get(self, path, **kwargs):
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request("POST", path, **kwargs)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    @classmethod
+    def from_settings(cls):
+        options = dict(DEFAULT_CLIENT_OPTIONS)
+        options.update(getattr(settings, "GIOSG_HTTP_CLIENT", {}))
+        return cls(settings.GIOSG_API_BASE_URL, **options)
+
+
+# httpx connections are bound to the event loop that opened them, so each loop gets its own client.
+# Under an ASGI server there is only one loop per process.
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """
+    Returns AsyncGiosgClient for the currently running event loop, creating it from settings on first use
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = AsyncGiosgClient.from_settings()
+    return client
+
+
+def reset_async_clients():
+    """
+    Forgets created clients so that next get_async_client() call builds a new one from current settings
+    """
+    _clients.clear()
+
+
+@receiver(setting_changed)
+def _reset_clients_on_setting_change(setting, **kwargs):
+    if setting in ("GIOSG_API_BASE_URL", "GIOSG_HTTP_CLIENT", "GIOSG_RESILIENCE"):
+        reset_async_clients()
@@ -0,0 +1,152 @@
+import threading
+
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from giosg_api.resilience import Bulkhead, CircuitBreaker, GiosgUnavailable
+
+# Defaults for settings.GIOSG_HTTP_CLIENT. Any key can be overridden in settings.
+DEFAULT_CLIENT_OPTIONS = {
+    # Number of per-host connection pools to keep around
+    "pool_connections": 4,
+    # Maximum number of keep-alive connections kept open per host
+    "pool_maxsize": 20,
+    # Block instead of opening extra (non-pooled) connections when pool is exhausted
+    "pool_block": False,
+    # When disabled every request asks the server to close the connection afterwards,
+    # which is the same as not pooling at all. Mostly useful for benchmarking.
+    "keep_alive": True,
+    # (connect timeout, read timeout) in seconds
+    "timeout": (3.05, 10),
+    # Timeouts of the endpoints which should not use "timeout", by the endpoint names used in giosg_api/api.py.
+    # Calls made while a visitor waits get short timeouts.
+    "endpoint_timeouts": {
+        "auth": (3.05, 5),
+        "create_chat": (3.05, 5),
+        "send_message": (3.05, 5),
+        "memberships": (3.05, 5),
+        # Pages of chat history can be large
+        "list": (3.05, 30),
+    },
+    # How many times failed requests are retried. Connection errors are retried for all methods,
+    # response status based retries only for "retry_methods".
+    "retries": 3,
+    "backoff_factor": 0.2,
+    "retry_statuses": (502, 503, 504),
+    "retry_methods": ("GET",),
+}
+
+
+class GiosgClient:
+    """
+    Thin wrapper around requests.Session which keeps keep-alive connections to Giosg servers
+    pooled between calls, so that consecutive API calls do not pay a new TCP and TLS handshake.
+
+    Calls go through the circuit breaker and bulkhead of giosg_api/resilience.py. Connection errors
+    and timeouts are raised as GiosgUnavailable.
+    """
+
+    def __init__(self, base_url, pool_connections=4, pool_maxsize=20, pool_block=False, keep_alive=True,
+                 timeout=(3.05, 10), retries=3, backoff_factor=0.2, retry_statuses=(502, 503, 504),
+                 retry_methods=("GET",), endpoint_timeouts=None, breaker=None, bulkhead=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.endpoint_timeouts = endpoint_timeouts or {}
+        self.breaker = breaker or CircuitBreaker.from_settings()
+        self.bulkhead = bulkhead or Bulkhead.from_settings()
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=retry_statuses,
+            allowed_methods=frozenset(retry_methods),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+            max_retries=retry,
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if not keep_alive:
+            self.session.headers["Connection"] = "close"
+
+    def url(self, path):
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.base_url}{path}"
+
+    def request(self, method, path, endpoint=None, **kwargs):
+        """
+        Makes a request to Giosg. "endpoint" selects the timeout from "endpoint_timeouts".
+        """
+        kwargs.setdefault("timeout", self.endpoint_timeouts.get(endpoint, self.timeout))
+        trial = self.breaker.before_call()
+        success = None
+        try:
+            with self.bulkhead:
+                response = self.session.request(method, self.url(path), **kwargs)
+            success = response.status_code < 500
+            return response
+        except (requests.ConnectionError, requests.Timeout) as ex:
+            success = False
+            raise GiosgUnavailable(f"{method} {path} failed: {ex}") from ex
+        finally:
+            self.breaker.record(success, trial)
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+    @classmethod
+    def from_settings(cls):
+        options = dict(DEFAULT_CLIENT_OPTIONS)
+        options.update(getattr(settings, "GIOSG_HTTP_CLIENT", {}))
+        return cls(settings.GIOSG_API_BASE_URL, **options)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Returns process wide GiosgClient instance, creating it from settings on first use
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GiosgClient.from_settings()
+    return _client
+
+
+def reset_client():
+    """
+    Closes the shared client so that next get_client() call builds a new one from current settings
+    """
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
+
+
+@receiver(setting_changed)
+def _reset_client_on_setting_change(setting, **kwargs):
+    if setting in ("GIOSG_API_BASE_URL", "GIOSG_HTTP_CLIENT", "GIOSG_RESILIENCE"):
+        reset_client()
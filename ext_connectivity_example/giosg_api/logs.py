@@ -0,0 +1,148 @@
+"""
+Structured logging of Giosg API calls and received webhooks.
+
+Payloads are logged with log_payload() at DEBUG level. Nothing is serialized when DEBUG is not enabled
+for the logger, and otherwise the payload is serialized only by the formatter. QueueLogHandler hands
+records to a background thread which formats and writes them, so request threads never wait for I/O.
+SampleFilter keeps only a share of the low level records, for example payloads under heavy load.
+
+See LOGGING in settings.py for how these are configured.
+"""
+import json
+import logging
+import os
+import queue
+import random
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+
+class Payload:
+    """
+    Lazily decoded request or response body, serialized only when the record is formatted
+    """
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+    def decode(self):
+        data = self.data
+        if isinstance(data, (bytes, str)):
+            try:
+                return json.loads(data)
+            except ValueError:
+                return data.decode("utf-8", "replace") if isinstance(data, bytes) else data
+        return data
+
+    def __str__(self):
+        return json.dumps(self.decode(), default=str)
+
+
+def log_payload(logger, method, url, data):
+    """
+    Logs request or response payload of a Giosg API call or webhook at DEBUG level.
+    "url" may be a callable returning the URL, it is called only when DEBUG is enabled.
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        if callable(url):
+            url = url()
+        logger.debug("%s %s", method.upper(), url, extra={"payload": Payload(data)})
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one line JSON objects. Payload given with log_payload() is included as is.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        payload = getattr(record, "payload", None)
+        if payload is not None:
+            entry["payload"] = payload.decode()
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """
+    Passes only "rate" share of the records at or below "level". Records above it always pass.
+    """
+
+    def __init__(self, rate=1.0, level="DEBUG"):
+        super().__init__()
+        self.rate = rate
+        self.level = level if isinstance(level, int) else logging.getLevelName(level)
+
+    def filter(self, record):
+        return record.levelno > self.level or self.rate >= 1 or random.random() < self.rate
+
+
+class QueueLogHandler(QueueHandler):
+    """
+    Puts records to a bounded queue from which a background thread writes them to stderr.
+    When the queue is full records are dropped instead of blocking the caller, see "dropped".
+    """
+
+    def __init__(self, maxsize=10000, stream=None):
+        super().__init__(queue.Queue(maxsize))
+        self.target = logging.StreamHandler(stream)
+        self.dropped = 0
+        self._listener = None
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+
+    def setFormatter(self, fmt):
+        # Records are formatted by the target in the background thread
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # QueueHandler would format the message here, on the calling thread
+        return record
+
+    def enqueue(self, record):
+        self._start_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start_listener(self):
+        # Threads do not survive fork, so forked server workers start their own listener
+        if self._listener_pid == os.getpid():
+            return
+        with self._listener_lock:
+            if self._listener_pid != os.getpid():
+                self._listener = _Listener(self.queue, self.target, respect_handler_level=True)
+                self._listener.start()
+                self._listener_pid = os.getpid()
+
+    def flush(self):
+        """
+        Waits until the records queued so far have been written. Called by logging at exit.
+        """
+        with self._listener_lock:
+            if self._listener is not None and self._listener_pid == os.getpid():
+                self._listener.stop()
+                self._listener = None
+                self._listener_pid = None
+        self.target.flush()
+
+    def close(self):
+        self.flush()
+        self.target.close()
+        super().close()
+
+
+class _Listener(QueueListener):
+
+    def enqueue_sentinel(self):
+        # Wait for room instead of failing when the queue is full
+        self.queue.put(self._sentinel)
@@ -0,0 +1,244 @@
+"""
+Protection of our workers against a slow or failing Giosg service.
+
+Every call made through GiosgClient and AsyncGiosgClient goes through a circuit breaker and a bulkhead:
+
+Bulkhead caps the number of concurrent outbound calls of the process to GIOSG_RESILIENCE["max_concurrent_calls"].
+A call which does not get a slot in "bulkhead_timeout" seconds fails, so when Giosg slows down only that many
+workers wait for it and the rest keep serving requests which only touch our own database.
+
+CircuitBreaker keeps track of the outcome of the last "window" calls. Connection errors, timeouts and
+5xx responses are failures. When at least "min_calls" calls have been made and "failure_rate" share of them
+failed, the circuit opens and calls fail right away for "open_seconds". After that a single trial call is let
+through. If it succeeds the circuit closes again, otherwise it stays open for another "open_seconds".
+
+All of these fail with GiosgUnavailable, which GiosgUnavailableMiddleware turns into 503 responses.
+"""
+import asyncio
+import collections
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.deprecation import MiddlewareMixin
+
+from giosg_api.task_graph import TaskGraphError
+
+logger = logging.getLogger(__name__)
+
+# Defaults for settings.GIOSG_RESILIENCE
+DEFAULT_RESILIENCE_OPTIONS = {
+    "max_concurrent_calls": 16,
+    # How long a call may wait for a free slot before failing, in seconds
+    "bulkhead_timeout": 0.5,
+    "window": 20,
+    "min_calls": 10,
+    "failure_rate": 0.5,
+    "open_seconds": 10,
+}
+
+
+def get_option(name):
+    return getattr(settings, "GIOSG_RESILIENCE", {}).get(name, DEFAULT_RESILIENCE_OPTIONS[name])
+
+
+class GiosgUnavailable(Exception):
+    """
+    Raised when Giosg could not be reached, did not respond in time or is not called at all because
+    the circuit breaker is open or too many calls are in flight. "retry_after" is a hint in seconds.
+    """
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ResilienceStats:
+    """
+    Counters about outbound Giosg calls.
+
+    calls: calls whose outcome was recorded by the circuit breaker
+    failures: calls which failed with connection error, timeout or 5xx response
+    opened: times the circuit was opened
+    rejected_open: calls which were not made because the circuit was open
+    rejected_busy: calls which were not made because the bulkhead was full
+    """
+    fields = ("calls", "failures", "opened", "rejected_open", "rejected_busy")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counts = dict.fromkeys(self.fields, 0)
+
+    def increment(self, field):
+        with self._lock:
+            self._counts[field] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+stats = ResilienceStats()
+
+
+class CircuitBreaker:
+    """
+    See the module docstring. Thread safe, and the lock is only held for bookkeeping so that the
+    breaker can be used from async code as well.
+    """
+
+    def __init__(self, window=20, min_calls=10, failure_rate=0.5, open_seconds=10):
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self._outcomes = collections.deque(maxlen=window)
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(get_option("window"), get_option("min_calls"), get_option("failure_rate"),
+                   get_option("open_seconds"))
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self.open_seconds:
+            return "open"
+        return "half_open"
+
+    def before_call(self):
+        """
+        Raises GiosgUnavailable if the call must not be made. Returns True for the trial call of a
+        half open circuit, which must be passed to record().
+        """
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return False
+            if state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            retry_after = self.open_seconds - (time.monotonic() - self._opened_at)
+        stats.increment("rejected_open")
+        raise GiosgUnavailable("Giosg calls are failing, circuit breaker is open", max(math.ceil(retry_after), 1))
+
+    def record(self, success, trial=False):
+        """
+        Records the outcome of a call. "success" is None when the call was not made after all,
+        or failed for a reason which says nothing about the health of Giosg.
+        """
+        with self._lock:
+            if trial:
+                self._trial_running = False
+            if success is None:
+                return
+            stats.increment("calls")
+            if not success:
+                stats.increment("failures")
+            if trial:
+                if success:
+                    logger.info("Giosg call succeeded, closing circuit breaker")
+                    self._opened_at = None
+                else:
+                    self._open()
+            elif self._opened_at is None:
+                # Outcomes of calls which were started before the circuit opened are ignored
+                self._outcomes.append(success)
+                failures = self._outcomes.count(False)
+                if len(self._outcomes) >= self.min_calls and failures >= self.failure_rate * len(self._outcomes):
+                    logger.warning("%d of the last %d Giosg calls failed, opening circuit breaker",
+                                   failures, len(self._outcomes))
+                    self._open()
+
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        stats.increment("opened")
+
+
+class Bulkhead:
+    """
+    Context manager which limits the number of threads inside it, see the module docstring
+    """
+
+    def __init__(self, max_concurrent_calls=16, timeout=0.5):
+        self.timeout = timeout
+        self._semaphore = threading.BoundedSemaphore(max_concurrent_calls)
+
+    @classmethod
+    def from_settings(cls):
+        return cls(get_option("max_concurrent_calls"), get_option("bulkhead_timeout"))
+
+    def __enter__(self):
+        if not self._semaphore.acquire(timeout=self.timeout):
+            stats.increment("rejected_busy")
+            raise GiosgUnavailable("Too many concurrent Giosg calls")
+        return self
+
+    def __exit__(self, *exc_info):
+        self._semaphore.release()
+
+
+class AsyncBulkhead:
+    """
+    Asyncio counterpart of Bulkhead. Must be created in the event loop which uses it.
+    """
+
+    def __init__(self, max_concurrent_calls=16, timeout=0.5):
+        self.timeout = timeout
+        self._semaphore = asyncio.BoundedSemaphore(max_concurrent_calls)
+
+    @classmethod
+    def from_settings(cls):
+        return cls(get_option("max_concurrent_calls"), get_option("bulkhead_timeout"))
+
+    async def __aenter__(self):
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            stats.increment("rejected_busy")
+            raise GiosgUnavailable("Too many concurrent Giosg calls") from None
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._semaphore.release()
+
+
+def find_unavailable(exception):
+    """
+    Returns GiosgUnavailable which caused "exception", also when it was raised by a task of a task graph
+    """
+    if isinstance(exception, GiosgUnavailable):
+        return exception
+    if isinstance(exception, TaskGraphError):
+        return next((error for error in exception.errors.values() if isinstance(error, GiosgUnavailable)), None)
+    return None
+
+
+class GiosgUnavailableMiddleware(MiddlewareMixin):
+    """
+    Returns 503 with Retry-After header when a view fails because Giosg is unavailable
+    """
+
+    def process_exception(self, request, exception):
+        unavailable = find_unavailable(exception)
+        if unavailable is None:
+            return None
+        logger.warning("Giosg is unavailable for %s %s: %s", request.method, request.path, unavailable)
+        response = JsonResponse({"detail": "Giosg service is unavailable, try again later."}, status=503)
+        response["Retry-After"] = str(unavailable.retry_after)
+        return response
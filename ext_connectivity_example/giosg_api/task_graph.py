@@ -0,0 +1,164 @@
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Returns thread pool shared by all task graphs. Tasks are expected to mostly wait for network I/O.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                max_workers = getattr(settings, "GIOSG_TASK_GRAPH_MAX_WORKERS", 32)
+                _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="giosg-task")
+    return _executor
+
+
+@receiver(setting_changed)
+def _reset_executor_on_setting_change(setting, **kwargs):
+    global _executor
+    if setting == "GIOSG_TASK_GRAPH_MAX_WORKERS":
+        with _executor_lock:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = None
+
+
+class TaskGraphError(Exception):
+    """
+    Raised when one or more tasks of a TaskGraph failed. All errors are available in "errors"
+    as a dict of task name -> exception.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(f"{name}: {error!r}" for name, error in errors.items()))
+
+
+class Task:
+    def __init__(self, name, func, depends_on, compensate):
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+        self.compensate = compensate
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def duration(self):
+        return self.finished_at - self.started_at
+
+    def __call__(self, results):
+        self.started_at = time.perf_counter()
+        try:
+            return self.func(*(results[name] for name in self.depends_on))
+        finally:
+            self.finished_at = time.perf_counter()
+
+
+class TaskGraph:
+    """
+    Runs a set of dependent tasks, starting each task as soon as all tasks it depends on have finished.
+    Tasks that do not depend on each other run concurrently in a thread pool.
+
+    Each task function gets the results of the tasks it depends on as positional arguments.
+    If any task fails, no more tasks are started, running tasks are waited for and then the "compensate"
+    callbacks of successfully finished tasks are called with their results, in reverse order of completion.
+    Compensations are run in the calling thread, so they can safely use the database.
+    Finally TaskGraphError with all errors is raised.
+
+        graph = TaskGraph("chat start")
+        graph.add("visitor", create_visitor)
+        graph.add("name", set_name, depends_on=["visitor"])
+        graph.add("chat", create_chat, depends_on=["visitor"])
+        results = graph.run()
+    """
+
+    def __init__(self, name, executor=None):
+        self.name = name
+        self.executor = executor
+        self.tasks = {}
+        self.started_at = None
+        self.finished_at = None
+
+    def add(self, name, func, depends_on=(), compensate=None):
+        for dependency in depends_on:
+            if dependency not in self.tasks:
+                raise ValueError(f"Task {name} depends on unknown task {dependency}")
+        self.tasks[name] = Task(name, func, depends_on, compensate)
+
+    def run(self):
+        executor = self.executor or get_executor()
+        results = {}
+        errors = {}
+        completed = []
+        pending = dict(self.tasks)
+        running = {}
+
+        self.started_at = time.perf_counter()
+        while pending or running:
+            if not errors:
+                for name, task in list(pending.items()):
+                    if all(dependency in results for dependency in task.depends_on):
+                        # Context is copied so that tasks record their timing spans to the request
+                        running[executor.submit(contextvars.copy_context().run, task, results)] = task
+                        del pending[name]
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                try:
+                    results[task.name] = future.result()
+                    completed.append(task)
+                except Exception as ex:
+                    errors[task.name] = ex
+        self.finished_at = time.perf_counter()
+        self.log_timings()
+
+        if errors:
+            for task in reversed(completed):
+                if task.compensate is not None:
+                    try:
+                        task.compensate(results[task.name])
+                    except Exception:
+                        logger.exception("%s: compensation of task %s failed", self.name, task.name)
+            raise TaskGraphError(errors)
+        return results
+
+    @property
+    def duration(self):
+        return self.finished_at - self.started_at
+
+    @property
+    def sequential_duration(self):
+        """
+        How long running the finished tasks one after another would have taken
+        """
+        return sum(task.duration for task in self.tasks.values() if task.finished_at is not None)
+
+    def log_timings(self):
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        task_timings = ", ".join(
+            f"{task.name}={task.duration * 1000:.1f}ms"
+            for task in self.tasks.values() if task.finished_at is not None
+        )
+        logger.info(
+            "%s took %.1fms, %.1fms when run sequentially (%s)",
+            self.name, self.duration * 1000, self.sequential_duration * 1000, task_timings,
+        )
@@ -0,0 +1,291 @@
+"""
+Visitor access token caching.
+
+Tokens are stored in the Django cache together with the time when they should be renewed.
+When a token is missing, only one thread in one process authenticates the visitor at a time
+("single-flight"), others wait for the result instead of hammering the auth endpoint. Threads of
+the same process are coalesced with a local lock and processes with a lock stored in the cache.
+
+When a token is used after GIOSG_TOKEN_RENEW_AFTER share of its lifetime has passed, it is
+renewed in a background thread so that requests almost never have to wait for authentication.
+
+Configure a cache shared by all processes (DJANGO_CACHE_PROFILE in settings.py), otherwise every
+process authenticates each visitor itself. Tokens read from the shared cache are also kept in the memory
+of the process for GIOSG_TOKEN_LOCAL_CACHE["timeout"] seconds, but never past their renewal time, so
+that renewed tokens are picked up from the shared cache. Entries are stored as short strings
+"<renew at>:<token>" instead of pickled dicts, see ext_connectivity_example/cache_serializers.py.
+"""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from giosg_api.lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# How long a process may hold the refresh lock of a visitor before others give up waiting for it
+LOCK_TIMEOUT = 10
+# How often waiters check if the token has appeared to the cache
+POLL_INTERVAL = 0.05
+
+# Defaults for settings.GIOSG_TOKEN_LOCAL_CACHE
+DEFAULT_LOCAL_CACHE_OPTIONS = {
+    # How many tokens are kept in the memory of each process
+    "maxsize": 10000,
+    # How long a token read from the shared cache is used before it is read again, in seconds
+    "timeout": 60,
+}
+
+
+def get_option(name):
+    return getattr(settings, "GIOSG_TOKEN_LOCAL_CACHE", {}).get(name, DEFAULT_LOCAL_CACHE_OPTIONS[name])
+
+
+class TokenCacheStats:
+    """
+    Counters about token cache usage.
+
+    hits: token was found from cache
+    local_hits: token was found from the memory of this process, included in hits
+    misses: token was not found and the caller had to wait for it
+    coalesced_waits: caller got a token fetched by another thread or process while it was waiting
+    refreshes: token was fetched on the request path
+    background_refreshes: token was renewed in the background before it expired
+    """
+    fields = ("hits", "local_hits", "misses", "coalesced_waits", "refreshes", "background_refreshes")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counts = dict.fromkeys(self.fields, 0)
+
+    def increment(self, field):
+        with self._lock:
+            self._counts[field] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+stats = TokenCacheStats()
+
+_local_locks = weakref.WeakValueDictionary()
+_local_locks_guard = threading.Lock()
+_renewal_executor = None
+_local_tokens = None
+
+
+def _token_key(visitor_id):
+    return f"access_token_{visitor_id}"
+
+
+def _lock_key(visitor_id):
+    return f"access_token_lock_{visitor_id}"
+
+
+def _local_lock(visitor_id):
+    with _local_locks_guard:
+        lock = _local_locks.get(visitor_id)
+        if lock is None:
+            lock = _local_locks[visitor_id] = threading.Lock()
+        return lock
+
+
+def _local():
+    global _local_tokens
+    if _local_tokens is None:
+        with _local_locks_guard:
+            if _local_tokens is None:
+                _local_tokens = LRUCache(get_option("maxsize"), get_option("timeout"))
+    return _local_tokens
+
+
+def reset():
+    """
+    Drops tokens kept in the memory of this process. Shared cache entries are left as they are.
+    """
+    global _local_tokens
+    with _local_locks_guard:
+        _local_tokens = None
+
+
+def _encode_entry(token, renew_at):
+    return f"{int(renew_at)}:{token}"
+
+
+def _decode_entry(value):
+    """
+    Returns (token, renew_at) of a shared cache entry or None for entries of other formats
+    """
+    if not isinstance(value, str):
+        return None
+    renew_at, _, token = value.partition(":")
+    try:
+        return token, int(renew_at)
+    except ValueError:
+        return None
+
+
+def _get_entry(visitor_id):
+    entry = _local().get(visitor_id)
+    if entry is not None and time.time() < entry[1]:
+        stats.increment("local_hits")
+        return entry
+    entry = _decode_entry(cache.get(_token_key(visitor_id)))
+    if entry is not None:
+        _local().set(visitor_id, entry)
+    return entry
+
+
+async def _aget_entry(visitor_id):
+    entry = _local().get(visitor_id)
+    if entry is not None and time.time() < entry[1]:
+        stats.increment("local_hits")
+        return entry
+    entry = _decode_entry(await cache.aget(_token_key(visitor_id)))
+    if entry is not None:
+        _local().set(visitor_id, entry)
+    return entry
+
+
+def store_token(visitor):
+    """
+    Stores access token from Giosg auth response to cache
+    """
+    expires_in = int(visitor["expires_in"])
+    renew_after = getattr(settings, "GIOSG_TOKEN_RENEW_AFTER", 0.8)
+    token, renew_at = visitor["access_token"], time.time() + expires_in * renew_after
+    cache.set(_token_key(visitor["visitor_id"]), _encode_entry(token, renew_at), expires_in - 10)
+    _local().set(visitor["visitor_id"], (token, renew_at))
+
+
+def _acquire_lock(visitor_id):
+    owner = uuid.uuid4().hex
+    if cache.add(_lock_key(visitor_id), owner, LOCK_TIMEOUT):
+        return owner
+    return None
+
+
+def _release_lock(visitor_id, owner):
+    if cache.get(_lock_key(visitor_id)) == owner:
+        cache.delete(_lock_key(visitor_id))
+
+
+def get_token(organization_id, visitor_id, visitor_secret_id, authenticate):
+    """
+    Returns access token of the visitor from cache. If token is not found, calls
+    authenticate(organization_id, visitor_secret_id) which must store the new token with store_token().
+    """
+    entry = _get_entry(visitor_id)
+    if entry is not None:
+        stats.increment("hits")
+        token, renew_at = entry
+        if time.time() >= renew_at:
+            _schedule_renewal(organization_id, visitor_id, visitor_secret_id, authenticate)
+        return token
+
+    stats.increment("misses")
+    with _local_lock(visitor_id):
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        waited = False
+        while True:
+            entry = _get_entry(visitor_id)
+            if entry is not None:
+                # Another thread or process fetched the token while we were waiting
+                stats.increment("coalesced_waits")
+                return entry[0]
+
+            owner = _acquire_lock(visitor_id)
+            if owner is not None or time.monotonic() >= deadline:
+                if waited and owner is None:
+                    logger.warning("Timed out waiting for access token of visitor %s", visitor_id)
+                try:
+                    stats.increment("refreshes")
+                    return authenticate(organization_id, visitor_secret_id)["access_token"]
+                finally:
+                    if owner is not None:
+                        _release_lock(visitor_id, owner)
+
+            waited = True
+            time.sleep(POLL_INTERVAL)
+
+
+async def aget_token(organization_id, visitor_id, visitor_secret_id, authenticate):
+    """
+    Same as get_token() but for async code. authenticate must be a coroutine function.
+    Waiting tasks are coalesced through the cache lock only.
+    """
+    entry = await _aget_entry(visitor_id)
+    if entry is not None:
+        stats.increment("hits")
+        token, renew_at = entry
+        if time.time() >= renew_at:
+            # Renewal uses the sync API in a background thread
+            from giosg_api.api import authenticate_giosg_visitor
+            await sync_to_async(_schedule_renewal)(
+                organization_id, visitor_id, visitor_secret_id, authenticate_giosg_visitor,
+            )
+        return token
+
+    stats.increment("misses")
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while True:
+        entry = await _aget_entry(visitor_id)
+        if entry is not None:
+            stats.increment("coalesced_waits")
+            return entry[0]
+
+        owner = uuid.uuid4().hex
+        acquired = await cache.aadd(_lock_key(visitor_id), owner, LOCK_TIMEOUT)
+        if acquired or time.monotonic() >= deadline:
+            try:
+                stats.increment("refreshes")
+                visitor = await authenticate(organization_id, visitor_secret_id)
+                return visitor["access_token"]
+            finally:
+                if acquired and await cache.aget(_lock_key(visitor_id)) == owner:
+                    await cache.adelete(_lock_key(visitor_id))
+
+        await asyncio.sleep(POLL_INTERVAL)
+
+
+def _schedule_renewal(organization_id, visitor_id, visitor_secret_id, authenticate):
+    global _renewal_executor
+    owner = _acquire_lock(visitor_id)
+    if owner is None:
+        # Somebody is already renewing the token
+        return
+
+    def renew():
+        try:
+            authenticate(organization_id, visitor_secret_id)
+            stats.increment("background_refreshes")
+        except Exception:
+            logger.exception("Failed to renew access token of visitor %s", visitor_id)
+        finally:
+            _release_lock(visitor_id, owner)
+
+    with _local_locks_guard:
+        if _renewal_executor is None:
+            _renewal_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="giosg-token-renewal")
+    _renewal_executor.submit(renew)
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    if setting in ("GIOSG_TOKEN_LOCAL_CACHE", "CACHES"):
+        reset()
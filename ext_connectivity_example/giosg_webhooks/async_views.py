@@ -0,0 +1,103 @@
+"""
+Async versions of the webhook views. These are used when the app is served with an ASGI server
+(see ext_connectivity_example/asgi_urls.py).
+"""
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse
+from rest_framework import status
+
+from . import decoders, dedup
+
+from .models import WebhookEvent
+
+from chat_app.async_views import async_csrf_exempt
+
+from ext_connectivity_example.instrumentation import span
+from giosg_api.logs import log_payload
+
+logger = logging.getLogger(__name__)
+
+
+def _method_not_allowed(webhook_name):
+    return JsonResponse({
+        "detail": f"Only POST requests supported. "
+                  f"This endpoint is intended to be called by Giosg {webhook_name} webhook"
+    }, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+def _decode(request, webhook_class, many=False):
+    try:
+        # Retries of webhooks we have already queued are dropped before validating them
+        with span("decode"):
+            return decoders.decode(request.body, webhook_class, many=many, skip=dedup.is_duplicate), None
+    except decoders.WebhookDecodeError as error:
+        return None, JsonResponse(error.errors, safe=False, status=status.HTTP_400_BAD_REQUEST)
+
+
+@async_csrf_exempt
+async def giosg_chat_webhook(request):
+    """
+    Async version of GiosgChatWebhookView
+
+    GET/POST /giosg_webhooks/chats
+    """
+    if request.method != "POST":
+        return _method_not_allowed("chat")
+
+    # Body is decoded only if DEBUG logging is enabled and the record is sampled
+    log_payload(logger, "received webhook", request.build_absolute_uri, request.body)
+
+    webhook, error_response = _decode(request, decoders.ChatWebhook)
+    if error_response:
+        return error_response
+
+    if webhook is not None:
+        await sync_to_async(dedup.enqueue_new)(WebhookEvent.KIND_CHAT, [webhook])
+    return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+
+
+@async_csrf_exempt
+async def giosg_message_webhook(request):
+    """
+    Async version of GiosgChatMessageWebhookView
+
+    GET/POST /giosg_webhooks/messages
+    """
+    if request.method != "POST":
+        return _method_not_allowed("message")
+
+    # Body is decoded only if DEBUG logging is enabled and the record is sampled
+    log_payload(logger, "received webhook", request.build_absolute_uri, request.body)
+
+    webhook, error_response = _decode(request, decoders.MessageWebhook)
+    if error_response:
+        return error_response
+
+    if webhook is not None:
+        await sync_to_async(dedup.enqueue_new)(WebhookEvent.KIND_MESSAGE, [webhook])
+    return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+
+
+@async_csrf_exempt
+async def giosg_message_batch_webhook(request):
+    """
+    Async version of GiosgChatMessageBatchWebhookView
+
+    GET/POST /giosg_webhooks/messages/batch
+    """
+    if request.method != "POST":
+        return JsonResponse({
+            "detail": "Only POST requests supported. This endpoint expects a list of message webhook payloads"
+        }, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    # Body is decoded only if DEBUG logging is enabled and the record is sampled
+    log_payload(logger, "received webhook", request.build_absolute_uri, request.body)
+
+    webhooks, error_response = _decode(request, decoders.MessageWebhook, many=True)
+    if error_response:
+        return error_response
+
+    await sync_to_async(dedup.enqueue_new)(WebhookEvent.KIND_MESSAGE, webhooks)
+    return HttpResponse(status=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,164 @@
+"""
+Fast decoding of webhook payloads.
+
+Only the fields which the handlers read are picked from the payload and validated, rest of the
+payload is ignored. Validation rules are the same as in serializers.py (strings which are not blank
+and fit the max length, booleans), but values are not coerced: for example a number is not accepted
+as a string.
+Fields of the resource which the handler needs to store the new chat or message are required when
+the action is "added".
+
+Decoded webhooks are records with __slots__. to_payload() returns the payload in the same shape as
+the serializers did, which is what is stored to the queue and given to the handlers.
+"""
+import json
+
+ACTIONS = frozenset(("added", "changed", "removed"))
+
+
+class WebhookDecodeError(ValueError):
+    """
+    Raised when webhook payload is invalid. "errors" are in the same format as DRF serializer errors.
+    """
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def _field(data, name, kind, max_length, required, nullable, errors):
+    value = data.get(name)
+    if value is None:
+        if name not in data:
+            if required:
+                errors[name] = ["This field is required."]
+        elif not nullable:
+            errors[name] = ["This field may not be null."]
+        return None
+    if kind is bool:
+        if type(value) is not bool:
+            errors[name] = ["Must be a valid boolean."]
+    elif type(value) is not str:
+        errors[name] = ["Not a valid string."]
+    elif not value:
+        errors[name] = ["This field may not be blank."]
+    elif len(value) > max_length:
+        errors[name] = [f"Ensure this field has no more than {max_length} characters."]
+    return value
+
+
+class Webhook:
+    """
+    Base of decoded webhooks. Subclasses list the fields of the resource they use in "resource_fields"
+    as (name, type, max length, required when action is "added", null allowed) tuples. Type is str or bool,
+    max length is only used for strings.
+    """
+    __slots__ = ("action", "resource_id", "channel")
+    resource_fields = ()
+
+    @classmethod
+    def from_dict(cls, data):
+        if not isinstance(data, dict):
+            raise WebhookDecodeError({"non_field_errors": ["Invalid data. Expected a dictionary."]})
+
+        errors = {}
+        action = _field(data, "action", str, 50, True, False, errors)
+        if "action" not in errors and action not in ACTIONS:
+            errors["action"] = [f'"{action}" is not a valid action.']
+        resource_id = _field(data, "resource_id", str, 50, True, False, errors)
+        channel = _field(data, "channel", str, 256, True, False, errors)
+
+        resource = data.get("resource")
+        values = ()
+        if resource is None:
+            errors["resource"] = ["This field is required."]
+        elif not isinstance(resource, dict):
+            errors["resource"] = {"non_field_errors": ["Invalid data. Expected a dictionary."]}
+        else:
+            resource_errors = {}
+            added = action == "added"
+            values = [
+                _field(resource, name, kind, max_length, added and required, nullable, resource_errors)
+                for name, kind, max_length, required, nullable in cls.resource_fields
+            ]
+            if resource_errors:
+                errors["resource"] = resource_errors
+        if errors:
+            raise WebhookDecodeError(errors)
+
+        webhook = cls.__new__(cls)
+        webhook.action = action
+        webhook.resource_id = resource_id
+        webhook.channel = channel
+        for field, value in zip(cls.resource_fields, values):
+            setattr(webhook, field[0], value)
+        return webhook
+
+    def to_payload(self):
+        return {
+            "action": self.action,
+            "resource_id": self.resource_id,
+            "channel": self.channel,
+            "resource": {field[0]: getattr(self, field[0]) for field in self.resource_fields},
+        }
+
+
+class ChatWebhook(Webhook):
+    """
+    Chat webhook, see serializers.ChatWebhookSerializer
+    """
+    __slots__ = ("room_organization_id", "is_ended")
+    resource_fields = (
+        ("room_organization_id", str, 200, True, False),
+        ("is_ended", bool, None, False, False),
+    )
+
+
+class MessageWebhook(Webhook):
+    """
+    Message webhook, see serializers.MessageWebhookSerializer
+    """
+    __slots__ = ("type", "chat_id", "sender_type", "sender_id", "sender_name", "message")
+    resource_fields = (
+        ("type", str, 20, True, False),
+        ("chat_id", str, 50, True, False),
+        ("sender_type", str, 50, True, False),
+        ("sender_id", str, 50, True, False),
+        ("sender_name", str, 200, False, True),
+        ("message", str, 2048, False, True),
+    )
+
+
+def decode(body, webhook_class, many=False, skip=None):
+    """
+    Decodes JSON request body to webhook_class instance, or to list of them if "many" is True.
+    Raises WebhookDecodeError if the body is not valid.
+
+    Payloads for which "skip" returns True are dropped without validating them,
+    in which case None is returned instead of a single webhook.
+    """
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise WebhookDecodeError({"detail": "JSON parse error"})
+    if not many:
+        if skip is not None and skip(data):
+            return None
+        return webhook_class.from_dict(data)
+
+    if not isinstance(data, list):
+        raise WebhookDecodeError({"non_field_errors": ["Expected a list of items."]})
+    webhooks = []
+    errors = []
+    for item in data:
+        if skip is not None and skip(item):
+            errors.append({})
+            continue
+        try:
+            webhooks.append(webhook_class.from_dict(item))
+            errors.append({})
+        except WebhookDecodeError as error:
+            errors.append(error.errors)
+    if any(errors):
+        raise WebhookDecodeError(errors)
+    return webhooks
@@ -0,0 +1,198 @@
+"""
+Deduplication of webhooks which Giosg sends more than once.
+
+Giosg retries webhooks when it does not get a response in time, so the same webhook may arrive many
+times. Webhooks are identified by (channel, resource_id, action) and each of them is queued only once
+within GIOSG_WEBHOOK_DEDUP["window"] seconds:
+
+1. Keys of recently queued webhooks are kept in an in-process LRU cache. Retries found from it are
+   dropped right after the body has been parsed, before the payload is validated or the database is touched.
+2. Otherwise the key is inserted to the ReceivedWebhook table in the same transaction as the webhook is
+   queued, and its unique constraint tells if another process has queued the webhook already.
+
+A chat may change many times, so "changed" webhooks are never deduplicated. For batches, keys which
+already exist are read first and the rest are inserted ignoring conflicts, so concurrent deliveries of
+the same batch may still queue a webhook twice. Handlers are idempotent, so that is harmless.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import IntegrityError, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from giosg_api.lru import LRUCache
+
+from .models import ReceivedWebhook
+from .queue import enqueue_many
+
+logger = logging.getLogger(__name__)
+
+# Actions which happen only once for each resource
+DEDUPLICATED_ACTIONS = frozenset(("added", "removed"))
+
+# Defaults for settings.GIOSG_WEBHOOK_DEDUP
+DEFAULT_DEDUP_OPTIONS = {
+    # How long webhooks are remembered, in seconds
+    "window": 24 * 3600,
+    # How many keys are kept in the local cache of each process
+    "maxsize": 100000,
+    # How often deduplication statistics are logged, in seconds. 0 disables logging.
+    "stats_interval": 300,
+}
+
+
+def get_option(name):
+    return getattr(settings, "GIOSG_WEBHOOK_DEDUP", {}).get(name, DEFAULT_DEDUP_OPTIONS[name])
+
+
+class DedupStats:
+    """
+    Counters of received webhooks and duplicates dropped by the local cache and by the database
+    """
+    fields = ("received", "local_duplicates", "db_duplicates")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._logged_at = time.monotonic()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counts = dict.fromkeys(self.fields, 0)
+
+    def increment(self, field, count=1):
+        with self._lock:
+            self._counts[field] += count
+
+    def snapshot(self):
+        with self._lock:
+            counts = dict(self._counts)
+        duplicates = counts["local_duplicates"] + counts["db_duplicates"]
+        counts["dedup_rate"] = round(duplicates / counts["received"], 4) if counts["received"] else None
+        return counts
+
+    def maybe_log(self):
+        interval = get_option("stats_interval")
+        if interval and time.monotonic() - self._logged_at >= interval:
+            self._logged_at = time.monotonic()
+            logger.info("Webhook deduplication statistics: %s", self.snapshot())
+
+
+stats = DedupStats()
+
+_local = None
+_local_lock = threading.Lock()
+
+
+def get_local_cache():
+    global _local
+    if _local is None:
+        with _local_lock:
+            if _local is None:
+                _local = LRUCache(get_option("maxsize"), get_option("window"))
+    return _local
+
+
+def get_key(channel, resource_id, action):
+    """
+    Returns deduplication key of the webhook, or None if webhooks like it are not deduplicated
+    """
+    if action not in DEDUPLICATED_ACTIONS:
+        return None
+    return (channel, resource_id, action)
+
+
+def is_duplicate(data):
+    """
+    Returns True if the parsed webhook payload was queued recently by this process.
+    Only the local cache is checked, so this is cheap enough to do before validating the payload.
+    """
+    stats.increment("received")
+    stats.maybe_log()
+    if not isinstance(data, dict):
+        return False
+    key = get_key(data.get("channel"), data.get("resource_id"), data.get("action"))
+    if key is None or get_local_cache().get(key) is None:
+        return False
+    stats.increment("local_duplicates")
+    return True
+
+
+def _claim(keys):
+    """
+    Inserts keys to ReceivedWebhook table and returns those of them which were there already
+    """
+    existing = keys & set(
+        ReceivedWebhook.objects
+        .filter(resource_id__in={key[1] for key in keys})
+        .values_list("channel", "resource_id", "action")
+    )
+    ReceivedWebhook.objects.bulk_create([
+        ReceivedWebhook(channel=channel, resource_id=resource_id, action=action)
+        for channel, resource_id, action in keys - existing
+    ], ignore_conflicts=True)
+    return existing
+
+
+def enqueue_new(kind, webhooks):
+    """
+    Queues those of the decoded webhooks which have not been queued before.
+    Returns the number of queued webhooks.
+    """
+    keys = set()
+    new_webhooks = []
+    for webhook in webhooks:
+        key = get_key(webhook.channel, webhook.resource_id, webhook.action)
+        if key is not None:
+            if key in keys:
+                stats.increment("local_duplicates")
+                continue
+            keys.add(key)
+        new_webhooks.append((key, webhook))
+
+    if len(new_webhooks) == 1 and keys:
+        # Single webhook is the common case: the insert either succeeds or the webhook is a duplicate
+        try:
+            with transaction.atomic():
+                channel, resource_id, action = next(iter(keys))
+                ReceivedWebhook.objects.create(channel=channel, resource_id=resource_id, action=action)
+                enqueue_many(kind, [new_webhooks[0][1].to_payload()])
+            queued = 1
+        except IntegrityError:
+            stats.increment("db_duplicates")
+            queued = 0
+    else:
+        with transaction.atomic():
+            existing = _claim(keys) if keys else set()
+            if existing:
+                stats.increment("db_duplicates", len(existing))
+            payloads = [webhook.to_payload() for key, webhook in new_webhooks if key not in existing]
+            enqueue_many(kind, payloads)
+        queued = len(payloads)
+
+    local = get_local_cache()
+    for key in keys:
+        local.set(key, True)
+    return queued
+
+
+def delete_expired():
+    """
+    Forgets webhooks received before the deduplication window
+    """
+    return ReceivedWebhook.objects.filter(
+        received_at__lt=timezone.now() - timedelta(seconds=get_option("window"))
+    ).delete()[0]
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    global _local
+    if setting == "GIOSG_WEBHOOK_DEDUP":
+        with _local_lock:
+            _local = None
@@ -0,0 +1,199 @@
+"""
+Processing of validated webhook payloads. Webhook views only store the payloads to the queue,
+these functions are called by the "process_webhooks" workers.
+"""
+import logging
+
+from django.db import IntegrityError
+from django.utils import timezone
+
+from chat_app import push
+from chat_app.caching import chat_ids, visitor_ids
+from chat_app.models import ArchivedChatMessage, ChatConversation, ChatMessage
+
+from giosg_api import api
+
+logger = logging.getLogger(__name__)
+
+
+def handle_chat_webhook(payload):
+    """
+    Handle chat webhook from Giosg platform
+    """
+    resource_id = payload["resource_id"]
+
+    if payload["action"] == "added":
+        # If the action was "added" we need to create a new chat to
+        # our third-party system.
+        if chat_ids.get(resource_id) is not None:
+            # Chat was started by our app and stored already when it was created
+            logger.debug("Chat %s already exists", resource_id)
+            return
+
+        org_id = payload["resource"]["room_organization_id"]
+        visitor_id = api.get_visitor_id(org_id, resource_id)
+
+        visitor_pk = visitor_ids.get(visitor_id)
+        if visitor_pk is None:
+            logger.debug("Visitor of chat %s was not found so chat was not started by our app and we skip it",
+                         resource_id)
+        else:
+            try:
+                chat, _ = ChatConversation.objects.get_or_create(
+                    giosg_chat_id=resource_id,
+                    visitor_id=visitor_pk,
+                )
+            except IntegrityError:
+                # Visitor may have been deleted by another process after we cached its ID
+                visitor_ids.delete(visitor_id)
+                raise
+            logger.info("Created %s", chat)
+    elif payload["action"] == "changed":
+        # Changed webhooks contain only the changed fields. We only care about the chat ending, messages
+        # of ended chats are archived after a while. Other changes could be handled here as well.
+        is_ended = payload["resource"].get("is_ended")
+        if is_ended is not None:
+            set_chat_ended(resource_id, is_ended)
+    elif payload["action"] == "removed":
+        # If the action was "removed" we can delete the chat from
+        # our third-party chat system also. This could happen for example if data was asked to be
+        # purged because of a GDPR reasons. Cached ID is dropped when the chat is deleted
+        # but we drop it also here in case the chat was already deleted locally.
+        chat_ids.delete(resource_id)
+        try:
+            chat = ChatConversation.objects.get(giosg_chat_id=resource_id)
+            chat.delete()
+            logger.info("Deleted %s", chat)
+        except ChatConversation.DoesNotExist:
+            pass
+
+
+def set_chat_ended(giosg_chat_id, is_ended):
+    """
+    Marks chat ended, or open again if it was reopened on Giosg platform
+    """
+    try:
+        chat = ChatConversation.objects.get(giosg_chat_id=giosg_chat_id)
+    except ChatConversation.DoesNotExist:
+        return
+    if is_ended == (chat.ended_at is not None):
+        return
+    chat.ended_at = timezone.now() if is_ended else None
+    # Saved with save() so that updated_at changes and the change is pushed to browsers
+    chat.save(update_fields=["ended_at", "updated_at"])
+    logger.info("Chat %s %s", giosg_chat_id, "ended" if is_ended else "reopened")
+
+
+def handle_message_webhook(payload):
+    """
+    Handle message webhook from Giosg platform
+    """
+    resource_id = payload["resource_id"]
+    resource = payload["resource"]
+
+    if payload["action"] == "added":
+        # If the action was "added" we need to create a new message to
+        # our third-party system.
+        if ingest_messages([payload]):
+            raise ChatConversation.DoesNotExist(f"Chat {resource['chat_id']} was not found")
+    elif payload["action"] == "changed":
+        # We dont care about changes at the moment but we could do something
+        # with the changed information
+        pass
+    elif payload["action"] == "removed":
+        # If the action was "removed" we can delete the message from
+        # our third-party chat system also.
+        try:
+            message = ChatMessage.objects.get(giosg_message_id=resource_id)
+            message.delete()
+            logger.info("Deleted %s", message)
+        except ChatMessage.DoesNotExist:
+            ArchivedChatMessage.objects.filter(giosg_message_id=resource_id).delete()
+
+
+def prefetch_chat_visitors(payloads):
+    """
+    Resolves visitors of new chats in the given chat webhook payloads concurrently, so that
+    handle_chat_webhook() finds them from the cache.
+    """
+    chats_by_org = {}
+    for payload in payloads:
+        if payload["action"] == "added" and chat_ids.get(payload["resource_id"]) is None:
+            org_id = payload["resource"]["room_organization_id"]
+            chats_by_org.setdefault(org_id, []).append(payload["resource_id"])
+    for org_id, giosg_chat_ids in chats_by_org.items():
+        api.get_visitor_ids(org_id, giosg_chat_ids)
+
+
+def get_sender_name(resource):
+    """
+    Returns name of the message sender shown in our app
+    """
+    # We could also use sender_public_name if we wish
+    if resource["sender_type"] == "visitor" and resource["sender_name"] is None:
+        return "Visitor"
+    return resource["sender_name"]
+
+
+def ingest_messages(payloads):
+    """
+    Stores messages of "added" message webhooks with as few queries as possible: all chats are
+    resolved with one query and new messages are inserted with bulk_create. Messages which
+    already exist (replayed webhooks) are skipped, and only rows inserted by this call are published.
+
+    Returns payloads which could not be stored because their chat was not found.
+    """
+    # We ignore all other kinds of messages like join and leave notifications
+    # and care only about text content
+    payloads = [p for p in payloads if p["action"] == "added" and p["resource"]["type"] == "msg"]
+    if not payloads:
+        return []
+
+    chats = chat_ids.get_many(p["resource"]["chat_id"] for p in payloads)
+    seen = set(
+        ChatMessage.objects
+        .filter(giosg_message_id__in=[p["resource_id"] for p in payloads])
+        .values_list("giosg_message_id", flat=True)
+    )
+
+    messages = []
+    missing = []
+    for payload in payloads:
+        resource = payload["resource"]
+        if payload["resource_id"] in seen:
+            continue
+        chat_id = chats.get(resource["chat_id"])
+        if chat_id is None:
+            missing.append(payload)
+            continue
+        seen.add(payload["resource_id"])
+        messages.append(ChatMessage(
+            giosg_message_id=payload["resource_id"],
+            chat_id=chat_id,
+            sender_id=resource["sender_id"],
+            sender_name=get_sender_name(resource),
+            message=resource["message"],
+        ))
+
+    try:
+        # Conflicts can only come from webhooks of the same message processed at the same time
+        ChatMessage.objects.bulk_create(messages, batch_size=500, ignore_conflicts=True)
+    except IntegrityError:
+        # Some chat may have been deleted by another process after we cached its ID
+        for chat_id in {p["resource"]["chat_id"] for p in payloads}:
+            chat_ids.delete(chat_id)
+        raise
+    if messages:
+        # Rows dropped as conflicts were inserted by someone else, who also publishes them
+        inserted = set()
+        for start in range(0, len(messages), 500):
+            inserted.update(
+                ChatMessage.objects
+                .filter(pk__in=[message.pk for message in messages[start:start + 500]])
+                .values_list("pk", flat=True)
+            )
+        messages = [message for message in messages if message.pk in inserted]
+    if messages:
+        push.publish_messages(messages)
+    logger.info("Created %d messages", len(messages))
+    return missing
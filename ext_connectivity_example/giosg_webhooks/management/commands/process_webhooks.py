@@ -0,0 +1,88 @@
+import json
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from chat_app import caching, push
+from giosg_webhooks import dedup
+from giosg_webhooks.queue import process_batch
+
+# How often keys of webhooks received before the deduplication window and old push events are deleted, in seconds
+CLEANUP_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = "Processes webhooks received from Giosg. Run this alongside the web server."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="Number of worker threads")
+        parser.add_argument("--batch-size", type=int, default=100, help="How many events a worker claims at once")
+        parser.add_argument("--poll-interval", type=float, default=0.5,
+                            help="How long an idle worker sleeps before checking the queue again, in seconds")
+        parser.add_argument("--once", action="store_true", help="Exit when the queue is empty")
+        parser.add_argument("--stats-interval", type=float, default=300,
+                            help="How often ID cache statistics are printed, in seconds. 0 disables them")
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        threads = [
+            threading.Thread(target=self.work, args=(stop, options), name=f"webhook-worker-{i}", daemon=True)
+            for i in range(options["workers"])
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f"Processing webhooks with {len(threads)} workers")
+        next_stats_at = time.monotonic() + options["stats_interval"]
+        self.delete_expired_rows()
+        next_cleanup_at = time.monotonic() + CLEANUP_INTERVAL
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+                    if options["stats_interval"] and time.monotonic() >= next_stats_at:
+                        self.print_stats()
+                        next_stats_at = time.monotonic() + options["stats_interval"]
+                    if time.monotonic() >= next_cleanup_at:
+                        self.delete_expired_rows()
+                        next_cleanup_at = time.monotonic() + CLEANUP_INTERVAL
+        except KeyboardInterrupt:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        finally:
+            connection.close()
+        if options["stats_interval"]:
+            self.print_stats()
+
+    def print_stats(self):
+        self.stdout.write(f"ID cache statistics: {json.dumps(caching.stats())}")
+
+    def delete_expired_rows(self):
+        close_old_connections()
+        try:
+            dedup.delete_expired()
+        except Exception as ex:
+            self.stderr.write(f"Failed to delete expired webhook keys: {ex!r}")
+        try:
+            push.delete_old_events()
+        except Exception as ex:
+            self.stderr.write(f"Failed to delete old push events: {ex!r}")
+
+    def work(self, stop, options):
+        try:
+            while not stop.is_set():
+                close_old_connections()
+                try:
+                    processed = process_batch(options["batch_size"])
+                except Exception as ex:
+                    # Most likely the database is locked or unavailable, try again later
+                    self.stderr.write(f"Failed to claim webhooks: {ex!r}")
+                    processed = 0
+                if not processed:
+                    if options["once"]:
+                        return
+                    stop.wait(options["poll_interval"])
+        finally:
+            connection.close()
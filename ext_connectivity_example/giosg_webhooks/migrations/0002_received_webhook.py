@@ -0,0 +1,28 @@
+# Generated by Django 4.0.2 on 2026-10-18 16:53
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('giosg_webhooks', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReceivedWebhook',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel', models.CharField(max_length=256)),
+                ('resource_id', models.CharField(max_length=50)),
+                ('action', models.CharField(max_length=50)),
+                ('received_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='receivedwebhook',
+            constraint=models.UniqueConstraint(fields=('resource_id', 'action', 'channel'), name='received_webhook_key'),
+        ),
+    ]
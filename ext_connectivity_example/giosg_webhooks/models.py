@@ -1,3 +1,66 @@
 from django.db import models
+from django.utils import timezone
 
-# Create your models here.
+
+class WebhookEvent(models.Model):
+    """
+    Webhook received from Giosg which is waiting to be processed by the "process_webhooks" workers.
+
+    Events with the same "ordering_key" (Giosg chat ID) are processed one at a time in the order
+    they were received. Successfully processed events are deleted. Events which fail too many times
+    are left to the table with status "dead" so that they can be inspected and retried manually.
+    """
+    KIND_CHAT = "chat"
+    KIND_MESSAGE = "message"
+    KIND_CHOICES = [
+        (KIND_CHAT, "Chat"),
+        (KIND_MESSAGE, "Message"),
+    ]
+
+    STATUS_PENDING = "pending"
+    STATUS_PROCESSING = "processing"
+    STATUS_DEAD = "dead"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_PROCESSING, "Processing"),
+        (STATUS_DEAD, "Dead"),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    ordering_key = models.CharField(max_length=256)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "id"]),
+            models.Index(fields=["ordering_key", "status"]),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} webhook {self.id} ({self.status})"
+
+
+class ReceivedWebhook(models.Model):
+    """
+    Key of a webhook which was accepted to the queue. Giosg retries webhooks which it thinks were not
+    delivered, and the unique constraint makes sure that each of them is queued only once.
+    Rows older than the deduplication window are deleted, see giosg_webhooks/dedup.py.
+    """
+    channel = models.CharField(max_length=256)
+    resource_id = models.CharField(max_length=50)
+    action = models.CharField(max_length=50)
+    received_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["resource_id", "action", "channel"], name="received_webhook_key"),
+        ]
+
+    def __str__(self):
+        return f"{self.action} {self.channel} {self.resource_id}"
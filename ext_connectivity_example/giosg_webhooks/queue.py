@@ -0,0 +1,214 @@
+"""
+Database backed queue for received webhooks.
+
+Webhook views validate and enqueue the payloads and return immediately, so that Giosg does not have
+to wait for our own processing. Workers (see management command "process_webhooks") claim events from
+the queue and process them with the handlers in giosg_webhooks/handlers.py.
+
+Events with the same ordering key (Giosg chat ID) are processed strictly in the order they were received:
+only the oldest unfinished event of each key can be claimed. Failed events are retried with exponential
+backoff and after too many attempts they are marked "dead" and skipped.
+
+Consecutive "added" message webhooks of a chat are claimed together and all claimed messages are
+stored with one bulk insert (see handlers.ingest_messages), so under load single webhooks are
+effectively buffered for the polling interval of the workers and ingested in batches.
+"""
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Min
+from django.utils import timezone
+
+from .handlers import handle_chat_webhook, handle_message_webhook, ingest_messages, prefetch_chat_visitors
+from chat_app.models import ChatConversation
+
+from .models import WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {
+    WebhookEvent.KIND_CHAT: handle_chat_webhook,
+    WebhookEvent.KIND_MESSAGE: handle_message_webhook,
+}
+
+# Defaults for settings.GIOSG_WEBHOOK_QUEUE
+DEFAULT_QUEUE_OPTIONS = {
+    # How many times processing of an event is attempted before it is marked dead
+    "max_attempts": 8,
+    # Delay before the first retry in seconds, doubled for each following attempt
+    "retry_delay": 2,
+    "max_retry_delay": 300,
+    # How long a worker may process an event before it is given to another worker, in seconds
+    "lease": 60,
+}
+
+
+def get_option(name):
+    return getattr(settings, "GIOSG_WEBHOOK_QUEUE", {}).get(name, DEFAULT_QUEUE_OPTIONS[name])
+
+
+def get_ordering_key(kind, payload):
+    """
+    Returns Giosg chat ID the webhook relates to. Events of the same chat are processed in order.
+    """
+    if kind == WebhookEvent.KIND_CHAT:
+        return payload["resource_id"]
+    return payload["resource"].get("chat_id") or payload["channel"]
+
+
+def enqueue(kind, payload):
+    """
+    Stores validated webhook payload to the queue
+    """
+    return WebhookEvent.objects.create(
+        kind=kind,
+        ordering_key=get_ordering_key(kind, payload),
+        payload=payload,
+    )
+
+
+def enqueue_many(kind, payloads):
+    """
+    Stores list of validated webhook payloads to the queue with one insert
+    """
+    return WebhookEvent.objects.bulk_create([
+        WebhookEvent(kind=kind, ordering_key=get_ordering_key(kind, payload), payload=payload)
+        for payload in payloads
+    ])
+
+
+def is_new_message(kind, action):
+    return kind == WebhookEvent.KIND_MESSAGE and action == "added"
+
+
+def claim(limit=10):
+    """
+    Claims up to "limit" events for processing. Only the oldest unfinished event of each ordering key
+    can be claimed, except that it is claimed together with the "added" message events directly following it
+    if it is one as well.
+    """
+    now = timezone.now()
+    # Give events of crashed workers back to the queue
+    WebhookEvent.objects.filter(
+        status=WebhookEvent.STATUS_PROCESSING, locked_until__lt=now,
+    ).update(status=WebhookEvent.STATUS_PENDING, locked_until=None)
+
+    candidates = list(
+        WebhookEvent.objects
+        .filter(status=WebhookEvent.STATUS_PENDING, available_at__lte=now)
+        .order_by("id")
+        .values_list("id", "ordering_key", "kind", "payload__action")[:limit * 5]
+    )
+    if not candidates:
+        return []
+
+    # Only the oldest unfinished event of each key may be processed
+    heads = dict(
+        WebhookEvent.objects
+        .filter(
+            ordering_key__in={candidate[1] for candidate in candidates},
+            status__in=[WebhookEvent.STATUS_PENDING, WebhookEvent.STATUS_PROCESSING],
+        )
+        .values("ordering_key")
+        .annotate(first_id=Min("id"))
+        .values_list("ordering_key", "first_id")
+    )
+
+    runs = {}
+    # Keys whose run of new messages may still continue
+    open_runs = set()
+    for event_id, key, kind, action in candidates:
+        if key not in runs:
+            if heads.get(key) == event_id:
+                runs[key] = [event_id]
+                if is_new_message(kind, action):
+                    open_runs.add(key)
+        elif key in open_runs:
+            if is_new_message(kind, action):
+                runs[key].append(event_id)
+            else:
+                open_runs.discard(key)
+
+    claimed_ids = []
+    locked_until = now + timedelta(seconds=get_option("lease"))
+    for head_id, *rest in runs.values():
+        # Conditional update makes sure that only one worker gets the event. If we get the head,
+        # other workers can not claim the rest of the run as it is not the oldest event any more.
+        updated = WebhookEvent.objects.filter(id=head_id, status=WebhookEvent.STATUS_PENDING).update(
+            status=WebhookEvent.STATUS_PROCESSING,
+            locked_until=locked_until,
+        )
+        if not updated:
+            continue
+        rest = rest[:limit - len(claimed_ids) - 1]
+        if rest:
+            WebhookEvent.objects.filter(id__in=rest).update(
+                status=WebhookEvent.STATUS_PROCESSING,
+                locked_until=locked_until,
+            )
+        claimed_ids.extend([head_id, *rest])
+        if len(claimed_ids) >= limit:
+            break
+    return list(WebhookEvent.objects.filter(id__in=claimed_ids).order_by("id"))
+
+
+def process(event):
+    """
+    Processes claimed event. Returns True if processing succeeded.
+    """
+    try:
+        HANDLERS[event.kind](event.payload)
+    except Exception as ex:
+        fail(event, ex)
+        return False
+    event.delete()
+    return True
+
+
+def fail(event, error):
+    event.attempts += 1
+    event.last_error = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+    event.locked_until = None
+    if event.attempts >= get_option("max_attempts"):
+        event.status = WebhookEvent.STATUS_DEAD
+        logger.error("Webhook event %s failed %s times, giving up: %r", event.id, event.attempts, error)
+    else:
+        delay = min(get_option("retry_delay") * 2 ** (event.attempts - 1), get_option("max_retry_delay"))
+        event.status = WebhookEvent.STATUS_PENDING
+        event.available_at = timezone.now() + timedelta(seconds=delay)
+        logger.warning("Webhook event %s failed, retrying in %ss: %r", event.id, delay, error)
+    event.save(update_fields=["attempts", "last_error", "locked_until", "status", "available_at"])
+
+
+def process_batch(limit=10):
+    """
+    Claims and processes one batch of events. Returns number of processed events.
+    """
+    events = claim(limit)
+    count = len(events)
+
+    chat_payloads = [event.payload for event in events if event.kind == WebhookEvent.KIND_CHAT]
+    if len(chat_payloads) > 1:
+        prefetch_chat_visitors(chat_payloads)
+
+    new_messages = [event for event in events if is_new_message(event.kind, event.payload["action"])]
+    if new_messages:
+        try:
+            missing = ingest_messages([event.payload for event in new_messages])
+        except Exception:
+            logger.exception("Failed to ingest %s messages at once, processing them one by one", len(new_messages))
+        else:
+            failed = []
+            for event in new_messages:
+                if event.payload in missing:
+                    chat_id = event.payload["resource"]["chat_id"]
+                    fail(event, ChatConversation.DoesNotExist(f"Chat {chat_id} was not found"))
+                    failed.append(event)
+            WebhookEvent.objects.filter(id__in=[event.id for event in new_messages if event not in failed]).delete()
+            events = [event for event in events if event not in new_messages]
+
+    for event in events:
+        process(event)
+    return count
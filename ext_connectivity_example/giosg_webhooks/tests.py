@@ -1,3 +1,333 @@
-from django.test import TestCase
+import json
+import logging
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from benchmarks.fake_giosg import FakeGiosgServer
+from chat_app import caching
+from chat_app.models import ChatConversation, ChatMessage, PushEvent, Visitor
+
+from giosg_api import api
+from giosg_api.logs import log_payload
+
+from . import decoders, dedup, queue
+from .handlers import handle_chat_webhook, ingest_messages
+from .models import WebhookEvent
+from .queue import process_batch
+
+
+def message_webhook(**resource):
+    return {
+        "action": "added",
+        "resource_id": "message",
+        "channel": "/api/v5/orgs/org/owned_chats/chat/messages",
+        "resource": {
+            "type": "msg",
+            "chat_id": "chat",
+            "sender_type": "visitor",
+            "sender_id": "visitor",
+            "sender_name": None,
+            "message": "Hello",
+            "sender_avatar": {"id": "avatar"},
+            **resource,
+        },
+    }
+
+
+class WebhookDecoderTests(TestCase):
+
+    def test_only_used_fields_are_kept(self):
+        webhook = decoders.decode(json.dumps(message_webhook()), decoders.MessageWebhook)
+        self.assertEqual(webhook.to_payload(), {
+            "action": "added",
+            "resource_id": "message",
+            "channel": "/api/v5/orgs/org/owned_chats/chat/messages",
+            "resource": {
+                "type": "msg", "chat_id": "chat", "sender_type": "visitor", "sender_id": "visitor", "sender_name": None,
+                "message": "Hello",
+            },
+        })
+
+    def test_invalid_fields_are_reported(self):
+        payload = message_webhook(chat_id=None, sender_id=123, message="x" * 2049)
+        payload["channel"] = ""
+        del payload["resource"]["sender_type"]
+        with self.assertRaises(decoders.WebhookDecodeError) as context:
+            decoders.decode(json.dumps(payload), decoders.MessageWebhook)
+        self.assertEqual(set(context.exception.errors), {"channel", "resource"})
+        self.assertEqual(set(context.exception.errors["resource"]), {"chat_id", "sender_type", "sender_id", "message"})
+
+    def test_unknown_action_is_rejected(self):
+        with self.assertRaises(decoders.WebhookDecodeError) as context:
+            decoders.decode(json.dumps({**message_webhook(), "action": "created"}), decoders.MessageWebhook)
+        self.assertEqual(set(context.exception.errors), {"action"})
+
+    def test_resource_fields_are_optional_when_not_added(self):
+        payload = {"action": "removed", "resource_id": "chat", "channel": "/api/v5/orgs/org/owned_chats/chat",
+                   "resource": {}}
+        webhook = decoders.decode(json.dumps(payload), decoders.ChatWebhook)
+        self.assertIsNone(webhook.room_organization_id)
+
+
+class ChatEndedTests(TestCase):
+
+    def test_changed_webhook_ends_and_reopens_chat(self):
+        visitor = Visitor.objects.create(giosg_visitor_id="visitor", visitor_name="Visitor")
+        chat = ChatConversation.objects.create(giosg_chat_id="chat", visitor=visitor)
+        body = {"action": "changed", "resource_id": "chat", "channel": "/api/v5/orgs/org/owned_chats/chat",
+                "resource": {"is_ended": True}}
+
+        handle_chat_webhook(decoders.decode(json.dumps(body), decoders.ChatWebhook).to_payload())
+        chat.refresh_from_db()
+        self.assertIsNotNone(chat.ended_at)
+
+        body["resource"]["is_ended"] = False
+        handle_chat_webhook(decoders.decode(json.dumps(body), decoders.ChatWebhook).to_payload())
+        chat.refresh_from_db()
+        self.assertIsNone(chat.ended_at)
+
+    def test_is_ended_must_be_boolean(self):
+        body = {"action": "changed", "resource_id": "chat", "channel": "/api/v5/orgs/org/owned_chats/chat",
+                "resource": {"is_ended": "yes"}}
+        with self.assertRaises(decoders.WebhookDecodeError) as context:
+            decoders.decode(json.dumps(body), decoders.ChatWebhook)
+        self.assertEqual(context.exception.errors, {"resource": {"is_ended": ["Must be a valid boolean."]}})
+
+
+class ChatWebhookCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        caching.chat_ids.reset()
+        caching.visitor_ids.reset()
+        self.server = FakeGiosgServer().start()
+        self.addCleanup(self.server.stop)
+        settings_override = override_settings(GIOSG_API_BASE_URL=self.server.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def chat_webhook(self, action, chat_id):
+        body = {"action": action, "resource_id": chat_id, "channel": f"/api/v5/orgs/org/owned_chats/{chat_id}",
+                "resource": {"room_organization_id": "org"}}
+        return decoders.decode(json.dumps(body), decoders.ChatWebhook).to_payload()
+
+    def test_removed_chat_is_dropped_from_both_tiers(self):
+        visitor = Visitor.objects.create(giosg_visitor_id="visitor", visitor_name="Visitor")
+        ChatConversation.objects.create(giosg_chat_id="removed-chat", visitor=visitor)
+        caching.chat_ids.get("removed-chat")
+
+        handle_chat_webhook(self.chat_webhook("removed", "removed-chat"))
+        self.assertFalse(ChatConversation.objects.exists())
+        self.assertIsNone(caching.chat_ids.local.get("removed-chat"))
+        self.assertIsNone(cache.get(caching.chat_ids._shared_key("removed-chat")))
+
+    def test_chat_started_by_us_is_ingested_without_memberships_calls(self):
+        response = self.client.post("/api/chats/", {"visitor_name": "Started"}, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        giosg_chat_id = ChatConversation.objects.get(visitor__visitor_name="Started").giosg_chat_id
+
+        handle_chat_webhook(self.chat_webhook("added", giosg_chat_id))
+        self.assertEqual(ChatConversation.objects.filter(giosg_chat_id=giosg_chat_id).count(), 1)
+        self.assertEqual(self.server.state.request_counts["memberships"], 0)
+
+    def test_webhook_arriving_before_our_chat_is_stored_needs_no_memberships_calls(self):
+        giosg_visitor = api.create_giosg_visitor("org", "room")
+        visitor = Visitor.objects.create(giosg_visitor_id=giosg_visitor["visitor_id"], visitor_name="Early")
+        # Webhook of the chat is processed before the chat started below is stored
+        chat_data = api.create_new_chat_as_visitor(
+            "org", "room", visitor.giosg_visitor_id, giosg_visitor["access_token"],
+        )
+
+        handle_chat_webhook(self.chat_webhook("added", chat_data["id"]))
+        self.assertEqual(ChatConversation.objects.get(giosg_chat_id=chat_data["id"]).visitor, visitor)
+        self.assertEqual(self.server.state.request_counts["memberships"], 0)
+
+
+class WebhookViewTests(TestCase):
+
+    def setUp(self):
+        # Keys of queued webhooks outlive the test transactions
+        dedup.get_local_cache().clear()
+
+    def test_valid_webhook_is_queued(self):
+        response = self.client.post("/giosg_webhooks/messages", message_webhook(), content_type="application/json")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(WebhookEvent.objects.get().payload["resource"]["chat_id"], "chat")
+
+    def test_queued_message_is_stored(self):
+        visitor = Visitor.objects.create(giosg_visitor_id="visitor", visitor_name="Visitor")
+        # Other tests leave their chat IDs to the shared cache
+        ChatConversation.objects.create(giosg_chat_id="queued-chat", visitor=visitor)
+        self.client.post(
+            "/giosg_webhooks/messages", message_webhook(chat_id="queued-chat"), content_type="application/json",
+        )
+        self.assertEqual(process_batch(), 1)
+        self.assertEqual(ChatMessage.objects.get().message, "Hello")
+
+    def test_url_is_built_only_when_payloads_are_logged(self):
+        logger = logging.getLogger("giosg_webhooks.views")
+        built = []
+        self.assertFalse(logger.isEnabledFor(logging.DEBUG))
+        log_payload(logger, "received webhook", lambda: built.append("url"), b"{}")
+        self.assertEqual(built, [])
+
+        with self.assertLogs(logger, logging.DEBUG) as logs:
+            self.client.post("/giosg_webhooks/messages", message_webhook(), content_type="application/json")
+        self.assertEqual(logs.records[0].getMessage(), "RECEIVED WEBHOOK http://testserver/giosg_webhooks/messages")
+
+    def test_invalid_batch_is_rejected(self):
+        response = self.client.post(
+            "/giosg_webhooks/messages/batch", [message_webhook(), {"action": "added"}], content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()[0], {})
+        self.assertFalse(WebhookEvent.objects.exists())
+
+
+class WebhookDedupTests(TestCase):
+
+    def setUp(self):
+        dedup.stats.reset()
+        dedup.get_local_cache().clear()
+
+    def post(self, payload):
+        return self.client.post("/giosg_webhooks/messages", payload, content_type="application/json")
+
+    def test_retries_are_queued_once(self):
+        for _ in range(3):
+            self.assertEqual(self.post(message_webhook()).status_code, 204)
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+        self.assertEqual(dedup.stats.snapshot()["local_duplicates"], 2)
+
+    def test_database_catches_retries_seen_by_another_process(self):
+        self.post(message_webhook())
+        dedup.get_local_cache().clear()
+        self.post(message_webhook())
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+        self.assertEqual(dedup.stats.snapshot(), {
+            "received": 2, "local_duplicates": 0, "db_duplicates": 1, "dedup_rate": 0.5,
+        })
+
+    def test_changed_webhooks_are_not_deduplicated(self):
+        for _ in range(2):
+            self.post({**message_webhook(), "action": "changed"})
+        self.assertEqual(WebhookEvent.objects.count(), 2)
+
+
+class WebhookQueueTests(TestCase):
+
+    def enqueue_message(self, chat_id, action="added", message_id="message"):
+        payload = {**message_webhook(chat_id=chat_id), "action": action, "resource_id": message_id}
+        return queue.enqueue(WebhookEvent.KIND_MESSAGE, payload)
+
+    def enqueue_chat(self, chat_id):
+        return queue.enqueue(WebhookEvent.KIND_CHAT, {
+            "action": "changed", "resource_id": chat_id, "channel": f"/api/v5/orgs/org/owned_chats/{chat_id}",
+            "resource": {"is_ended": True},
+        })
+
+    def claimed_ids(self, limit=10):
+        return [event.id for event in queue.claim(limit)]
+
+    def test_only_head_of_each_chat_is_claimed(self):
+        first = self.enqueue_chat("first")
+        first_message = self.enqueue_message("first")
+        second = [self.enqueue_message("second") for _ in range(2)]
+        second_changed = self.enqueue_message("second", action="changed")
+
+        # New messages directly after the head are claimed together with it
+        self.assertEqual(self.claimed_ids(), [first.id, *[event.id for event in second]])
+        # Nothing can be claimed until the heads are processed
+        self.assertEqual(self.claimed_ids(), [])
+
+        first.delete()
+        self.assertEqual(self.claimed_ids(), [first_message.id])
+        WebhookEvent.objects.filter(id__in=[event.id for event in second]).delete()
+        self.assertEqual(self.claimed_ids(), [second_changed.id])
+
+    def test_chats_are_processed_in_received_order(self):
+        visitor = Visitor.objects.create(giosg_visitor_id="queue-visitor", visitor_name="Visitor")
+        ChatConversation.objects.create(giosg_chat_id="queue-chat", visitor=visitor)
+        self.enqueue_message("queue-chat", message_id="first")
+        self.enqueue_chat("queue-chat")
+        self.enqueue_message("queue-chat", message_id="second")
+
+        # The "changed" webhook ends the run of new messages
+        self.assertEqual(process_batch(), 1)
+        self.assertIsNone(ChatConversation.objects.get().ended_at)
+        self.assertEqual(process_batch(), 1)
+        self.assertIsNotNone(ChatConversation.objects.get().ended_at)
+        self.assertEqual(process_batch(), 1)
+        self.assertEqual(ChatMessage.objects.count(), 2)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_expired_lease_is_reclaimed(self):
+        event = self.enqueue_chat("chat")
+        self.assertEqual(self.claimed_ids(), [event.id])
+        self.assertEqual(self.claimed_ids(), [])
+
+        WebhookEvent.objects.filter(id=event.id).update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.claimed_ids(), [event.id])
+        self.assertEqual(WebhookEvent.objects.get().status, WebhookEvent.STATUS_PROCESSING)
+
+    @override_settings(GIOSG_WEBHOOK_QUEUE={"retry_delay": 2, "max_retry_delay": 5})
+    def test_failed_event_is_retried_with_backoff(self):
+        event = self.enqueue_chat("chat")
+        following = self.enqueue_message("chat")
+
+        for attempt, delay in [(1, 2), (2, 4), (3, 5)]:
+            WebhookEvent.objects.filter(id=event.id).update(available_at=timezone.now())
+            [claimed] = queue.claim()
+            before = timezone.now()
+            queue.fail(claimed, ValueError("Giosg is down"))
+            claimed.refresh_from_db()
+            self.assertEqual(claimed.status, WebhookEvent.STATUS_PENDING)
+            self.assertEqual(claimed.attempts, attempt)
+            self.assertIn("Giosg is down", claimed.last_error)
+            self.assertAlmostEqual((claimed.available_at - before).total_seconds(), delay, delta=1)
+            # Later events of the chat wait for the failed one
+            self.assertEqual(self.claimed_ids(), [])
+        self.assertEqual(WebhookEvent.objects.get(id=following.id).status, WebhookEvent.STATUS_PENDING)
+
+    @override_settings(GIOSG_WEBHOOK_QUEUE={"max_attempts": 2, "retry_delay": 0})
+    def test_event_is_dead_after_max_attempts(self):
+        event = self.enqueue_chat("chat")
+        following = self.enqueue_message("chat")
+
+        for status in [WebhookEvent.STATUS_PENDING, WebhookEvent.STATUS_DEAD]:
+            [claimed] = queue.claim()
+            self.assertEqual(claimed.id, event.id)
+            queue.fail(claimed, ValueError("Broken webhook"))
+            self.assertEqual(WebhookEvent.objects.get(id=event.id).status, status)
+
+        # Dead events no longer hold back the chat
+        self.assertEqual(self.claimed_ids(), [following.id])
+
+
+class IngestMessagesTests(TestCase):
+
+    def test_only_inserted_messages_are_published(self):
+        visitor = Visitor.objects.create(giosg_visitor_id="ingest-visitor", visitor_name="Visitor")
+        chat = ChatConversation.objects.create(giosg_chat_id="ingest-chat", visitor=visitor)
+        PushEvent.objects.all().delete()
+        payloads = [
+            {**message_webhook(chat_id="ingest-chat"), "resource_id": message_id} for message_id in ["first", "second"]
+        ]
+        bulk_create = ChatMessage.objects.bulk_create
+
+        def insert_concurrently(messages, **kwargs):
+            # Another worker stores the same webhook between our duplicate check and insert
+            ChatMessage.objects.create(giosg_message_id="second", chat=chat, sender_id="visitor", message="Hello")
+            return bulk_create(messages, **kwargs)
+
+        with mock.patch.object(ChatMessage.objects, "bulk_create", insert_concurrently):
+            self.assertEqual(ingest_messages(payloads), [])
+
+        self.assertEqual(ChatMessage.objects.count(), 2)
+        [event] = PushEvent.objects.filter(kind=PushEvent.KIND_MESSAGE)
+        self.assertEqual(event.payload["giosg_message_id"], "first")
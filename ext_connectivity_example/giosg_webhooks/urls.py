@@ -1,8 +1,10 @@
 from django.urls import path
-from .views import GiosgChatWebhookView, GiosgChatMessageWebhookView
+from .views import GiosgChatWebhookView, GiosgChatMessageWebhookView, GiosgChatMessageBatchWebhookView
 
 
 urlpatterns = [
     path('giosg_webhooks/chats', GiosgChatWebhookView.as_view(), name='giosg_chat_webhook'),
     path('giosg_webhooks/messages', GiosgChatMessageWebhookView.as_view(), name='giosg_message_webhook'),
+    path('giosg_webhooks/messages/batch', GiosgChatMessageBatchWebhookView.as_view(),
+         name='giosg_message_batch_webhook'),
 ]
@@ -1,13 +1,17 @@
+import logging
+
 from rest_framework.views import APIView
 from rest_framework import status
 from rest_framework.response import Response
 
-from . import serializers
+from . import decoders, dedup
+
+from .models import WebhookEvent
 
-from chat_app.models import ChatConversation, ChatMessage, Visitor
+from ext_connectivity_example.instrumentation import span
+from giosg_api.logs import log_payload
 
-from giosg_api import api
-from giosg_api.utils import pretty_print_response
+logger = logging.getLogger(__name__)
 
 
 class GiosgChatWebhookView(APIView):
@@ -27,52 +31,23 @@ class GiosgChatWebhookView(APIView):
         """
         Handle chat webhook from Giosg platform
         """
-        # Printing to Django console for debug reasons
-        pretty_print_response("received webhook", request.build_absolute_uri(), request.body)
-
-        serializer = serializers.ChatWebhookSerializer(data=request.data)
-        if not serializer.is_valid():
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        else:
-            # We received chat state change webhook from Giosg.
-            payload = serializer.validated_data
-            resource_id = payload["resource_id"]
-
-            if payload["action"] == "added":
-                # If the action was "added" we need to create a new chat to
-                # our third-party system.
-                org_id = payload["resource"]["room_organization_id"]
-                visitor_id = api.get_visitor_id(org_id, resource_id)
-
-                try:
-                    visitor = Visitor.objects.get(giosg_visitor_id=visitor_id)
-                    chat, _ = ChatConversation.objects.get_or_create(
-                        giosg_chat_id=resource_id,
-                        visitor=visitor,
-                    )
-                    print("Created", chat)
-                except Visitor.DoesNotExist:
-                    print("Visitor was not found so chat was not started by our app and we skip it")
-            elif payload["action"] == "changed":
-                # We dont care about changes at the moment but we could do something
-                # with the changed information. One example could be to "end" the conversation when it
-                # ends on Giosg platform.
-                pass
-            elif payload["action"] == "removed":
-                # If the action was "removed" we can delete the chat from
-                # our third-party chat system also. This could happen for example if data was asked to be
-                # purged because of a GDPR reasons.
-                try:
-                    chat = ChatConversation.objects.get(giosg_chat_id=resource_id)
-                    chat.delete()
-                    print("Deleted", chat)
-                except ChatConversation.DoesNotExist:
-                    pass
-
-            # We just return the data that we got in webhook payload.
-            # We should respond with status code 2xx but the content could be empty.
-            # This just helps debugging the webhooks.
-            return Response(payload, status=status.HTTP_200_OK)
+        # Body is decoded only if DEBUG logging is enabled and the record is sampled
+        log_payload(logger, "received webhook", request.build_absolute_uri, request.body)
+
+        try:
+            # Retries of webhooks we have already queued are dropped before validating them
+            with span("decode"):
+                webhook = decoders.decode(request.body, decoders.ChatWebhook, skip=dedup.is_duplicate)
+        except decoders.WebhookDecodeError as error:
+            return Response(error.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # We received chat state change webhook from Giosg. It is only stored to the queue here
+        # and processed by "process_webhooks" workers, see giosg_webhooks/handlers.py
+        if webhook is not None:
+            dedup.enqueue_new(WebhookEvent.KIND_CHAT, [webhook])
+
+        # We should respond with status code 2xx but the content could be empty.
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class GiosgChatMessageWebhookView(APIView):
@@ -92,50 +67,52 @@ class GiosgChatMessageWebhookView(APIView):
         """
         Handle message webhook from Giosg platform
         """
-        # Printing to Django console for debug reasons
-        pretty_print_response("received webhook", request.build_absolute_uri(), request.body)
-
-        serializer = serializers.MessageWebhookSerializer(data=request.data)
-        if not serializer.is_valid():
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        else:
-            # We received chat message webhook from Giosg.
-            payload = serializer.validated_data
-            resource_id = payload["resource_id"]
-            resource = payload["resource"]
-
-            if payload["action"] == "added":
-                # If the action was "added" we need to create a new message to
-                # our third-party system.
-                if resource["type"] == "msg":
-                    # We ignore all other kinds of messages like join and leave notifications
-                    # and care only about text content
-                    # We could also use sender_public_name if we wish
-                    sender_name = "Visitor" if resource["sender_type"] == "visitor" and resource["sender_name"] is None else resource["sender_name"]
-                    message = ChatMessage.objects.create(
-                        giosg_message_id=resource_id,
-                        chat=ChatConversation.objects.get(giosg_chat_id=resource["chat_id"]),
-                        sender_id=resource["sender_id"],
-                        sender_name=sender_name,
-                        message=resource["message"],
-                    )
-
-                    print("Created", message)
-            elif payload["action"] == "changed":
-                # We dont care about changes at the moment but we could do something
-                # with the changed information
-                pass
-            elif payload["action"] == "removed":
-                # If the action was "removed" we can delete the message from
-                # our third-party chat system also.
-                try:
-                    message = ChatMessage.objects.get(giosg_id=resource_id)
-                    message.delete()
-                    print("Deleted", message)
-                except ChatMessage.DoesNotExist:
-                    pass
-
-            # We just return the data that we got in webhook payload.
-            # We should respond with status code 2xx but the content could be empty.
-            # This just helps debugging the webhooks.
-            return Response(payload, status=status.HTTP_200_OK)
+        # Body is decoded only if DEBUG logging is enabled and the record is sampled
+        log_payload(logger, "received webhook", request.build_absolute_uri, request.body)
+
+        try:
+            # Retries of webhooks we have already queued are dropped before validating them
+            with span("decode"):
+                webhook = decoders.decode(request.body, decoders.MessageWebhook, skip=dedup.is_duplicate)
+        except decoders.WebhookDecodeError as error:
+            return Response(error.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # We received chat message webhook from Giosg. It is only stored to the queue here
+        # and processed by "process_webhooks" workers, see giosg_webhooks/handlers.py
+        if webhook is not None:
+            dedup.enqueue_new(WebhookEvent.KIND_MESSAGE, [webhook])
+
+        # We should respond with status code 2xx but the content could be empty.
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class GiosgChatMessageBatchWebhookView(APIView):
+    """
+    API for receiving many message webhook payloads at once, for example when replaying
+    missed webhooks. Body must be a list of message webhook payloads.
+
+    GET/POST /giosg_webhooks/messages/batch
+    """
+    allowed_methods = ["POST", "GET"]
+
+    def get(self, request, format=None):
+        return Response({
+            "detail": "Only POST requests supported. This endpoint expects a list of message webhook payloads"
+        }, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    def post(self, request, *args, **kwargs):
+        """
+        Handle list of message webhooks
+        """
+        # Body is decoded only if DEBUG logging is enabled and the record is sampled
+        log_payload(logger, "received webhook", request.build_absolute_uri, request.body)
+
+        try:
+            with span("decode"):
+                webhooks = decoders.decode(request.body, decoders.MessageWebhook, many=True, skip=dedup.is_duplicate)
+        except decoders.WebhookDecodeError as error:
+            return Response(error.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # All webhooks are stored to the queue with one insert
+        dedup.enqueue_new(WebhookEvent.KIND_MESSAGE, webhooks)
+        return Response(status=status.HTTP_204_NO_CONTENT)